@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from core.utils.profiling import get_profiling_config, make_profile_token
+
+
+class Command(BaseCommand):
+    help = "生成请求剖析令牌（放入请求头即剖析该请求，结果在 /profiles/ 查看）"
+
+    def handle(self, *args, **options):
+        config = get_profiling_config()
+        token = make_profile_token()
+        self.stdout.write(token)
+        self.stderr.write(f"用法：curl -H '{config['HEADER']}: {token}' ...（{config['TOKEN_MAX_AGE']} 秒内有效）")
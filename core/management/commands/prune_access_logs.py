@@ -0,0 +1,59 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.utils.retention import purge_access_logs, purge_aggregates
+
+
+class Command(BaseCommand):
+    help = "分批清理过期访问日志（按主键分批删除并限速，或删除过期的按天分区）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="保留最近多少天的原始日志（默认30）")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="每批删除行数（默认5000）")
+        parser.add_argument('--pause', type=float, default=0.1, help="批间暂停秒数（默认0.1）")
+        parser.add_argument('--time-budget', type=float, default=None, help="最长运行秒数，到时停止，剩余留到下次")
+        parser.add_argument('--aggregate-days', type=int, default=None,
+                            help="同时清理早于该天数的分钟级汇总与耗时直方图（默认不清理）")
+        parser.add_argument('--include-unrolled', action='store_true', help="连同尚未汇总的日志一起删除")
+        parser.add_argument('--dry-run', action='store_true', help="只统计将删除的行数，不实际删除")
+
+    def handle(self, *args, **options):
+        progress = self.stdout.write
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        self.stdout.write(f"清理 {cutoff:%Y-%m-%d %H:%M:%S} 之前的访问日志...")
+
+        result = purge_access_logs(
+            cutoff,
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+            time_budget=options['time_budget'],
+            keep_unrolled=not options['include_unrolled'],
+            dry_run=options['dry_run'],
+            progress=progress,
+        )
+        self._report('access_logs', result)
+
+        if options['aggregate_days'] is not None:
+            remaining = None
+            if options['time_budget'] is not None:
+                remaining = max(options['time_budget'] - result['elapsed'], 0)
+            aggregate_cutoff = timezone.now() - timedelta(days=options['aggregate_days'])
+            for table, table_result in purge_aggregates(
+                    aggregate_cutoff,
+                    chunk_size=options['chunk_size'],
+                    pause=options['pause'],
+                    time_budget=remaining,
+                    dry_run=options['dry_run'],
+                    progress=progress,
+            ).items():
+                self._report(table, table_result)
+
+    def _report(self, table, result):
+        if result.get('skipped'):
+            self.stdout.write(self.style.WARNING(f"{table}：跳过（{result['skipped']}）"))
+            return
+        status = "已完成" if result['finished'] else "时间预算用尽，未删完"
+        style = self.style.SUCCESS if result['finished'] else self.style.WARNING
+        self.stdout.write(style(
+            f"{table}：删除 {result['deleted']} 行，{result['chunks']} 批，耗时 {result['elapsed']} 秒（{status}）"
+        ))
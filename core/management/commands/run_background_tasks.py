@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from core.utils.scheduler import background_tasks
+
+# 导入注册周期任务的模块（任务在模块导入时注册到background_tasks）
+import core.utils.rollup  # noqa: F401
+import core.utils.idempotency  # noqa: F401
+import core.utils.recommendations  # noqa: F401
+
+
+class Command(BaseCommand):
+    help = "在前台运行后台周期任务（汇总、过期幂等键清理、推荐重建等），用于Web进程关闭BACKGROUND_TASKS的部署"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="每个任务立即执行一次后退出")
+        parser.add_argument('--task', action='append', dest='tasks', default=None,
+                            help="只运行指定任务（函数名，可重复指定）")
+
+    def handle(self, *args, **options):
+        tasks = background_tasks.tasks()
+        names = options['tasks']
+        unknown = sorted(set(names or ()) - {task.name for task in tasks})
+        if unknown:
+            self.stderr.write(self.style.ERROR(f"未知任务：{', '.join(unknown)}（可选：{', '.join(t.name for t in tasks)}）"))
+            return
+        self.stdout.write(f"周期任务：{', '.join(f'{t.name}（{t.interval:g}秒）' for t in tasks if not names or t.name in names)}")
+
+        if options['once']:
+            background_tasks.run_pending(force=True, names=names)
+            return
+        try:
+            while True:
+                time.sleep(min(background_tasks.run_pending(names=names), 1.0))
+        except KeyboardInterrupt:
+            self.stdout.write("已停止")
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesslog',
+            name='db_query_count',
+            field=models.IntegerField(default=0, verbose_name='数据库查询次数'),
+        ),
+        migrations.AddField(
+            model_name='accesslog',
+            name='db_time',
+            field=models.FloatField(default=0, verbose_name='数据库耗时（秒）'),
+        ),
+        migrations.AddField(
+            model_name='accesslog',
+            name='error_class',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='异常类型'),
+        ),
+        migrations.AddField(
+            model_name='accesslog',
+            name='response_size',
+            field=models.IntegerField(blank=True, null=True, verbose_name='响应大小（字节）'),
+        ),
+        migrations.AddField(
+            model_name='accesslog',
+            name='status_code',
+            field=models.SmallIntegerField(blank=True, null=True, verbose_name='响应状态码'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_access_log_request_details'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatencyHistogram',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, verbose_name='访问路径')),
+                ('window_start', models.DateTimeField(verbose_name='窗口开始时间')),
+                ('window_seconds', models.IntegerField(verbose_name='窗口长度（秒）')),
+                ('worker', models.CharField(max_length=64, verbose_name='工作进程（主机:PID）')),
+                ('count', models.BigIntegerField(default=0, verbose_name='请求数')),
+                ('total_us', models.BigIntegerField(default=0, verbose_name='耗时合计（微秒）')),
+                ('max_us', models.BigIntegerField(default=0, verbose_name='最大耗时（微秒）')),
+                ('buckets', models.TextField(verbose_name='桶计数（JSON）')),
+            ],
+            options={
+                'verbose_name': '耗时直方图',
+                'verbose_name_plural': '耗时直方图',
+                'db_table': 'latency_histogram',
+                'indexes': [models.Index(fields=['window_start', 'path'], name='idx_hist_window')],
+                'constraints': [models.UniqueConstraint(fields=('path', 'window_start', 'worker'), name='uk_hist_path_window_worker')],
+            },
+        ),
+    ]
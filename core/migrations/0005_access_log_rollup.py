@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_latency_histogram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='汇总任务名')),
+                ('last_log_id', models.BigIntegerField(default=0, verbose_name='已汇总的最大日志ID')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '汇总进度',
+                'verbose_name_plural': '汇总进度',
+                'db_table': 'rollup_state',
+            },
+        ),
+        migrations.CreateModel(
+            name='AccessLogRollup',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.IntegerField(verbose_name='粒度（秒）')),
+                ('bucket_start', models.DateTimeField(verbose_name='时间桶开始时间')),
+                ('path', models.CharField(max_length=255, verbose_name='访问路径')),
+                ('count', models.BigIntegerField(default=0, verbose_name='请求数')),
+                ('error_count', models.BigIntegerField(default=0, verbose_name='错误数')),
+                ('sum_duration', models.FloatField(default=0, verbose_name='耗时合计（秒）')),
+                ('max_duration', models.FloatField(default=0, verbose_name='最大耗时（秒）')),
+                ('min_duration', models.FloatField(blank=True, null=True, verbose_name='最小耗时（秒）')),
+                ('sum_db_time', models.FloatField(default=0, verbose_name='数据库耗时合计（秒）')),
+                ('sum_db_queries', models.BigIntegerField(default=0, verbose_name='数据库查询次数合计')),
+                ('buckets', models.TextField(default='{}', verbose_name='耗时直方图桶计数（JSON）')),
+            ],
+            options={
+                'verbose_name': '访问日志汇总',
+                'verbose_name_plural': '访问日志汇总',
+                'db_table': 'access_log_rollup',
+                'constraints': [models.UniqueConstraint(fields=('resolution', 'bucket_start', 'path'), name='uk_rollup_bucket_path')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_access_log_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesslog',
+            name='sample_weight',
+            field=models.IntegerField(default=1, verbose_name='采样权重'),
+        ),
+    ]
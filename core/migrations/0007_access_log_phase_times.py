@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_access_log_sample_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesslog',
+            name='connect_time',
+            field=models.FloatField(default=0, verbose_name='数据库连接耗时（秒）'),
+        ),
+        migrations.AddField(
+            model_name='accesslog',
+            name='render_time',
+            field=models.FloatField(default=0, verbose_name='模板渲染耗时（秒）'),
+        ),
+        migrations.AddField(
+            model_name='accesslogrollup',
+            name='sum_connect_time',
+            field=models.FloatField(default=0, verbose_name='数据库连接耗时合计（秒）'),
+        ),
+        migrations.AddField(
+            model_name='accesslogrollup',
+            name='sum_render_time',
+            field=models.FloatField(default=0, verbose_name='模板渲染耗时合计（秒）'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_access_log_phase_times'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataversion',
+            name='update_time',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最后递增时间'),
+        ),
+    ]
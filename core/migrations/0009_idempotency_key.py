@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_data_version_update_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=64, verbose_name='作用域（接口:用户ID）')),
+                ('idem_key', models.CharField(max_length=128, verbose_name='幂等键（Idempotency-Key请求头）')),
+                ('request_hash', models.CharField(max_length=64, verbose_name='请求参数摘要')),
+                ('result', models.TextField(blank=True, null=True, verbose_name='执行结果（JSON）')),
+                ('create_time', models.DateTimeField(verbose_name='创建时间')),
+                ('expire_time', models.DateTimeField(verbose_name='过期时间')),
+            ],
+            options={
+                'verbose_name': '幂等键',
+                'verbose_name_plural': '幂等键',
+                'db_table': 'idempotency_key',
+                'indexes': [models.Index(fields=['expire_time'], name='idx_idem_expire')],
+                'constraints': [models.UniqueConstraint(fields=('scope', 'idem_key'), name='uk_idem_scope_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:47
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesslog',
+            name='inserted_at',
+            field=models.DateTimeField(db_default=django.db.models.functions.datetime.Now(), verbose_name='写入时间'),
+        ),
+        migrations.AddField(
+            model_name='accesslog',
+            name='route',
+            field=models.CharField(blank=True, max_length=200, null=True, verbose_name='路由模板'),
+        ),
+    ]
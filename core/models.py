@@ -1,5 +1,6 @@
 # core/models.py
 from django.db import models
+from django.db.models.functions import Now
 from django.contrib.auth.models import User
 
 
@@ -153,10 +154,21 @@ class AccessLog(models.Model):
         verbose_name="访问用户"
     )
     path = models.CharField(max_length=255, verbose_name="访问路径")
+    route = models.CharField(max_length=200, null=True, blank=True, verbose_name="路由模板")  # 如 customer/<int:customer_id>/
     start_time = models.DateTimeField(verbose_name="开始时间")
     end_time = models.DateTimeField(verbose_name="结束时间")
     duration = models.FloatField(verbose_name="访问耗时（秒）")
     ip = models.CharField(max_length=50, verbose_name="访问IP")
+    status_code = models.SmallIntegerField(null=True, blank=True, verbose_name="响应状态码")
+    error_class = models.CharField(max_length=100, null=True, blank=True, verbose_name="异常类型")
+    response_size = models.IntegerField(null=True, blank=True, verbose_name="响应大小（字节）")
+    db_query_count = models.IntegerField(default=0, verbose_name="数据库查询次数")
+    db_time = models.FloatField(default=0, verbose_name="数据库耗时（秒）")
+    connect_time = models.FloatField(default=0, verbose_name="数据库连接耗时（秒）")  # 已含在db_time中
+    render_time = models.FloatField(default=0, verbose_name="模板渲染耗时（秒）")
+    sample_weight = models.IntegerField(default=1, verbose_name="采样权重")  # 1/N采样时为N，代表的真实请求数
+    # 写入时间取数据库时钟（不是请求结束时间）：汇总按它判断日志是否已稳定提交，写入线程积压时也不会跳过较小ID
+    inserted_at = models.DateTimeField(db_default=Now(), verbose_name="写入时间")
 
     class Meta:
         db_table = "access_logs"  # 不变
@@ -165,4 +177,111 @@ class AccessLog(models.Model):
         indexes = [models.Index(fields=["user", "start_time"], name="idx_log_user")]
 
     def __str__(self):
-        return f"{self.user.username if self.user else '匿名用户'} - {self.path}（{self.duration}s）"
\ No newline at end of file
+        return f"{self.user.username if self.user else '匿名用户'} - {self.path}（{self.duration}s）"
+
+
+class DataVersion(models.Model):
+    """数据版本表（写操作递增版本号，进程内缓存据此惰性失效；键为表名或单个实体，如 customer:12）"""
+    table_name = models.CharField(max_length=64, primary_key=True, verbose_name="表名")
+    version = models.BigIntegerField(default=0, verbose_name="版本号")
+    update_time = models.DateTimeField(null=True, blank=True, verbose_name="最后递增时间")  # 条件GET的Last-Modified
+
+    class Meta:
+        db_table = "data_version"
+        verbose_name = "数据版本"
+        verbose_name_plural = "数据版本"
+
+    def __str__(self):
+        return f"{self.table_name}（v{self.version}）"
+
+
+class LatencyHistogram(models.Model):
+    """访问耗时直方图（每个工作进程按路径、时间窗口各一行，查询时合并）"""
+    id = models.BigAutoField(primary_key=True, verbose_name="ID")
+    path = models.CharField(max_length=255, verbose_name="访问路径")  # 存路由模板，与汇总表一致
+    window_start = models.DateTimeField(verbose_name="窗口开始时间")
+    window_seconds = models.IntegerField(verbose_name="窗口长度（秒）")
+    worker = models.CharField(max_length=64, verbose_name="工作进程（主机:PID）")
+    count = models.BigIntegerField(default=0, verbose_name="请求数")
+    total_us = models.BigIntegerField(default=0, verbose_name="耗时合计（微秒）")
+    max_us = models.BigIntegerField(default=0, verbose_name="最大耗时（微秒）")
+    buckets = models.TextField(verbose_name="桶计数（JSON）")
+
+    class Meta:
+        db_table = "latency_histogram"
+        verbose_name = "耗时直方图"
+        verbose_name_plural = "耗时直方图"
+        constraints = [
+            models.UniqueConstraint(fields=["path", "window_start", "worker"], name="uk_hist_path_window_worker")
+        ]
+        indexes = [models.Index(fields=["window_start", "path"], name="idx_hist_window")]
+
+    def __str__(self):
+        return f"{self.path} @ {self.window_start}（{self.count}次）"
+
+
+class AccessLogRollup(models.Model):
+    """访问日志汇总表（按分钟/小时、路径预聚合，供统计与看板查询）"""
+    id = models.BigAutoField(primary_key=True, verbose_name="ID")
+    resolution = models.IntegerField(verbose_name="粒度（秒）")  # 60=分钟，3600=小时
+    bucket_start = models.DateTimeField(verbose_name="时间桶开始时间")
+    path = models.CharField(max_length=255, verbose_name="访问路径")  # 存路由模板（按ID区分的URL合为一行），旧日志无路由时为访问路径
+    count = models.BigIntegerField(default=0, verbose_name="请求数")
+    error_count = models.BigIntegerField(default=0, verbose_name="错误数")
+    sum_duration = models.FloatField(default=0, verbose_name="耗时合计（秒）")
+    max_duration = models.FloatField(default=0, verbose_name="最大耗时（秒）")
+    min_duration = models.FloatField(null=True, blank=True, verbose_name="最小耗时（秒）")
+    sum_db_time = models.FloatField(default=0, verbose_name="数据库耗时合计（秒）")
+    sum_db_queries = models.BigIntegerField(default=0, verbose_name="数据库查询次数合计")
+    sum_connect_time = models.FloatField(default=0, verbose_name="数据库连接耗时合计（秒）")  # 已含在sum_db_time中
+    sum_render_time = models.FloatField(default=0, verbose_name="模板渲染耗时合计（秒）")
+    buckets = models.TextField(default='{}', verbose_name="耗时直方图桶计数（JSON）")
+
+    class Meta:
+        db_table = "access_log_rollup"
+        verbose_name = "访问日志汇总"
+        verbose_name_plural = "访问日志汇总"
+        constraints = [
+            models.UniqueConstraint(fields=["resolution", "bucket_start", "path"], name="uk_rollup_bucket_path")
+        ]
+
+    def __str__(self):
+        return f"{self.path} @ {self.bucket_start}（{self.resolution}s，{self.count}次）"
+
+
+class RollupState(models.Model):
+    """汇总进度（高水位：已汇总的最大日志ID）"""
+    name = models.CharField(max_length=64, primary_key=True, verbose_name="汇总任务名")
+    last_log_id = models.BigIntegerField(default=0, verbose_name="已汇总的最大日志ID")
+    update_time = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+
+    class Meta:
+        db_table = "rollup_state"
+        verbose_name = "汇总进度"
+        verbose_name_plural = "汇总进度"
+
+    def __str__(self):
+        return f"{self.name}：{self.last_log_id}"
+
+
+class IdempotencyKey(models.Model):
+    """幂等键（客户端重试时直接返回首次执行的结果；与业务写入同一事务提交，回滚则不保留）"""
+    id = models.BigAutoField(primary_key=True, verbose_name="ID")
+    scope = models.CharField(max_length=64, verbose_name="作用域（接口:用户ID）")
+    idem_key = models.CharField(max_length=128, verbose_name="幂等键（Idempotency-Key请求头）")
+    request_hash = models.CharField(max_length=64, verbose_name="请求参数摘要")  # 同一键配不同参数时拒绝
+    result = models.TextField(null=True, blank=True, verbose_name="执行结果（JSON）")
+    create_time = models.DateTimeField(verbose_name="创建时间")
+    expire_time = models.DateTimeField(verbose_name="过期时间")
+
+    class Meta:
+        db_table = "idempotency_key"
+        verbose_name = "幂等键"
+        verbose_name_plural = "幂等键"
+        constraints = [
+            models.UniqueConstraint(fields=["scope", "idem_key"], name="uk_idem_scope_key")
+        ]
+        indexes = [models.Index(fields=["expire_time"], name="idx_idem_expire")]
+
+    def __str__(self):
+        return f"{self.scope} {self.idem_key}"
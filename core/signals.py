@@ -0,0 +1,69 @@
+import threading
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from core.models import Product, Category, ProductCategory, Customer, Order, OrderItem
+from core.utils.versions import bump_version
+
+# 同一事务内待递增的版本键（按最外层atomic块区分），逐行信号合并为提交后的一次递增
+_pending = threading.local()
+
+
+def _bump_on_commit(*tables: str) -> None:
+    """ORM事务提交后再递增版本号，避免缓存在提交前读到旧数据"""
+    conn = transaction.get_connection()
+    if not conn.in_atomic_block:
+        bump_version(*tables)
+        return
+    block = conn.atomic_blocks[0]
+    if getattr(_pending, 'block', None) is not block:
+        _pending.block, _pending.keys = block, set()  # 新事务（回滚的事务留下的键随之丢弃）
+    _pending.keys.update(tables)
+    pending = _pending.keys
+    # 每次都登记回调（savepoint回滚只丢弃其中登记的回调），第一个执行的回调递增全部键，其余为空操作
+    transaction.on_commit(lambda: _flush(pending))
+
+
+def _flush(pending: set) -> None:
+    tables = sorted(pending)
+    pending.clear()
+    if tables:
+        bump_version(*tables)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, **kwargs):
+    _bump_on_commit('product')
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, **kwargs):
+    _bump_on_commit('category')
+
+
+@receiver([post_save, post_delete], sender=ProductCategory)
+def product_category_changed(sender, **kwargs):
+    _bump_on_commit('product_category')
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_categories_m2m_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _bump_on_commit('product_category')
+
+
+# 订单/客户的ORM写入（数据生成脚本、清理脚本、admin）同样递增版本号，与pymysql工具函数保持一致，
+# 否则订单/客户分块缓存、customer_detail的ETag与销售分析快照都不会失效
+@receiver([post_save, post_delete], sender=Order)
+def order_changed(sender, instance, **kwargs):
+    _bump_on_commit('shop_order', f'customer:{instance.customer_id}')
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def order_item_changed(sender, **kwargs):
+    _bump_on_commit('shop_order_item')
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def customer_changed(sender, instance, **kwargs):
+    _bump_on_commit('customer', f'customer:{instance.pk}')
@@ -102,10 +102,20 @@ CREATE TABLE `access_logs` (
   `log_id` INT NOT NULL AUTO_INCREMENT COMMENT '日志ID',
   `user_id` INT NULL COMMENT '访问用户',
   `path` VARCHAR(255) NOT NULL COMMENT '访问路径',
+  `route` VARCHAR(200) NULL COMMENT '路由模板',
   `start_time` DATETIME(6) NOT NULL COMMENT '开始时间',
   `end_time` DATETIME(6) NOT NULL COMMENT '结束时间',
   `duration` FLOAT NOT NULL COMMENT '访问耗时（秒）',
   `ip` VARCHAR(50) NOT NULL COMMENT '访问IP',
+  `status_code` SMALLINT NULL COMMENT '响应状态码',
+  `error_class` VARCHAR(100) NULL COMMENT '异常类型',
+  `response_size` INT NULL COMMENT '响应大小（字节）',
+  `db_query_count` INT NOT NULL DEFAULT 0 COMMENT '数据库查询次数',
+  `db_time` DOUBLE NOT NULL DEFAULT 0 COMMENT '数据库耗时（秒）',
+  `connect_time` DOUBLE NOT NULL DEFAULT 0 COMMENT '数据库连接耗时（秒，含在db_time中）',
+  `render_time` DOUBLE NOT NULL DEFAULT 0 COMMENT '模板渲染耗时（秒）',
+  `sample_weight` INT NOT NULL DEFAULT 1 COMMENT '采样权重',
+  `inserted_at` DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) COMMENT '写入时间（数据库时钟，汇总据此判断已提交）',
   PRIMARY KEY (`log_id`),
 
   INDEX `idx_log_user` (`user_id`, `start_time`),
@@ -114,4 +124,72 @@ CREATE TABLE `access_logs` (
     FOREIGN KEY (`user_id`)
     REFERENCES `auth_user` (`id`)
     ON DELETE SET NULL
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='访问性能日志表';
\ No newline at end of file
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='访问性能日志表';
+
+
+CREATE TABLE `data_version` (
+  `table_name` VARCHAR(64) NOT NULL COMMENT '表名',
+  `version` BIGINT NOT NULL DEFAULT 0 COMMENT '版本号',
+  `update_time` DATETIME(6) NULL COMMENT '最后递增时间（UTC）',
+  PRIMARY KEY (`table_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='数据版本表（缓存失效）';
+
+
+
+CREATE TABLE `latency_histogram` (
+  `id` BIGINT NOT NULL AUTO_INCREMENT COMMENT 'ID',
+  `path` VARCHAR(255) NOT NULL COMMENT '访问路径',
+  `window_start` DATETIME(6) NOT NULL COMMENT '窗口开始时间',
+  `window_seconds` INT NOT NULL COMMENT '窗口长度（秒）',
+  `worker` VARCHAR(64) NOT NULL COMMENT '工作进程（主机:PID）',
+  `count` BIGINT NOT NULL DEFAULT 0 COMMENT '请求数',
+  `total_us` BIGINT NOT NULL DEFAULT 0 COMMENT '耗时合计（微秒）',
+  `max_us` BIGINT NOT NULL DEFAULT 0 COMMENT '最大耗时（微秒）',
+  `buckets` LONGTEXT NOT NULL COMMENT '桶计数（JSON）',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_hist_path_window_worker` (`path`, `window_start`, `worker`),
+  INDEX `idx_hist_window` (`window_start`, `path`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='访问耗时直方图';
+
+
+
+CREATE TABLE `access_log_rollup` (
+  `id` BIGINT NOT NULL AUTO_INCREMENT COMMENT 'ID',
+  `resolution` INT NOT NULL COMMENT '粒度（秒）',
+  `bucket_start` DATETIME(6) NOT NULL COMMENT '时间桶开始时间',
+  `path` VARCHAR(255) NOT NULL COMMENT '访问路径',
+  `count` BIGINT NOT NULL DEFAULT 0 COMMENT '请求数',
+  `error_count` BIGINT NOT NULL DEFAULT 0 COMMENT '错误数',
+  `sum_duration` DOUBLE NOT NULL DEFAULT 0 COMMENT '耗时合计（秒）',
+  `max_duration` DOUBLE NOT NULL DEFAULT 0 COMMENT '最大耗时（秒）',
+  `min_duration` DOUBLE NULL COMMENT '最小耗时（秒）',
+  `sum_db_time` DOUBLE NOT NULL DEFAULT 0 COMMENT '数据库耗时合计（秒）',
+  `sum_db_queries` BIGINT NOT NULL DEFAULT 0 COMMENT '数据库查询次数合计',
+  `sum_connect_time` DOUBLE NOT NULL DEFAULT 0 COMMENT '数据库连接耗时合计（秒）',
+  `sum_render_time` DOUBLE NOT NULL DEFAULT 0 COMMENT '模板渲染耗时合计（秒）',
+  `buckets` LONGTEXT NOT NULL COMMENT '耗时直方图桶计数（JSON）',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_rollup_bucket_path` (`resolution`, `bucket_start`, `path`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='访问日志汇总表';
+
+
+CREATE TABLE `rollup_state` (
+  `name` VARCHAR(64) NOT NULL COMMENT '汇总任务名',
+  `last_log_id` BIGINT NOT NULL DEFAULT 0 COMMENT '已汇总的最大日志ID',
+  `update_time` DATETIME(6) NOT NULL COMMENT '更新时间',
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='汇总进度表';
+
+
+CREATE TABLE `idempotency_key` (
+  `id` BIGINT NOT NULL AUTO_INCREMENT COMMENT 'ID',
+  `scope` VARCHAR(64) NOT NULL COMMENT '作用域（接口:用户ID）',
+  `idem_key` VARCHAR(128) NOT NULL COMMENT '幂等键（Idempotency-Key请求头）',
+  `request_hash` VARCHAR(64) NOT NULL COMMENT '请求参数摘要',
+  `result` LONGTEXT NULL COMMENT '执行结果（JSON）',
+  `create_time` DATETIME(6) NOT NULL COMMENT '创建时间',
+  `expire_time` DATETIME(6) NOT NULL COMMENT '过期时间',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_idem_scope_key` (`scope`, `idem_key`),
+  INDEX `idx_idem_expire` (`expire_time`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='幂等键表（与业务写入同一事务）';
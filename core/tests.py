@@ -1,3 +1,830 @@
-from django.test import TestCase
+import datetime
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock, skipUnless
+from django.db import connection, transaction
+from django.contrib.auth.models import AnonymousUser
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from core.models import AccessLog, AccessLogRollup, RollupState, IdempotencyKey, Customer, Product, Order, OrderItem
+from core.utils.db import get_db_conn, exec_update
+from core.utils.idempotency import IdempotencyClaim
+from core.utils.log_writer import BufferedLogWriter
+from core.utils.scheduler import PeriodicScheduler
+from core.utils.histogram import LatencyHistogram, HistogramStore, get_latency_percentiles
+from core.utils.performance import get_performance_stats, performance_log
+from core.utils.admission import (ConcurrencyLimiter, admission_control, get_admission_config, get_limiter, ADMITTED,
+                                  QUEUE_FULL, TIMEOUT, USER_LIMIT)
+import numpy as np
+from core.utils.analytics import SalesFrame, build_report, get_analytics_config, group_sum
+from core.utils.catalog_cache import CatalogCache
+from core.utils.recommendations import basket_pairs, build_model, get_recommendation_config
+from core.utils.product_tools import browse_products, decrement_stock_batch
+from core.utils.query_audit import QueryAudit, QueryAuditError, audit_queries, fingerprint, get_audit_config
+from core.utils.singleflight import single_flight
+from core.utils.events import _event_dir
+from core.utils.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from core.utils.rollup import _RollupAccumulator, _rollup_batch, summarize_rollups, MINUTE, ROLLUP_NAME
 
-# Create your tests here.
+
+class PerformanceLogTests(TestCase):
+    """performance_log装饰器的回归测试"""
+
+    @override_settings(ACCESS_LOG_BUFFER={'ENABLED': False}, ACCESS_LOG_SAMPLING={'DEFAULT_RATE': 1})
+    def test_login_page_template_response(self):
+        # LoginView返回未渲染的TemplateResponse，装饰器不能在渲染前读取content
+        response = self.client.get('/login/')
+        self.assertEqual(response.status_code, 200)
+        log = AccessLog.objects.get(path='/login/')
+        self.assertEqual(log.status_code, 200)
+        self.assertEqual(log.response_size, len(response.content))
+
+    @override_settings(ACCESS_LOG_BUFFER={'ENABLED': False}, ACCESS_LOG_SAMPLING={'DEFAULT_RATE': 1})
+    def test_performance_stats_include_uniques(self):
+        # 独立IP/用户数默认仍然返回（汇总表改造前的返回结构）
+        self.client.get('/login/')
+        stats = get_performance_stats(days=1)
+        self.assertEqual(stats['unique_ips'], 1)
+        self.assertEqual(stats['unique_users'], 0)
+        self.assertIsNone(get_performance_stats(days=1, include_uniques=False)['unique_ips'])
+
+
+@skipUnless(connection.vendor == 'mysql', "依赖InnoDB的唯一索引锁，只在MySQL上运行")
+class IdempotencyConcurrencyTests(TransactionTestCase):
+    """幂等键并发占用：相同键的并发首次请求只执行一次，其余等待并返回首次结果（不能死锁）"""
+
+    def run_claim(self, key, request_hash, barrier, results, hold=0.2):
+        conn = get_db_conn()
+        try:
+            claim = IdempotencyClaim('test:1', key, request_hash)
+            barrier.wait()
+            if claim.acquire(conn):
+                results.append(('replayed', claim.result))
+            else:
+                time.sleep(hold)  # 模拟业务写入，让并发请求在唯一索引上等待
+                claim.save(conn, {'order_id': 1})
+                results.append(('executed', claim.result))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            results.append(('error', str(e)))
+        finally:
+            conn.close()
+
+    def run_concurrently(self, key, request_hash, count):
+        barrier = threading.Barrier(count)
+        results = []
+        threads = [threading.Thread(target=self.run_claim, args=(key, request_hash, barrier, results))
+                   for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        return results
+
+    def test_concurrent_first_requests(self):
+        results = self.run_concurrently('double-click', 'h1', 2)
+        self.assertEqual(sorted(kind for kind, _ in results), ['executed', 'replayed'], results)
+        self.assertEqual(results[0][1], results[1][1])
+
+    def test_expired_key_reused(self):
+        exec_update(
+            "INSERT INTO idempotency_key (scope, idem_key, request_hash, result, create_time, expire_time) "
+            "VALUES ('test:1', 'expired', 'old', '{}', UTC_TIMESTAMP(6) - INTERVAL 2 DAY, "
+            "UTC_TIMESTAMP(6) - INTERVAL 1 DAY)"
+        )
+        results = self.run_concurrently('expired', 'h2', 2)
+        self.assertEqual(sorted(kind for kind, _ in results), ['executed', 'replayed'], results)
+        self.assertEqual(IdempotencyKey.objects.get(idem_key='expired').request_hash, 'h2')
+
+
+class TimingTests(TestCase):
+    """模板引擎别名与Server-Timing响应头"""
+
+    def test_default_template_engine_alias(self):
+        from django.template import engines
+        self.assertEqual(engines['django'].name, 'django')
+
+    @override_settings(SERVER_TIMING_HEADER='staff', DEBUG=False, ACCESS_LOG_BUFFER={'ENABLED': False})
+    def test_server_timing_hidden_from_anonymous(self):
+        response = self.client.get('/login/')
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(SERVER_TIMING_HEADER='staff', DEBUG=False, ACCESS_LOG_BUFFER={'ENABLED': False})
+    def test_server_timing_for_staff(self):
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_user('timing', is_staff=True))
+        response = self.client.get('/login/')
+        self.assertIn('Server-Timing', response)
+
+
+class SchedulerTests(TestCase):
+    """后台周期任务在独立调度线程中执行，不占用日志写入线程"""
+
+    def test_periodic_tasks_do_not_block_log_writer(self):
+        scheduler = PeriodicScheduler(name='test-tasks')
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_rebuild():
+            started.set()
+            release.wait(5)
+
+        scheduler.add_task(slow_rebuild, 0)
+        scheduler.add_task(lambda: calls.append('persist'), 3600, run_at_exit=True)
+        scheduler.ensure_started()
+        self.assertTrue(started.wait(5))
+
+        written = []
+        writer = BufferedLogWriter(written.extend, flush_interval=0.05, name='test-writer')
+        writer.submit('log')
+        self.assertTrue(writer.flush(1))  # 慢任务执行期间日志照常写入
+        self.assertEqual(written, ['log'])
+        writer.close()
+
+        release.set()
+        scheduler.close()
+        self.assertEqual(calls, ['persist'])  # 退出时只执行run_at_exit的任务
+
+
+class VersionSignalTests(TestCase):
+    """ORM写入订单/明细/客户时，事务提交后合并递增一次版本号"""
+
+    def test_orm_order_writes_bump_versions_once(self):
+        with mock.patch('core.signals.bump_version') as bump, self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                customer = Customer.objects.create(name='张三', phone='13800000000', address='北京',
+                                                   reg_date=datetime.date(2025, 1, 1))
+                product = Product.objects.create(name='耳机', code='P1', price=Decimal('9.90'), stock=5)
+                order = Order.objects.create(order_code='ORD1', customer=customer, status='待处理',
+                                             total_amount=Decimal('9.90'))
+                OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=Decimal('9.90'))
+                order.save()
+        bump.assert_called_once_with('customer', f'customer:{customer.pk}', 'product', 'shop_order',
+                                     'shop_order_item')
+
+    def test_rolled_back_writes_do_not_bump(self):
+        with mock.patch('core.signals.bump_version') as bump, self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                Customer.objects.create(name='李四', phone='13900000000', address='上海',
+                                        reg_date=datetime.date(2025, 1, 1))
+                raise ValueError
+            with transaction.atomic():
+                Customer.objects.filter(phone='13900000000').delete()
+        bump.assert_not_called()
+
+
+class LatencyHistogramTests(TestCase):
+    """进程内耗时直方图：持久化后跨进程合并，统计函数的百分位由直方图得出"""
+
+    def test_histogram_percentiles(self):
+        hist = LatencyHistogram()
+        for ms in range(1, 101):
+            hist.record(ms * 1000)
+        summary = hist.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['p50'], 0.05, delta=0.05 / 16)
+        self.assertAlmostEqual(summary['p99'], 0.099, delta=0.099 / 16)
+        merged = LatencyHistogram.from_row(hist.to_json(), hist.count, hist.total_us, hist.max_us).merge(hist)
+        self.assertEqual(merged.count, 200)
+        self.assertEqual(merged.percentile(50), hist.percentile(50))
+
+    def test_persisted_histograms_feed_stats(self):
+        store = HistogramStore(window_seconds=60)
+        for _ in range(9):
+            store.record('/histogram-test/', 0.01)
+        store.record('/histogram-test/', 2.0)
+        self.assertEqual(store.persist(), 1)
+        self.assertEqual(store.persist(), 0)  # 没有新数据时不重复写入
+
+        stats = get_performance_stats(days=1, include_uniques=False)
+        self.assertAlmostEqual(stats['p50'], 0.01, delta=0.01 / 16)
+        self.assertAlmostEqual(stats['p99'], 2.0, delta=2.0 / 16)
+        rows = get_latency_percentiles(minutes=5, path='/histogram-test/')
+        self.assertEqual(rows[0]['count'], 10)
+
+
+class RollupTests(TestCase):
+    """访问日志汇总：累加器、合并统计、按路由模板汇总与高水位推进"""
+
+    def add_log(self, path, route, duration, inserted_ago=60, status_code=200, weight=1):
+        now = timezone.now()
+        return AccessLog.objects.create(
+            path=path, route=route, start_time=now - datetime.timedelta(seconds=duration), end_time=now,
+            duration=duration, ip='127.0.0.1', status_code=status_code, sample_weight=weight,
+            inserted_at=now - datetime.timedelta(seconds=inserted_ago),
+        )
+
+    def test_accumulator_weights_and_merge(self):
+        acc = _RollupAccumulator()
+        acc.add(0.1, False, 0.02, 2, weight=10)
+        acc.add(0.5, True, 0.1, 5, weight=1, render_time=0.05)
+        self.assertEqual(acc.count, 11)
+        self.assertEqual(acc.error_count, 1)
+        self.assertAlmostEqual(acc.sum_duration, 1.5)
+        self.assertEqual((acc.min_duration, acc.max_duration), (0.1, 0.5))
+
+        row = AccessLogRollup(resolution=MINUTE, bucket_start=timezone.now(), path='order/', min_duration=None)
+        acc.merge_into(row)
+        acc.merge_into(row)
+        stats = summarize_rollups([row])
+        self.assertEqual(stats['total_requests'], 22)
+        self.assertAlmostEqual(stats['error_rate'], 2 / 22, places=4)
+        self.assertAlmostEqual(stats['avg_duration'], 3.0 / 22)
+        self.assertAlmostEqual(stats['phases']['render']['avg'], 0.1 / 22)
+        self.assertAlmostEqual(stats['p50'], 0.1, delta=0.1 / 16)
+
+    def test_summarize_empty(self):
+        stats = summarize_rollups([])
+        self.assertEqual(stats['total_requests'], 0)
+        self.assertIsNone(stats['avg_duration'])
+        self.assertIsNone(stats['p99'])
+
+    def test_rollup_keys_on_route(self):
+        for customer_id in range(1, 4):
+            self.add_log(f'/customer/{customer_id}/', 'customer/<int:customer_id>/', 0.1)
+        self.add_log('/legacy/', None, 0.2)
+        self.assertEqual(_rollup_batch(100, 10), 4)
+        paths = set(AccessLogRollup.objects.filter(resolution=MINUTE).values_list('path', flat=True))
+        self.assertEqual(paths, {'customer/<int:customer_id>/', '/legacy/'})
+
+    def test_watermark_stops_at_recently_inserted_log(self):
+        # 第二条刚写入（可能有更小的ID尚未提交），高水位停在它之前
+        first = self.add_log('/order/', 'order/', 0.1)
+        self.add_log('/order/', 'order/', 0.1, inserted_ago=0)
+        self.add_log('/order/', 'order/', 0.1)
+        self.assertEqual(_rollup_batch(100, 10), 1)
+        self.assertEqual(RollupState.objects.get(name=ROLLUP_NAME).last_log_id, first.log_id)
+
+
+BREAKER_CONFIG = {'ENABLED': True, 'WINDOW': 30, 'MIN_CALLS': 4, 'FAILURE_RATE': 0.5, 'CONSECUTIVE_TIMEOUTS': 2,
+                  'OPEN_SECONDS': 5, 'MAX_OPEN_SECONDS': 20, 'HALF_OPEN_PROBES': 1, 'HALF_OPEN_SUCCESSES': 2}
+
+
+@override_settings(DB_CIRCUIT_BREAKER=BREAKER_CONFIG, ACCESS_LOG_BUFFER={'ENABLED': False})
+class CircuitBreakerTests(TestCase):
+    """数据库熔断器的状态转换，以及熔断期间请求返回503与Retry-After"""
+
+    def open_breaker(self, breaker):
+        for _ in range(2):
+            breaker.record_failure('timeout', timeout=True)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_opens_on_failure_rate(self):
+        breaker = CircuitBreaker('test')
+        for ok in (True, False, True):
+            breaker.record_success() if ok else breaker.record_failure('error')
+        self.assertEqual(breaker.state, CLOSED)  # 调用数不足MIN_CALLS时不按失败率判断
+        breaker.record_failure('error')
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_consecutive_timeouts_reset_by_success(self):
+        breaker = CircuitBreaker('test')
+        breaker.record_failure('timeout', timeout=True)
+        breaker.record_success()
+        breaker.record_failure('timeout', timeout=True)
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure('timeout', timeout=True)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_open_rejects_then_half_open_probes_close(self):
+        breaker = CircuitBreaker('test')
+        with mock.patch('core.utils.circuit_breaker.time.monotonic', return_value=1000.0):
+            self.open_breaker(breaker)
+            with self.assertRaises(CircuitOpenError) as ctx:
+                breaker.before_call()
+            self.assertEqual(ctx.exception.retry_after, 5)
+        with mock.patch('core.utils.circuit_breaker.time.monotonic', return_value=1005.0):
+            self.assertTrue(breaker.before_call())
+            self.assertEqual(breaker.state, HALF_OPEN)
+            with self.assertRaises(CircuitOpenError):
+                breaker.before_call()  # 半开时只放行HALF_OPEN_PROBES个试探
+            breaker.record_success(probe=True)
+            self.assertTrue(breaker.before_call())
+            breaker.record_success(probe=True)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertFalse(breaker.before_call())
+
+    def test_failed_probe_doubles_open_time(self):
+        breaker = CircuitBreaker('test')
+        with mock.patch('core.utils.circuit_breaker.time.monotonic', return_value=1000.0):
+            self.open_breaker(breaker)
+        for expected in (10, 20, 20):
+            with mock.patch('core.utils.circuit_breaker.time.monotonic', return_value=breaker.opened_at + 100):
+                probe = breaker.before_call()
+                breaker.record_failure('error', probe=probe)
+            self.assertEqual((breaker.state, breaker.open_seconds), (OPEN, expected))
+
+    def call_view(self, view):
+        request = RequestFactory().get('/circuit-test/')
+        request.user = AnonymousUser()
+        return performance_log(view)(request)
+
+    def test_open_circuit_maps_to_503(self):
+        breaker = CircuitBreaker('test')
+        self.open_breaker(breaker)
+
+        def raising_view(request):
+            breaker.before_call()
+
+        def swallowing_view(request):
+            try:
+                breaker.before_call()
+            except Exception as e:
+                return JsonResponse({"code": 500, "msg": str(e)})
+
+        for view in (raising_view, swallowing_view):
+            response = self.call_view(view)
+            self.assertEqual(response.status_code, 503)
+            self.assertTrue(1 <= int(response['Retry-After']) <= 5)
+        log = AccessLog.objects.filter(path='/circuit-test/').last()
+        self.assertEqual(log.error_class, 'CircuitOpenError')
+
+    def test_own_5xx_response_kept(self):
+        breaker = CircuitBreaker('test')
+        self.open_breaker(breaker)
+
+        def health_view(request):
+            try:
+                breaker.before_call()
+            except CircuitOpenError:
+                return JsonResponse({"code": 503, "msg": "unhealthy"}, status=503)
+
+        response = self.call_view(health_view)
+        self.assertEqual(response.status_code, 503)
+        self.assertNotIn('Retry-After', response)
+
+
+class AdmissionTests(SimpleTestCase):
+    """准入控制：排队先来先服务、429/503拒绝与AIMD自适应上限"""
+
+    def config(self, **overrides):
+        return {**get_admission_config(), 'PER_USER_LIMIT': 0, **overrides}
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+
+    def test_fifo_handoff(self):
+        config = self.config(QUEUE_TIMEOUT=5)
+        limiter = ConcurrencyLimiter('fifo', 1)
+        self.assertEqual(limiter.acquire(None, config), ADMITTED)
+        admitted = []
+
+        def queued(name):
+            self.assertEqual(limiter.acquire(None, config), ADMITTED)
+            admitted.append(name)
+
+        threads = []
+        for index, name in enumerate(('first', 'second')):
+            threads.append(threading.Thread(target=queued, args=(name,)))
+            threads[-1].start()
+            self.wait_for(lambda: limiter.waiting == index + 1)
+
+        limiter.release(None, 0.01, config)
+        self.wait_for(lambda: admitted == ['first'])
+        # 名额已直接交给队首，新到的请求不能插队
+        self.assertEqual(limiter.acquire(None, self.config(QUEUE_TIMEOUT=0.01)), TIMEOUT)
+        self.assertEqual(limiter.waiting, 1)
+        limiter.release(None, 0.01, config)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(admitted, ['first', 'second'])
+        self.assertEqual(limiter.in_flight, 1)
+
+    def test_queue_full_and_user_limit(self):
+        limiter = ConcurrencyLimiter('limits', 1)
+        self.assertEqual(limiter.acquire('u1', self.config(PER_USER_LIMIT=1)), ADMITTED)
+        self.assertEqual(limiter.acquire('u1', self.config(PER_USER_LIMIT=1)), USER_LIMIT)
+        self.assertEqual(limiter.acquire('u2', self.config(QUEUE_SIZE=0)), QUEUE_FULL)
+        limiter.release('u1', 0.01, self.config())
+        self.assertEqual(limiter.per_user, {})
+
+    def test_decorator_rejections(self):
+        factory = RequestFactory()
+        release = threading.Event()
+        view = admission_control(lambda request: release.wait(5) and JsonResponse({"code": 200}),
+                                 endpoint='test_rejections')
+
+        def post(pk):
+            request = factory.post('/order/create/')
+            request.user = mock.Mock(pk=pk, is_authenticated=True)
+            return view(request)
+
+        admission_settings = {'ENABLED': True, 'LIMITS': {'test_rejections': 1}, 'QUEUE_SIZE': 0, 'PER_USER_LIMIT': 1}
+        with override_settings(ADMISSION_CONTROL=admission_settings):
+            running = threading.Thread(target=post, args=(1,))
+            running.start()
+            self.wait_for(lambda: get_limiter('test_rejections').in_flight == 1)
+            busy, too_many = post(2), post(1)
+            release.set()
+            running.join(5)
+        self.assertEqual(busy.status_code, 503)
+        self.assertEqual(too_many.status_code, 429)
+        for response in (busy, too_many):
+            self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+    def test_aimd_limit(self):
+        config = self.config(ADAPTIVE=True, TARGET_LATENCY=0.5, DECREASE_FACTOR=0.5, DECREASE_INTERVAL=60,
+                             MIN_LIMIT=1, MAX_LIMIT=5)
+        limiter = ConcurrencyLimiter('aimd', 4)
+        for _ in range(2):
+            self.assertEqual(limiter.acquire(None, config), ADMITTED)
+        limiter.release(None, 2.0, config)
+        self.assertEqual(limiter.limit, 2.0)
+        limiter.release(None, 2.0, config)
+        self.assertEqual(limiter.limit, 2.0)  # DECREASE_INTERVAL内不再降低
+
+        for _ in range(2):
+            self.assertEqual(limiter.acquire(None, config), ADMITTED)
+        limiter.release(None, 0.1, config)  # 满负荷且延迟正常：加1/limit
+        self.assertEqual(limiter.limit, 2.5)
+        limiter.release(None, 0.1, config)  # 未满负荷时不增加
+        self.assertEqual(limiter.limit, 2.5)
+
+
+class SingleFlightTests(SimpleTestCase):
+    """单飞合并：执行期间到达的相同调用共享leader的结果或异常，跟随者拿到深拷贝"""
+
+    def run_coalesced(self, func, followers=3):
+        """leader执行期间启动followers个相同调用，返回各调用的 (结果, 异常)"""
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        @single_flight(name='test')
+        def load(key):
+            calls.append(key)
+            started.set()
+            release.wait(5)
+            return func()
+
+        results = []
+
+        def call():
+            try:
+                results.append((load('k'), None))
+            except Exception as e:
+                results.append((None, e))
+
+        threads = [threading.Thread(target=call) for _ in range(followers + 1)]
+        threads[0].start()
+        self.assertTrue(started.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while load.flight._calls and next(iter(load.flight._calls.values())).followers < followers:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(calls, ['k'])  # 只执行一次
+        self.assertEqual(load.flight._calls, {})  # 执行结束即移除，不缓存
+        return results
+
+    def test_followers_share_deep_copies(self):
+        results = self.run_coalesced(lambda: {'items': [1, 2]})
+        values = [value for value, error in results]
+        self.assertEqual(values, [{'items': [1, 2]}] * 4)
+        values[0]['items'].append(3)
+        self.assertEqual(len({id(value['items']) for value in values}), 4)
+        self.assertEqual(values[1], {'items': [1, 2]})
+
+    def test_followers_share_error(self):
+        def fail():
+            raise ValueError('数据库错误')
+
+        results = self.run_coalesced(fail, followers=2)
+        self.assertEqual([type(error) for _, error in results], [ValueError] * 3)
+
+    @override_settings(SINGLE_FLIGHT={'COPY_RESULTS': False})
+    def test_shared_result_without_copy(self):
+        values = [value for value, _ in self.run_coalesced(lambda: {'items': []}, followers=1)]
+        self.assertIs(values[0], values[1])
+
+
+class EventDirTests(SimpleTestCase):
+    """跨进程广播的套接字目录只允许当前用户访问"""
+
+    def test_created_private_and_tightened(self):
+        with tempfile.TemporaryDirectory() as parent:
+            directory = os.path.join(parent, 'events')
+            self.assertIsNone(_event_dir({'DIR': directory}))
+            self.assertEqual(_event_dir({'DIR': directory}, create=True), directory)
+            self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+            os.chmod(directory, 0o777)
+            _event_dir({'DIR': directory})
+            self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+    def test_foreign_owner_rejected(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch('core.utils.events.os.getuid', return_value=os.getuid() + 1):
+            with self.assertRaises(Exception):
+                _event_dir({'DIR': directory})
+
+
+def make_catalog(products, categories, links):
+    """由 (ID, 名称, 单价) 商品、(ID, 名称) 分类与 (商品, 分类) 关联构建商品目录快照（不查询数据库）"""
+    cache = CatalogCache()
+    rows = (
+        [{'product_id': pid, 'name': name, 'code': f'P{pid}', 'price': Decimal(price)} for pid, name, price in products],
+        [{'category_id': cid, 'name': name} for cid, name in categories],
+        [{'product_id': pid, 'category_id': cid} for pid, cid in links],
+    )
+    with mock.patch('core.utils.catalog_cache.exec_query', side_effect=rows):
+        cache._load({})
+    cache.refresh = lambda force=False: None
+    return cache
+
+
+def make_frame(orders):
+    """由 (订单ID, 下单日期, [(商品ID, 数量, 金额分)]) 列表构建销售数据快照，订单按ID升序"""
+    orders = sorted(orders)
+    lines = [line for _, _, order_lines in orders for line in order_lines]
+
+    def column(values):
+        return np.array(values, dtype=np.int64)
+
+    order_lines = column([len(order_lines) for _, _, order_lines in orders])
+    return SalesFrame(
+        versions={},
+        loaded_at=datetime.datetime.now(),
+        line_product=column([pid for pid, _, _ in lines]),
+        line_qty=column([qty for _, qty, _ in lines]),
+        line_cents=column([cents for _, _, cents in lines]),
+        order_ids=column([order_id for order_id, _, _ in orders]),
+        order_starts=column(np.r_[0, np.cumsum(order_lines)[:-1]] if orders else []),
+        order_day=column([np.datetime64(day, 'D').astype(np.int64) for _, day, _ in orders]),
+        order_lines=order_lines,
+        order_units=column([sum(qty for _, qty, _ in order_lines) for _, _, order_lines in orders]),
+        order_cents=column([sum(cents for _, _, cents in order_lines) for _, _, order_lines in orders]),
+    )
+
+
+class SalesAnalyticsTests(SimpleTestCase):
+    """销售分析：分组累加与报表（按日、商品、分类、热销与购物篮分布）"""
+
+    def test_group_sum(self):
+        keys, counts, totals = group_sum(np.array([3, 1, 3, 2, 1]), np.ones(5, dtype=np.int64),
+                                         np.array([10, 20, 30, 40, 50]))
+        self.assertEqual(keys.tolist(), [1, 2, 3])
+        self.assertEqual(counts.tolist(), [2, 1, 2])
+        self.assertEqual(totals.tolist(), [70, 40, 40])
+        empty = group_sum(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self.assertEqual([a.size for a in empty], [0, 0])
+
+    def test_build_report(self):
+        today = datetime.date.today()
+        old = today - datetime.timedelta(days=30)
+        frame = make_frame([
+            (1, old, [(1, 1, 1000)]),
+            (2, today, [(1, 2, 2000), (2, 1, 550)]),
+            (3, today, [(3, 5, 500)]),
+        ])
+        catalog = make_catalog([(1, '耳机', '10.00'), (2, '数据线', '5.50'), (3, '贴纸', '1.00')],
+                               [(10, '数码'), (20, '配件')], [(1, 10), (2, 10), (2, 20)])
+        with mock.patch('core.utils.analytics.catalog_cache', catalog):
+            report = build_report(frame, None, 2, get_analytics_config())
+            recent = build_report(frame, 7, 2, get_analytics_config())
+
+        self.assertEqual((report['orders'], report['units'], report['revenue']), (3, 9, 40.5))
+        self.assertEqual(report['avg_order_value'], 13.5)
+        self.assertEqual([row['date'] for row in report['by_day']], [str(old), str(today)])
+        self.assertEqual([(row['product_id'], row['units'], row['revenue']) for row in report['by_product']],
+                         [(1, 3, 30.0), (2, 1, 5.5), (3, 5, 5.0)])
+        self.assertEqual([row['product_id'] for row in report['top_sellers']['by_units']], [3, 1])
+        self.assertEqual([(row['name'], row['units'], row['revenue']) for row in report['by_category']],
+                         [('数码', 4, 35.5), ('配件', 1, 5.5)])  # 属于多个分类的商品计入每个分类
+        self.assertEqual(report['basket']['lines']['distribution'], {1: 2, 2: 1})
+
+        self.assertEqual((recent['orders'], recent['revenue']), (2, 30.5))
+        self.assertEqual(recent['by_product'][0], {'product_id': 1, 'name': '耳机', 'units': 2, 'revenue': 20.0,
+                                                   'orders': 1})
+
+    def test_empty_frame(self):
+        with mock.patch('core.utils.analytics.catalog_cache', make_catalog([], [], [])):
+            report = build_report(make_frame([]), None, 10, get_analytics_config())
+        self.assertEqual((report['orders'], report['by_product'], report['top_sellers']['by_units']), (0, [], []))
+
+
+class RecommendationTests(SimpleTestCase):
+    """关联推荐：订单内商品对计数与Top-K关联商品"""
+
+    # 订单5的商品种类超过MAX_BASKET_SIZE，不参与配对但计入支持度；订单3中商品2重复出现
+    BASKETS = {1: [1, 2, 3], 2: [2, 1], 3: [2, 4, 2], 4: [5], 5: [1, 2, 3, 4]}
+
+    def frame(self):
+        today = datetime.date.today()
+        return make_frame([(order_id, today, [(pid, 1, 100) for pid in products])
+                           for order_id, products in self.BASKETS.items()])
+
+    def config(self, **overrides):
+        return {**get_recommendation_config(), 'MAX_BASKET_SIZE': 3, **overrides}
+
+    def test_basket_pairs(self):
+        order_ids = np.array([o for o, products in self.BASKETS.items() for _ in products], dtype=np.int64)
+        products = np.array([p for products in self.BASKETS.values() for p in products], dtype=np.int64)
+        rows, cols, counts, support, orders = basket_pairs(order_ids, products, 3)
+        self.assertEqual(list(zip(rows.tolist(), cols.tolist(), counts.tolist())),
+                         [(1, 2, 2), (1, 3, 1), (2, 3, 1), (2, 4, 1)])
+        self.assertEqual(support.tolist(), [0, 3, 4, 2, 2, 1])
+        self.assertEqual(orders, 5)
+
+        empty = basket_pairs(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), 3)
+        self.assertEqual((empty[0].size, empty[4]), (0, 0))
+
+    def test_build_model_min_pair_count(self):
+        model = build_model(self.frame(), self.config(MIN_PAIR_COUNT=2, METRIC='confidence'))
+        self.assertEqual(set(model.neighbours), {1, 2})
+        (neighbour,) = model.neighbours[2]
+        self.assertEqual((neighbour.product_id, neighbour.co_count, neighbour.confidence), (1, 2, 0.5))
+        self.assertAlmostEqual(neighbour.lift, 2 * 5 / (4 * 3), places=4)
+
+    def test_build_model_top_k_order(self):
+        model = build_model(self.frame(), self.config(MIN_PAIR_COUNT=1, METRIC='lift', TOP_K=2))
+        # 提升度相同时按共现次数降序、商品ID升序
+        self.assertEqual([n.product_id for n in model.neighbours[1]], [2, 3])
+        self.assertEqual([n.product_id for n in model.neighbours[2]], [1, 3])
+        self.assertEqual([n.product_id for n in model.neighbours[4]], [2])
+        self.assertNotIn(5, model.neighbours)
+
+
+class QueryAuditTests(TestCase):
+    """查询审计：SQL指纹归一化与N+1/重复/总数违规检测"""
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint("SELECT * FROM product WHERE product_id = 5 AND name = 'it\\'s'"),
+                         fingerprint("select *  from product\n where product_id = %s and name = %s"))
+        self.assertEqual(fingerprint("SELECT name FROM product WHERE product_id IN (%s, %s, %s)"),
+                         "select name from product where product_id in (...)")
+        self.assertEqual(fingerprint("INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)"),
+                         "insert into t (a, b) values (...)")
+        self.assertEqual(fingerprint("SELECT * FROM customer WHERE customer_id = %(id)s"),
+                         "select * from customer where customer_id = ?")
+        self.assertEqual(fingerprint("SELECT * FROM log_2024"), "select * from log_2024")  # 标识符中的数字保留
+
+    def audit(self, **overrides):
+        return QueryAudit({**get_audit_config(), 'REPEAT_THRESHOLD': 3, 'DUPLICATE_THRESHOLD': 2,
+                           'TOTAL_THRESHOLD': 6, 'STRICT': False, **overrides})
+
+    def test_repeated_and_duplicate(self):
+        audit = self.audit()
+        for customer_id in (1, 2, 3, 4):
+            audit.record("SELECT * FROM shop_order WHERE customer_id = %s", (customer_id,), 0.01)
+        audit.record("SELECT * FROM product WHERE product_id = %s", (1,), 0.01)
+        self.assertEqual([v['kind'] for v in audit.violations], ['repeated'])
+        audit.record("SELECT * FROM product WHERE product_id = %s", (1,), 0.01)
+        summary = {v['kind']: v for v in audit.summary()}
+        self.assertEqual(set(summary), {'repeated', 'duplicate', 'total'})
+        self.assertEqual(summary['repeated']['count'], 4)  # 次数取最终值，违规只记录一次
+        self.assertEqual(summary['duplicate']['count'], 2)
+        self.assertAlmostEqual(summary['repeated']['time'], 0.04)
+        self.assertEqual(summary['total']['count'], 6)
+
+    def test_report_strict(self):
+        audit = self.audit()
+        audit.record("SELECT 1", None, 0.0)
+        self.assertEqual(audit.report('ok', raise_on_violation=True), [])
+        for _ in range(2):
+            audit.record("SELECT 1", None, 0.0)
+        with self.assertLogs('core.utils.query_audit', 'WARNING'), self.assertRaises(QueryAuditError):
+            audit.report('strict', raise_on_violation=True)
+
+    def test_audit_queries_counts_orm(self):
+        with self.assertLogs('core.utils.query_audit', 'WARNING'), self.assertRaises(QueryAuditError):
+            with audit_queries('orm', strict=True) as audit:
+                for phone in ('1', '2', '3'):
+                    list(Customer.objects.filter(phone=phone))
+                list(Customer.objects.filter(phone='1'))
+                list(Customer.objects.filter(phone='1'))
+        self.assertEqual(audit.total, 5)
+
+
+class BrowseProductsTests(SimpleTestCase):
+    """商品浏览：分类位图求交/求并、分面计数、排序与分页（目录快照与库存查询均为模拟数据）"""
+
+    STOCK = {1: 5, 2: 0, 3: 9, 4: 2, 5: 7}
+
+    def setUp(self):
+        catalog = make_catalog(
+            [(1, '耳机', '99.00'), (2, '数据线', '9.90'), (3, '音箱', '199.00'), (4, '贴纸', '1.00'),
+             (5, '充电器', '49.00')],
+            [(10, '数码'), (20, '配件'), (30, '清仓')],
+            [(1, 10), (2, 10), (2, 20), (3, 10), (4, 20), (5, 20), (5, 10)],
+        )
+        self.queries = []
+        patches = [mock.patch('core.utils.product_tools.catalog_cache', catalog),
+                   mock.patch('core.utils.product_tools.exec_query', side_effect=self.exec_query)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def exec_query(self, sql, params):
+        self.queries.append((sql, params))
+        if 'ORDER BY stock' in sql:
+            ids, (limit, offset) = params[:-2], params[-2:]
+            ordered = sorted(ids, key=lambda pid: (-self.STOCK[pid] if 'DESC' in sql else self.STOCK[pid], pid))
+            return [{'product_id': pid, 'stock': self.STOCK[pid]} for pid in ordered[offset:offset + limit]]
+        return [{'product_id': pid, 'stock': self.STOCK[pid]} for pid in params]
+
+    def ids(self, result):
+        return [item['product_id'] for item in result['items']]
+
+    def test_match_any_and_all(self):
+        result = browse_products([10, 20], match='all')
+        self.assertEqual((result['total'], self.ids(result)), (2, [2, 5]))
+        self.assertEqual({f['category_id']: f['count'] for f in result['facets']}, {10: 2, 20: 2, 30: 0})
+
+        result = browse_products([20, 30], match='any')
+        self.assertEqual((result['total'], self.ids(result)), (3, [2, 4, 5]))
+        self.assertEqual(result['items'][0], {'product_id': 2, 'name': '数据线', 'price': Decimal('9.90'), 'stock': 0,
+                                              'categories': '数码,配件'})
+
+        result = browse_products()
+        self.assertEqual(result['total'], 5)
+        self.assertEqual({f['category_id']: f['count'] for f in result['facets']}, {10: 4, 20: 3, 30: 0})
+        self.assertEqual(browse_products([30])['items'], [])
+
+    def test_sort_and_page(self):
+        self.assertEqual(self.ids(browse_products(sort='price')), [4, 2, 5, 1, 3])
+        self.assertEqual(self.ids(browse_products([10], sort='-price', page=2, page_size=2)), [5, 2])
+        self.assertEqual(self.ids(browse_products([10], sort='-price', page=3, page_size=2)), [])
+        self.assertEqual(self.ids(browse_products([20], sort='-stock')), [5, 4, 2])
+        self.assertIn('WHERE product_id IN', self.queries[-1][0])
+
+    def test_invalid_arguments(self):
+        for kwargs in ({'match': 'none'}, {'sort': 'name'}, {'category_ids': [99]}):
+            with self.assertRaises(Exception):
+                browse_products(**kwargs)
+
+
+class StockBatchValidationTests(SimpleTestCase):
+    """批量扣减库存的参数校验（不访问数据库）"""
+
+    def test_empty_and_non_positive(self):
+        self.assertEqual(decrement_stock_batch({}), {})
+        with mock.patch('core.utils.product_tools.get_db_conn') as get_conn:
+            for items in ({1: 0}, {1: 2, 2: -1}):
+                with self.assertRaises(Exception):
+                    decrement_stock_batch(items)
+        get_conn.assert_not_called()
+
+
+@skipUnless(connection.vendor == 'mysql', "pymysql工具函数直接连接MySQL，只在MySQL上运行")
+class StockBatchTests(TransactionTestCase):
+    """批量扣减库存：全部成功或全部回滚，并发扣减不超卖"""
+
+    def setUp(self):
+        self.products = [Product.objects.create(name=f'商品{i}', code=f'S{i}', price=Decimal('1.00'), stock=stock)
+                         for i, stock in enumerate((5, 3))]
+
+    def stocks(self):
+        return [p.stock for p in Product.objects.filter(pk__in=[p.pk for p in self.products]).order_by('pk')]
+
+    def test_all_or_nothing(self):
+        first, second = (p.pk for p in self.products)
+        self.assertEqual(decrement_stock_batch({first: 2, second: 3}), {first: 3, second: 0})
+        with self.assertRaisesMessage(Exception, f"商品ID {second} 库存不足（当前：0，需扣减：1）"):
+            decrement_stock_batch({first: 1, second: 1})
+        with self.assertRaisesMessage(Exception, "商品ID 999999 不存在"):
+            decrement_stock_batch({first: 1, 999999: 1})
+        self.assertEqual(self.stocks(), [3, 0])  # 失败时整体回滚
+
+    def test_external_transaction_left_to_caller(self):
+        first, second = (p.pk for p in self.products)
+        conn = get_db_conn()
+        try:
+            self.assertIsNone(decrement_stock_batch({first: 1}, conn=conn, return_remaining=False))
+            with self.assertRaises(Exception):
+                decrement_stock_batch({second: 4}, conn=conn)
+            conn.rollback()
+        finally:
+            conn.close()
+        self.assertEqual(self.stocks(), [5, 3])
+
+    def test_concurrent_decrements_do_not_oversell(self):
+        first = self.products[0].pk
+        barrier = threading.Barrier(8)
+        results = []
+
+        def buy():
+            barrier.wait()
+            try:
+                decrement_stock_batch({first: 1}, return_remaining=False)
+                results.append('ok')
+            except Exception:
+                results.append('short')
+
+        threads = [threading.Thread(target=buy) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.assertEqual(results.count('ok'), 5)
+        self.assertEqual(self.stocks()[0], 0)
@@ -0,0 +1,207 @@
+import math
+import threading
+import time
+from collections import deque
+from functools import wraps
+from typing import Dict, Optional
+from django.conf import settings
+from django.http import JsonResponse
+from core.utils import metrics
+
+# 默认配置，可在settings.ADMISSION_CONTROL中按键覆盖（并发上限按工作进程计）
+DEFAULT_ADMISSION_CONFIG = {
+    'ENABLED': True,
+    'LIMITS': {},  # 按端点覆盖并发上限，如 {'order_create': 8}
+    'DEFAULT_LIMIT': 8,  # 每个端点同时执行的请求数
+    'QUEUE_SIZE': 16,  # 每个端点最多排队等待的请求数，超出立即返回503
+    'QUEUE_TIMEOUT': 2.0,  # 排队最长等待（秒），超时返回503
+    'PER_USER_LIMIT': 2,  # 单个用户在同一端点同时执行+排队的请求数，超出返回429（0=不限制）
+    'MAX_RETRY_AFTER': 30,  # Retry-After上限（秒）
+    # AIMD自适应：延迟超过目标时按比例降低上限，饱和且延迟正常时每轮（约limit个请求）加1
+    'ADAPTIVE': False,
+    'TARGET_LATENCY': 0.5,  # 目标延迟（秒）
+    'MIN_LIMIT': 1,
+    'MAX_LIMIT': 32,
+    'DECREASE_FACTOR': 0.7,
+    'DECREASE_INTERVAL': 1.0,  # 两次降低之间的最短间隔（秒），避免同一批慢请求连续降低
+}
+
+admission_rejected = metrics.Counter('admission_rejected', "准入控制拒绝的请求数", ['endpoint', 'reason'])
+admission_wait = metrics.Histogram('admission_wait_seconds', "准入排队等待时间（秒）", ['endpoint'],
+                                   buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0))
+admission_limit = metrics.Gauge('admission_limit', "当前并发上限（各进程之和）", ['endpoint'],
+                                multiprocess_mode='livesum')
+admission_in_flight = metrics.Gauge('admission_in_flight', "准入后执行中的请求数", ['endpoint'],
+                                    multiprocess_mode='livesum')
+
+ADMITTED, QUEUE_FULL, TIMEOUT, USER_LIMIT = 'admitted', 'queue_full', 'timeout', 'user_limit'
+
+
+def get_admission_config() -> Dict:
+    """合并默认配置与settings.ADMISSION_CONTROL"""
+    return {**DEFAULT_ADMISSION_CONFIG, **getattr(settings, 'ADMISSION_CONTROL', {})}
+
+
+class ConcurrencyLimiter:
+    """
+    单个端点的并发限制：最多limit个请求同时执行，其余在有界队列中先来先服务地等待
+    释放时直接把名额交给队首请求（新到的请求不能插队）
+    配置ADAPTIVE时按请求延迟做AIMD调整（上限为浮点数，取整后生效）
+    """
+
+    def __init__(self, endpoint: str, limit: int):
+        self.endpoint = endpoint
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.per_user: Dict = {}
+        self.latency = 0.0  # 延迟的指数移动平均，用于估算Retry-After
+        self._waiters: deque = deque()
+        self._lock = threading.Lock()
+        self._last_decrease = 0.0
+        admission_limit.set(self.limit, endpoint=endpoint)
+
+    @property
+    def capacity(self) -> int:
+        return max(int(self.limit), 1)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def acquire(self, user_key, config: Dict) -> str:
+        """申请执行，返回ADMITTED或拒绝原因（QUEUE_FULL/TIMEOUT/USER_LIMIT）"""
+        with self._lock:
+            per_user_limit = config['PER_USER_LIMIT']
+            if per_user_limit and user_key is not None and self.per_user.get(user_key, 0) >= per_user_limit:
+                return USER_LIMIT
+            if self.in_flight < self.capacity and not self._waiters:
+                self._admit(user_key)
+                return ADMITTED
+            if len(self._waiters) >= config['QUEUE_SIZE']:
+                return QUEUE_FULL
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+            self._track_user(user_key, 1)
+
+        if waiter.wait(config['QUEUE_TIMEOUT']):
+            return ADMITTED
+        with self._lock:
+            # 超时与交接同时发生时以交接为准
+            if waiter.is_set():
+                return ADMITTED
+            self._waiters.remove(waiter)
+            self._track_user(user_key, -1)
+        return TIMEOUT
+
+    def release(self, user_key, latency: float, config: Dict) -> None:
+        """请求结束：记录延迟、按需调整上限，并把名额交给排队的请求"""
+        with self._lock:
+            saturated = self.in_flight >= self.capacity
+            self.in_flight -= 1
+            self._track_user(user_key, -1)
+            admission_in_flight.dec(endpoint=self.endpoint)
+            self.latency = latency if not self.latency else self.latency * 0.8 + latency * 0.2
+            if config['ADAPTIVE']:
+                self._adjust(latency, saturated, config)
+            while self._waiters and self.in_flight < self.capacity:
+                waiter = self._waiters.popleft()
+                self.in_flight += 1
+                admission_in_flight.inc(endpoint=self.endpoint)
+                waiter.set()
+
+    def retry_after(self, config: Dict) -> int:
+        """按当前排队长度与平均延迟估算客户端的重试等待（秒）"""
+        estimate = (self.latency or 1.0) * (self.waiting + 1) / self.capacity
+        return min(max(int(math.ceil(estimate)), 1), config['MAX_RETRY_AFTER'])
+
+    def _adjust(self, latency: float, saturated: bool, config: Dict) -> None:
+        """AIMD：超出目标延迟时乘性降低，满负荷且延迟正常时加性增加"""
+        old_limit = self.limit
+        now = time.monotonic()
+        if latency > config['TARGET_LATENCY']:
+            if now - self._last_decrease >= config['DECREASE_INTERVAL']:
+                self.limit = max(self.limit * config['DECREASE_FACTOR'], float(config['MIN_LIMIT']))
+                self._last_decrease = now
+        elif saturated or self._waiters:
+            self.limit = min(self.limit + 1.0 / self.limit, float(config['MAX_LIMIT']))
+        if self.limit != old_limit:
+            admission_limit.set(self.limit, endpoint=self.endpoint)
+
+    def _admit(self, user_key) -> None:
+        self.in_flight += 1
+        self._track_user(user_key, 1)
+        admission_in_flight.inc(endpoint=self.endpoint)
+
+    def _track_user(self, user_key, delta: int) -> None:
+        if user_key is None:
+            return
+        count = self.per_user.get(user_key, 0) + delta
+        if count > 0:
+            self.per_user[user_key] = count
+        else:
+            self.per_user.pop(user_key, None)
+
+
+_limiters: Dict[str, ConcurrencyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(endpoint: str, config: Optional[Dict] = None) -> ConcurrencyLimiter:
+    config = config or get_admission_config()
+    limiter = _limiters.get(endpoint)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(endpoint)
+            if limiter is None:
+                limit = config['LIMITS'].get(endpoint, config['DEFAULT_LIMIT'])
+                limiter = _limiters[endpoint] = ConcurrencyLimiter(endpoint, limit)
+    return limiter
+
+
+def _rejection(reason: str, retry_after: int) -> JsonResponse:
+    if reason == USER_LIMIT:
+        response = JsonResponse({"code": 429, "msg": "您的请求过于频繁，请等待上一个操作完成后重试"}, status=429)
+    else:
+        response = JsonResponse({"code": 503, "msg": "系统繁忙，请稍后重试"}, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def admission_control(view_func=None, endpoint: Optional[str] = None):
+    """
+    写接口的准入控制装饰器（放在performance_log之下，拒绝的请求同样记录访问日志）：
+        @admission_control
+        def order_create(request): ...
+    超出并发上限的请求排队等待，队列已满或等待超时返回503，单个用户并发过多返回429，均带Retry-After
+    被拒绝的请求不会打开数据库连接，也不会去争抢商品行锁
+    """
+
+    def decorator(func):
+        name = endpoint or func.__name__
+
+        @wraps(func)
+        def wrapper(request, *args, **kwargs):
+            config = get_admission_config()
+            if not config['ENABLED'] or request.method in ('GET', 'HEAD', 'OPTIONS'):
+                return func(request, *args, **kwargs)
+
+            limiter = get_limiter(name, config)
+            user_key = request.user.pk if getattr(request.user, 'is_authenticated', False) else None
+            wait_start = time.perf_counter()
+            result = limiter.acquire(user_key, config)
+            admission_wait.observe(time.perf_counter() - wait_start, endpoint=name)
+            if result != ADMITTED:
+                admission_rejected.inc(endpoint=name, reason=result)
+                return _rejection(result, limiter.retry_after(config))
+
+            start = time.perf_counter()
+            try:
+                return func(request, *args, **kwargs)
+            finally:
+                limiter.release(user_key, time.perf_counter() - start, config)
+
+        return wrapper
+
+    if view_func is not None:
+        return decorator(view_func)
+    return decorator
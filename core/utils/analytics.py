@@ -0,0 +1,283 @@
+import datetime
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+from django.conf import settings
+from core.utils import metrics
+from core.utils.catalog_cache import catalog_cache
+from core.utils.db import iter_query
+from core.utils.versions import get_versions
+
+# 默认配置，可在settings.SALES_ANALYTICS中按键覆盖
+DEFAULT_ANALYTICS_CONFIG = {
+    'CHECK_INTERVAL': 5.0,  # 版本号检查间隔（秒），间隔内直接使用内存数据
+    'BATCH_SIZE': 50000,  # 流式读取每批行数
+    'TOP_N': 10,  # 热销商品默认条数
+    'MAX_DAYS': 366,  # 按日统计最多返回的天数
+    'REPORT_CACHE_SIZE': 32,  # 每个数据快照缓存的报表数（按days/top参数区分）
+}
+
+# 订单明细新增/删除时递增（create_order、delete_order），订单状态变化不影响销售统计
+ANALYTICS_TABLES = ('shop_order_item',)
+
+# 单价按分存为整数，金额累加不受浮点误差影响；时间按订单写入时的本地时间（create_order使用datetime.now()）
+LOAD_SQL = """
+           SELECT oi.order_id, \
+                  oi.product_id, \
+                  oi.quantity, \
+                  CAST(ROUND(oi.unit_price * 100) AS SIGNED) AS price_cents, \
+                  o.create_time
+           FROM shop_order_item oi
+                    JOIN shop_order o ON o.order_id = oi.order_id \
+           """
+
+analytics_load_duration = metrics.Histogram('analytics_load_seconds', "销售分析全量加载耗时（秒）",
+                                            buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+analytics_rows = metrics.Gauge('analytics_rows', "销售分析内存中的订单明细行数", multiprocess_mode='max')
+
+
+def get_analytics_config() -> Dict:
+    """合并默认配置与settings.SALES_ANALYTICS"""
+    return {**DEFAULT_ANALYTICS_CONFIG, **getattr(settings, 'SALES_ANALYTICS', {})}
+
+
+class SalesFrame(NamedTuple):
+    """
+    一次加载的销售数据（列式，整体替换，读者无需加锁）
+    明细按订单ID排序，order_starts为每个订单第一条明细的下标，订单级数组与order_ids一一对应
+    """
+    versions: Dict[str, int]
+    loaded_at: datetime.datetime
+    line_product: np.ndarray  # int64 商品ID
+    line_qty: np.ndarray  # int64 数量
+    line_cents: np.ndarray  # int64 明细金额（分）
+    order_ids: np.ndarray  # int64
+    order_starts: np.ndarray  # int64
+    order_day: np.ndarray  # int64 下单日期（自1970-01-01起的天数）
+    order_lines: np.ndarray  # int64 每单明细条数
+    order_units: np.ndarray  # int64 每单商品件数
+    order_cents: np.ndarray  # int64 每单金额（分）
+
+
+def group_sum(keys: np.ndarray, *values: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    按键分组求和（排序后np.add.reduceat，整数精确累加）：返回 (唯一键, 各列之和...)
+    适用于键稀疏或范围很大（如日期、订单ID）的情况；键为较小的稠密整数时用np.bincount更快
+    """
+    if keys.size == 0:
+        return (keys,) + tuple(v[:0] for v in values)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    return (sorted_keys[starts],) + tuple(np.add.reduceat(v[order], starts) for v in values)
+
+
+def _percentiles(values: np.ndarray) -> Dict:
+    if values.size == 0:
+        return {'mean': 0, 'p50': 0, 'p90': 0, 'p99': 0, 'max': 0}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'mean': round(float(values.mean()), 2), 'p50': round(float(p50), 2), 'p90': round(float(p90), 2),
+            'p99': round(float(p99), 2), 'max': values.max().item()}
+
+
+def _yuan(cents) -> float:
+    return round(int(cents) / 100, 2)
+
+
+class SalesAnalytics:
+    """
+    销售分析：订单明细流式读入NumPy列数组常驻内存，各项统计用向量化分组计算
+    通过data_version版本号惰性刷新（有新订单或订单被删除时重新加载）；
+    重新加载期间其他请求继续使用旧数据，只有首次加载需要等待
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame: Optional[SalesFrame] = None
+        self._reports: Dict[Tuple, Dict] = {}  # 只对应_report_frame，快照替换后清空
+        self._report_frame: Optional[SalesFrame] = None
+        self._checked_at = 0.0
+        self.load_count = 0
+
+    def _load(self, versions: Dict[str, int], config: Dict) -> SalesFrame:
+        """全量流式加载订单明细（服务端游标分批读取，每批直接转成列数组）"""
+        start = time.perf_counter()
+        batches = list(iter_query(LOAD_SQL, row_format='numpy', batch_size=config['BATCH_SIZE']))
+        columns = ('order_id', 'product_id', 'quantity', 'price_cents', 'create_time')
+        if batches:
+            data = {name: np.concatenate([batch[name] for batch in batches]) for name in columns}
+        else:
+            data = {name: np.empty(0, dtype='datetime64[us]' if name == 'create_time' else np.int64)
+                    for name in columns}
+        del batches
+
+        order = np.argsort(data['order_id'], kind='stable')
+        line_order = data['order_id'][order]
+        line_product = data['product_id'][order]
+        line_qty = data['quantity'][order]
+        line_cents = line_qty * data['price_cents'][order]
+        line_time = data['create_time'][order]
+
+        if line_order.size:
+            order_starts = np.flatnonzero(np.r_[True, line_order[1:] != line_order[:-1]])
+            order_units = np.add.reduceat(line_qty, order_starts)
+            order_cents = np.add.reduceat(line_cents, order_starts)
+        else:
+            order_starts = np.empty(0, dtype=np.int64)
+            order_units = order_cents = np.empty(0, dtype=np.int64)
+        order_lines = np.diff(np.r_[order_starts, line_order.size])
+        order_day = line_time[order_starts].astype('datetime64[D]').astype(np.int64)
+
+        frame = SalesFrame(
+            versions=versions,
+            loaded_at=datetime.datetime.now(),
+            line_product=line_product,
+            line_qty=line_qty,
+            line_cents=line_cents,
+            order_ids=line_order[order_starts],
+            order_starts=order_starts,
+            order_day=order_day,
+            order_lines=order_lines,
+            order_units=order_units,
+            order_cents=order_cents,
+        )
+        analytics_load_duration.observe(time.perf_counter() - start)
+        analytics_rows.set(line_order.size)
+        self.load_count += 1
+        return frame
+
+    def frame(self, force: bool = False) -> SalesFrame:
+        """当前数据快照（版本号变化时重新加载）"""
+        config = get_analytics_config()
+        now = time.monotonic()
+        frame = self._frame
+        if not force and frame is not None and now - self._checked_at < config['CHECK_INTERVAL']:
+            return frame
+
+        versions = get_versions(ANALYTICS_TABLES)
+        if not force and frame is not None and versions == frame.versions:
+            self._checked_at = now
+            return frame
+        # 已有旧数据时，拿不到锁（另一个线程正在加载）就先返回旧数据
+        if not self._lock.acquire(blocking=frame is None or force):
+            return frame
+        try:
+            if force or self._frame is None or self._frame.versions != versions:
+                self._frame = self._load(versions, config)
+            self._checked_at = time.monotonic()
+            return self._frame
+        finally:
+            self._lock.release()
+
+    def report(self, days: Optional[int] = None, top: Optional[int] = None) -> Dict:
+        """销售报表（同一数据快照与参数的结果直接复用）"""
+        config = get_analytics_config()
+        top = top or config['TOP_N']
+        frame = self.frame()
+        if self._report_frame is not frame:
+            self._report_frame, self._reports = frame, {}
+        reports = self._reports
+        # "最近N天"随日期变化，键中带上当天日期
+        key = (days, top, datetime.date.today() if days is not None else None)
+        cached = reports.get(key)
+        if cached is not None:
+            return cached
+        result = build_report(frame, days, top, config)
+        if len(reports) >= config['REPORT_CACHE_SIZE']:
+            reports.clear()
+        reports[key] = result
+        return result
+
+
+def build_report(frame: SalesFrame, days: Optional[int], top: int, config: Dict) -> Dict:
+    """由数据快照计算报表：days为最近N天（含今天），None表示全部"""
+    catalog_cache.refresh()
+    snapshot = catalog_cache.snapshot
+
+    # 按下单日期筛选订单，再按每单明细条数展开为明细掩码
+    today = np.datetime64(datetime.date.today(), 'D').astype(np.int64)
+    if days is not None:
+        order_mask = frame.order_day >= today - days + 1
+        line_mask = np.repeat(order_mask, frame.order_lines)
+    else:
+        order_mask = np.ones(frame.order_ids.size, dtype=bool)
+        line_mask = np.ones(frame.line_product.size, dtype=bool)
+
+    order_day = frame.order_day[order_mask]
+    order_lines = frame.order_lines[order_mask]
+    order_units = frame.order_units[order_mask]
+    order_cents = frame.order_cents[order_mask]
+    line_product = frame.line_product[line_mask]
+    line_qty = frame.line_qty[line_mask]
+    line_cents = frame.line_cents[line_mask]
+
+    # 按日：日期稀疏且可能跨多年，排序后分组累加
+    day_keys, day_orders, day_units, day_cents = group_sum(
+        order_day, np.ones(order_day.size, dtype=np.int64), order_units, order_cents)
+    day_rows = [
+        {'date': str(np.datetime64(int(day), 'D')), 'orders': int(o), 'units': int(u), 'revenue': _yuan(c)}
+        for day, o, u, c in zip(day_keys[-config['MAX_DAYS']:], day_orders[-config['MAX_DAYS']:],
+                                day_units[-config['MAX_DAYS']:], day_cents[-config['MAX_DAYS']:])
+    ]
+
+    # 按商品：商品ID是较小的稠密整数，直接bincount（权重和在2^53以内为精确整数）
+    size = int(line_product.max()) + 1 if line_product.size else 0
+    product_units = np.bincount(line_product, weights=line_qty, minlength=size).astype(np.int64)
+    product_cents = np.bincount(line_product, weights=line_cents, minlength=size).astype(np.int64)
+    product_lines = np.bincount(line_product, minlength=size)
+    sold = np.flatnonzero(product_lines)
+
+    def product_row(pid) -> Dict:
+        cached = snapshot.products.get(int(pid))
+        return {'product_id': int(pid), 'name': cached[0] if cached else None, 'units': int(product_units[pid]),
+                'revenue': _yuan(product_cents[pid]), 'orders': int(product_lines[pid])}
+
+    def top_by(values: np.ndarray) -> List[Dict]:
+        if sold.size == 0:
+            return []
+        k = min(top, sold.size)
+        # argpartition取前k个，再只对这k个排序（按值降序、ID升序）
+        candidates = sold[np.argpartition(-values[sold], k - 1)[:k]]
+        candidates = candidates[np.lexsort((candidates, -values[candidates]))]
+        return [product_row(pid) for pid in candidates]
+
+    by_product = [product_row(pid) for pid in sold[np.lexsort((sold, -product_cents[sold]))]]
+
+    # 按分类：商品-分类关联展开为 (商品, 分类) 数组，一个商品属于多个分类时计入每个分类
+    pairs = [(pid, cid) for pid, (_, _, _, cids) in snapshot.products.items() for cid in cids if pid < size]
+    by_category = []
+    if pairs:
+        pair_product, pair_category = (np.array(col, dtype=np.int64) for col in zip(*pairs))
+        category_keys, category_units, category_cents = group_sum(
+            pair_category, product_units[pair_product], product_cents[pair_product])
+        by_category = sorted(
+            ({'category_id': int(cid), 'name': snapshot.category_names.get(int(cid)), 'units': int(u),
+              'revenue': _yuan(c)} for cid, u, c in zip(category_keys, category_units, category_cents) if u),
+            key=lambda row: (-row['revenue'], row['category_id'])
+        )
+
+    # 购物篮：每单明细条数与件数的分布
+    line_hist = np.bincount(order_lines) if order_lines.size else np.empty(0, dtype=np.int64)
+    total_cents = int(order_cents.sum())
+    return {
+        'loaded_at': frame.loaded_at,
+        'days': days,
+        'orders': int(order_day.size),
+        'units': int(order_units.sum()),
+        'revenue': _yuan(total_cents),
+        'avg_order_value': _yuan(total_cents // order_day.size) if order_day.size else 0,
+        'by_day': day_rows,
+        'by_product': by_product,
+        'by_category': by_category,
+        'top_sellers': {'by_units': top_by(product_units), 'by_revenue': top_by(product_cents)},
+        'basket': {
+            'lines': {**_percentiles(order_lines),
+                      'distribution': {int(n): int(c) for n, c in enumerate(line_hist) if c}},
+            'units': _percentiles(order_units),
+            'value': _percentiles(order_cents / 100),
+        },
+    }
+
+
+sales_analytics = SalesAnalytics()
@@ -0,0 +1,131 @@
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from django.conf import settings
+from core.utils.db import exec_query
+from core.utils.versions import get_versions
+
+# 商品目录依赖的表：任一表版本变化即重新加载
+CATALOG_TABLES = ('product', 'category', 'product_category')
+
+
+class CatalogSnapshot(NamedTuple):
+    """一次加载的商品目录快照（整体替换，读者无需加锁）"""
+    product_ids: List[int]  # 按ID升序，与原SQL的GROUP BY顺序一致
+    products: Dict[int, Tuple]  # {商品ID: (名称, 编码, 单价, 分类ID元组)}
+    category_names: Dict[int, str]  # {分类ID: 分类名}
+    category_bitmaps: Dict[int, int]  # {分类ID: 商品位图}，第product_id位为1表示该商品属于此分类
+    all_bitmap: int  # 全部商品位图
+    price_order: List[int]  # 按(单价, ID)升序排列的商品ID
+
+
+class CatalogCache:
+    """
+    商品目录进程内缓存：商品名称/编码/单价及分类名常驻内存，
+    通过data_version版本号惰性刷新；库存变化频繁，始终实时查询
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval  # 版本号检查间隔（秒），间隔内直接使用内存数据
+        self._lock = threading.Lock()
+        self._versions: Optional[Dict[str, int]] = None
+        self._checked_at = 0.0
+        self._snapshot = CatalogSnapshot([], {}, {}, {}, 0, [])
+        self.load_count = 0
+
+    def _load(self, versions: Dict[str, int]) -> None:
+        """全量加载商品目录（三次单表查询，代替每次请求的三表Join）"""
+        products = exec_query("SELECT product_id, name, code, price FROM product ORDER BY product_id")
+        categories = exec_query("SELECT category_id, name FROM category")
+        links = exec_query("SELECT product_id, category_id FROM product_category ORDER BY id")
+
+        product_categories: Dict[int, List[int]] = {}
+        category_bitmaps: Dict[int, int] = {c['category_id']: 0 for c in categories}
+        for link in links:
+            product_categories.setdefault(link['product_id'], []).append(link['category_id'])
+            category_bitmaps[link['category_id']] = category_bitmaps.get(link['category_id'], 0) | (1 << link['product_id'])
+
+        all_bitmap = 0
+        for p in products:
+            all_bitmap |= 1 << p['product_id']
+
+        self._snapshot = CatalogSnapshot(
+            product_ids=[p['product_id'] for p in products],
+            products={
+                p['product_id']: (p['name'], p['code'], p['price'], tuple(product_categories.get(p['product_id'], ())))
+                for p in products
+            },
+            category_names={c['category_id']: c['name'] for c in categories},
+            category_bitmaps=category_bitmaps,
+            all_bitmap=all_bitmap,
+            price_order=[p['product_id'] for p in sorted(products, key=lambda p: (p['price'], p['product_id']))],
+        )
+        self._versions = versions
+        self.load_count += 1
+
+    def refresh(self, force: bool = False) -> None:
+        """检查版本号，变化时重新加载（先读版本再加载，加载期间的写入会在下次检查时发现）"""
+        now = time.monotonic()
+        if not force and self._versions is not None and now - self._checked_at < self.check_interval:
+            return
+
+        versions = get_versions(CATALOG_TABLES)
+        with self._lock:
+            if force or versions != self._versions:
+                self._load(versions)
+            self._checked_at = now
+
+    def invalidate(self) -> None:
+        """使本进程缓存失效，下次访问时重新加载"""
+        with self._lock:
+            self._versions = None
+
+    @property
+    def snapshot(self) -> CatalogSnapshot:
+        return self._snapshot
+
+    @staticmethod
+    def build_product(snapshot: CatalogSnapshot, product_id: int, stock: int) -> Optional[Dict]:
+        """组装商品字典（字段与原get_product查询结果一致，分类名拼接格式同GROUP_CONCAT）"""
+        cached = snapshot.products.get(product_id)
+        if cached is None:
+            return None
+        name, _, price, category_ids = cached
+        names = [snapshot.category_names[cid] for cid in category_ids if cid in snapshot.category_names]
+        return {
+            'product_id': product_id,
+            'name': name,
+            'price': price,
+            'stock': stock,
+            'categories': ','.join(names) if names else None,
+        }
+
+    def get_product(self, product_id: int) -> Optional[Dict]:
+        """按ID取商品（目录走内存，库存走主键查询）"""
+        self.refresh()
+        row = exec_query("SELECT stock FROM product WHERE product_id = %s", (product_id,), return_single=True)
+        if not row:
+            return None
+        if product_id not in self._snapshot.products:
+            # 商品已存在但缓存尚未感知（版本检查间隔内新增），强制刷新一次
+            self.refresh(force=True)
+        return self.build_product(self._snapshot, product_id, row['stock'])
+
+    def get_product_list(self, limit: int = 100) -> List[Dict]:
+        """取商品列表（仅对当前页商品批量查询库存）"""
+        self.refresh()
+        snapshot = self._snapshot
+        product_ids = snapshot.product_ids[:limit]
+        if not product_ids:
+            return []
+
+        placeholders = ','.join(['%s'] * len(product_ids))
+        rows = exec_query(f"SELECT product_id, stock FROM product WHERE product_id IN ({placeholders})",
+                          tuple(product_ids))
+        stocks = {row['product_id']: row['stock'] for row in rows}
+
+        # 加载后被删除的商品不再返回
+        return [self.build_product(snapshot, pid, stocks[pid]) for pid in product_ids if pid in stocks]
+
+
+catalog_cache = CatalogCache(check_interval=getattr(settings, 'CATALOG_CACHE_CHECK_INTERVAL', 1.0))
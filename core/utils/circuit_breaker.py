@@ -0,0 +1,234 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import wraps
+from typing import Dict
+from django.conf import settings
+from core.utils import metrics
+from core.utils.request_stats import record_circuit_open
+
+# 默认配置，可在settings.DB_CIRCUIT_BREAKER中按键覆盖（状态按工作进程维护）
+DEFAULT_BREAKER_CONFIG = {
+    'ENABLED': True,
+    'WINDOW': 30,  # 统计失败率的滑动窗口（秒）
+    'MIN_CALLS': 10,  # 窗口内至少这么多次调用才按失败率判断
+    'FAILURE_RATE': 0.5,  # 窗口内失败率达到该值时断开
+    'CONSECUTIVE_TIMEOUTS': 3,  # 连续超时达到该次数时立即断开（不必等满窗口）
+    'OPEN_SECONDS': 5,  # 断开后多久进入半开状态试探
+    'MAX_OPEN_SECONDS': 60,  # 试探连续失败时断开时长加倍，最长不超过该值
+    'HALF_OPEN_PROBES': 1,  # 半开状态同时放行的试探请求数
+    'HALF_OPEN_SUCCESSES': 2,  # 试探成功多少次后恢复闭合
+    'STALE_MAX_ENTRIES': 128,  # 断开时可返回的读接口旧结果（进程内，按路径保存最近的成功响应）
+    'STALE_MAX_AGE': 600,  # 旧结果最长可用时间（秒）
+    'STALE_MAX_BYTES': 256 * 1024,  # 超过该大小的响应不保存
+}
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+circuit_state = metrics.Gauge('db_circuit_state', "数据库熔断器状态（0闭合/1半开/2断开，取各进程最大值）",
+                              multiprocess_mode='max')
+circuit_transitions = metrics.Counter('db_circuit_transitions', "熔断器状态切换次数", ['state'])
+circuit_rejected = metrics.Counter('db_circuit_rejected', "熔断器断开时直接拒绝的数据库连接数")
+stale_responses = metrics.Counter('db_circuit_stale_responses', "熔断器断开时返回旧结果的请求数", ['route'])
+
+
+class CircuitOpenError(Exception):
+    """熔断器断开（数据库不可用），请求直接失败而不等待连接超时；performance_log据此返回503与Retry-After"""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_breaker_config() -> Dict:
+    """合并默认配置与settings.DB_CIRCUIT_BREAKER"""
+    return {**DEFAULT_BREAKER_CONFIG, **getattr(settings, 'DB_CIRCUIT_BREAKER', {})}
+
+
+class CircuitBreaker:
+    """
+    闭合：正常放行，按滑动窗口统计失败率与连续超时，达到阈值时断开
+    断开：直接抛出CircuitOpenError，OPEN_SECONDS后进入半开
+    半开：只放行少量试探请求，连续成功则闭合，任一失败则再次断开（断开时长加倍）
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._calls: deque = deque()  # [(时间, 是否成功)]，只保留窗口内的记录
+        self._failures = 0
+        self.consecutive_timeouts = 0
+        self.opened_at = 0.0
+        self.open_seconds = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.last_error = None
+
+    def before_call(self) -> bool:
+        """调用前检查，返回本次是否为半开试探；断开时抛出CircuitOpenError"""
+        config = get_breaker_config()
+        if not config['ENABLED']:
+            return False
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    raise self._rejection()
+                self._transition(HALF_OPEN)
+            if self._probes_in_flight >= config['HALF_OPEN_PROBES']:
+                raise self._rejection()
+            self._probes_in_flight += 1
+            return True
+
+    def _rejection(self) -> CircuitOpenError:
+        circuit_rejected.inc()
+        retry_in = max(self.open_seconds - (time.monotonic() - self.opened_at), 0)
+        error = CircuitOpenError(f"数据库暂时不可用（熔断中，约 {retry_in:.0f} 秒后重试）：{self.last_error or '连续失败'}",
+                                 retry_after=max(math.ceil(retry_in), 1))
+        record_circuit_open(error)  # 视图大多捕获异常后自行返回，记在请求统计上供performance_log改为503
+        return error
+
+    def record_success(self, probe: bool = False) -> None:
+        config = get_breaker_config()
+        with self._lock:
+            self.consecutive_timeouts = 0
+            self._record(True, config)
+            if probe:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                self._probe_successes += 1
+                if self.state == HALF_OPEN and self._probe_successes >= config['HALF_OPEN_SUCCESSES']:
+                    self._transition(CLOSED)
+
+    def record_failure(self, error: str, timeout: bool = False, probe: bool = False) -> None:
+        config = get_breaker_config()
+        with self._lock:
+            self.last_error = error[:200]
+            self.consecutive_timeouts = self.consecutive_timeouts + 1 if timeout else 0
+            self._record(False, config)
+            if probe or self.state == HALF_OPEN:
+                # 试探失败：再次断开，断开时长加倍
+                self._open(min(max(self.open_seconds, config['OPEN_SECONDS']) * 2, config['MAX_OPEN_SECONDS']))
+                return
+            if self.state != CLOSED:
+                return
+            if self.consecutive_timeouts >= config['CONSECUTIVE_TIMEOUTS']:
+                self._open(config['OPEN_SECONDS'])
+            elif len(self._calls) >= config['MIN_CALLS'] and self._failures / len(self._calls) >= config['FAILURE_RATE']:
+                self._open(config['OPEN_SECONDS'])
+
+    def release_probe(self, probe: bool) -> None:
+        """调用因与数据库无关的原因失败时归还试探名额（不计入成功或失败）"""
+        if probe:
+            with self._lock:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+
+    def _record(self, ok: bool, config: Dict) -> None:
+        now = time.monotonic()
+        self._calls.append((now, ok))
+        if not ok:
+            self._failures += 1
+        expire_before = now - config['WINDOW']
+        while self._calls and self._calls[0][0] < expire_before:
+            if not self._calls.popleft()[1]:
+                self._failures -= 1
+
+    def _open(self, seconds: float) -> None:
+        self.opened_at = time.monotonic()
+        self.open_seconds = seconds
+        self._transition(OPEN)
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == CLOSED:
+            self._calls.clear()
+            self._failures = 0
+            self.consecutive_timeouts = 0
+            self.open_seconds = 0.0
+        circuit_transitions.inc(state=state)
+        circuit_state.set(_STATE_VALUES[state])
+
+    def is_open(self) -> bool:
+        """当前是否处于断开期（半开或已到试探时间的不算）"""
+        with self._lock:
+            return self.state == OPEN and time.monotonic() - self.opened_at < self.open_seconds
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            calls = len(self._calls)
+            return {
+                'state': self.state,
+                'window_calls': calls,
+                'window_failure_rate': round(self._failures / calls, 4) if calls else 0.0,
+                'consecutive_timeouts': self.consecutive_timeouts,
+                'retry_in': round(max(self.open_seconds - (time.monotonic() - self.opened_at), 0), 1)
+                if self.state == OPEN else 0,
+                'last_error': self.last_error,
+            }
+
+
+db_breaker = CircuitBreaker('mysql')
+
+
+class _StaleStore:
+    """读接口最近一次成功响应（按完整路径），熔断断开时代替实时结果返回"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()  # 路径 -> (保存时间, 内容, Content-Type)
+
+    def put(self, key: str, content: bytes, content_type: str, config: Dict) -> None:
+        if len(content) > config['STALE_MAX_BYTES']:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), content, content_type)
+            self._entries.move_to_end(key)
+            while len(self._entries) > config['STALE_MAX_ENTRIES']:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str, config: Dict):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > config['STALE_MAX_AGE']:
+            return None
+        return entry
+
+
+stale_store = _StaleStore()
+
+
+def serve_stale_when_open(view_func):
+    """
+    读接口装饰器（放在performance_log之下）：熔断器断开期间返回该路径最近一次成功的响应，
+    响应头带 Warning: 110 与 X-Stale-Age；没有旧结果时照常执行视图（随即快速失败）
+    """
+    from django.http import HttpResponse
+    from core.utils.conditional import successful_response
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        config = get_breaker_config()
+        if not config['ENABLED'] or request.method not in ('GET', 'HEAD'):
+            return view_func(request, *args, **kwargs)
+        key = request.get_full_path()
+        if db_breaker.is_open():
+            entry = stale_store.get(key, config)
+            if entry is not None:
+                saved_at, content, content_type = entry
+                match = getattr(request, 'resolver_match', None)
+                stale_responses.inc(route=match.route if match is not None and match.route else 'unmatched')
+                response = HttpResponse(content, content_type=content_type)
+                response['Warning'] = '110 - "Response is Stale"'
+                response['X-Stale-Age'] = str(int(time.monotonic() - saved_at))
+                return response
+        response = view_func(request, *args, **kwargs)
+        if successful_response(response) and not getattr(response, 'streaming', False):
+            stale_store.put(key, response.content, response.get('Content-Type', ''), config)
+        return response
+
+    return wrapper
@@ -0,0 +1,105 @@
+import hashlib
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from core.utils.versions import get_version_stamps
+
+# 默认配置，可在settings.CONDITIONAL_GET中按键覆盖
+DEFAULT_CONDITIONAL_CONFIG = {
+    'ENABLED': True,
+    'ETAG_SALT': '',  # 参与ETag计算，响应格式变化（如模板/字段调整）后修改即可让客户端缓存全部失效
+}
+
+_STAMPS_ATTR = '_version_stamps'
+
+# 当前视图ETag依据的版本号（视图执行期间有效），单飞合并据此区分写入前后的调用
+_active_versions: ContextVar[Optional[Tuple]] = ContextVar('active_versions', default=None)
+
+
+def get_conditional_config() -> Dict:
+    """合并默认配置与settings.CONDITIONAL_GET"""
+    return {**DEFAULT_CONDITIONAL_CONFIG, **getattr(settings, 'CONDITIONAL_GET', {})}
+
+
+def _request_stamps(request, keys_func, args, kwargs) -> Optional[Dict[str, Tuple[int, Optional[datetime]]]]:
+    """本次请求依赖的版本号（挂在request上，ETag与Last-Modified共用一次data_version查询）"""
+    if not hasattr(request, _STAMPS_ATTR):
+        keys = keys_func(request, *args, **kwargs)
+        stamps = get_version_stamps(sorted(set(keys))) if keys else None
+        setattr(request, _STAMPS_ATTR, stamps)
+    stamps = getattr(request, _STAMPS_ATTR)
+    if stamps:
+        _active_versions.set(tuple(sorted((key, version) for key, (version, _) in stamps.items())))
+    return stamps
+
+
+def current_version_key() -> Optional[Tuple]:
+    """当前请求ETag依据的 (键, 版本号) 元组；不在条件GET视图中时为None"""
+    return _active_versions.get()
+
+
+def successful_response(response) -> bool:
+    """只有成功结果才带校验器：JSON接口的业务错误也以HTTP 200返回，按响应体的code判断（code总是第一个键）"""
+    if response.status_code != 200:
+        return False
+    if response.get('Content-Type', '').startswith('application/json'):
+        return response.content.startswith(b'{"code": 200')
+    return True
+
+
+def version_etag(path: str, stamps: Dict[str, Tuple[int, Optional[datetime]]]) -> str:
+    """由请求路径与各键版本号计算ETag（不含引号，由Django加引号）"""
+    raw = '|'.join([get_conditional_config()['ETAG_SALT'], path] +
+                   [f"{key}={version}" for key, (version, _) in sorted(stamps.items())])
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def version_condition(keys_func: Callable[..., Iterable[str]]):
+    """
+    基于data_version版本号的条件GET装饰器：
+        @version_condition(lambda request, customer_id: [f'customer:{customer_id}'])
+    keys_func返回视图依赖的版本键（表名或 customer:<id> 之类的实体键），返回空时不做条件处理
+    If-None-Match/If-Modified-Since匹配时直接返回304，视图与其中的数据查询都不会执行
+    """
+
+    def etag_func(request, *args, **kwargs):
+        stamps = _request_stamps(request, keys_func, args, kwargs)
+        return version_etag(request.path, stamps) if stamps else None
+
+    def last_modified_func(request, *args, **kwargs):
+        stamps = _request_stamps(request, keys_func, args, kwargs)
+        if not stamps:
+            return None
+        times = [update_time for _, update_time in stamps.values() if update_time is not None]
+        return max(times) if times else None
+
+    def decorator(view_func):
+        conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view_func)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not get_conditional_config()['ENABLED']:
+                return view_func(request, *args, **kwargs)
+            token = _active_versions.set(None)
+            try:
+                response = conditional_view(request, *args, **kwargs)
+            finally:
+                _active_versions.reset(token)
+            if response.status_code == 304:
+                return response
+            if not successful_response(response):
+                # 错误结果不带校验器，避免版本号未变时客户端一直拿到304而保留错误
+                del response['ETag']
+                del response['Last-Modified']
+            elif response.has_header('ETag'):
+                # 客户端可以保存响应，但每次使用前都要带上ETag重新校验
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
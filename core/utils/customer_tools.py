@@ -1,4 +1,6 @@
 from core.utils.db import exec_query, exec_update
+from core.utils.versions import bump_version
+from core.utils.singleflight import single_flight
 from typing import List, Dict, Optional
 
 
@@ -17,7 +19,9 @@ def create_customer(name: str, phone: str, address: str) -> int:
           INSERT INTO customer (name, phone, address, reg_date)
           VALUES (%s, %s, %s, CURDATE())
           """
-    return exec_update(sql, (name, phone, address), return_id=True)
+    customer_id = exec_update(sql, (name, phone, address), return_id=True)
+    bump_version('customer')
+    return customer_id
 
 
 def get_customer_list(limit: int = 100):
@@ -39,8 +43,9 @@ def get_customer_list(limit: int = 100):
     return exec_query(sql, (limit,))
 
 
+@single_flight
 def get_customer_detail(customer_id: int):
-    """获取客户详细信息"""
+    """获取客户详细信息（同一客户的并发调用经single_flight合并为一次查询）"""
     try:
         customer_sql = """
                        SELECT customer_id,
@@ -141,6 +146,7 @@ def update_customer(customer_id: int, name: str, phone: str, address: str) -> st
         result = exec_update(update_sql, (name, phone, address, customer_id))
 
         if result > 0:
+            bump_version('customer', f'customer:{customer_id}')
             return f"客户信息更新成功"
         else:
             return "客户信息未发生变化"
@@ -171,6 +177,7 @@ def delete_customer(customer_id: int) -> str:
         result = exec_update(delete_sql, (customer_id,))
 
         if result > 0:
+            bump_version('customer', f'customer:{customer_id}')
             return f"客户删除成功"
         else:
             raise Exception("删除客户失败，可能客户不存在")
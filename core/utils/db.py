@@ -1,25 +1,77 @@
-from typing import List, Tuple, Optional, Dict, Any, Union
+from typing import Callable, Iterator, List, Tuple, Optional, Dict, Any, Union
+import logging
+import re
+import time
 import pymysql
 from django.conf import settings
+from core.utils.request_stats import record_query, record_connect
+from core.utils import metrics
+from core.utils.tracing import start_span
+from core.utils.deadline import DeadlineExceeded, remaining_time, expire, get_deadline_config
+from core.utils.circuit_breaker import CircuitOpenError, db_breaker
+from core.utils.rows import ROW_FORMATS, format_rows
+
+logger = logging.getLogger(__name__)
+
+# 指标按语句类型分组，其他语句（SHOW、ALTER等）计为other
+_QUERY_KINDS = ('select', 'insert', 'update', 'delete')
+
+_SELECT_RE = re.compile(r'^\s*select\b', re.IGNORECASE)
+# 服务端因MAX_EXECUTION_TIME中止（3024）或被KILL QUERY中断（1317）；客户端读超时表现为连接丢失（2013）
+_SERVER_TIMEOUT_CODES = (3024, 1317)
+_CLIENT_TIMEOUT_CODE = 2013
+# 计入熔断器的"数据库不可用"错误：无法连接、连接丢失、连接数已满、服务端关闭中（语法/权限类错误不计）
+_UNAVAILABLE_CODES = (2002, 2003, 2006, 2013, 2055, 1040, 1053)
 
 
 def get_db_conn() -> Optional[pymysql.connections.Connection]:
     conn = None
     try:
         db_conf = settings.DATABASES['default']
+        # 有请求截止时间时，连接超时不超过剩余预算
+        connect_timeout = 10
+        remaining = remaining_time()
+        if remaining is not None:
+            if remaining <= 0:
+                raise expire('before_query')
+            connect_timeout = min(connect_timeout, remaining)
+        # 熔断器断开时直接失败，不再等待连接超时；半开时只放行少量试探连接
+        probe = db_breaker.before_call()
+        connect_start = time.perf_counter_ns()
 
         # 多用户并发通过"连接创建/释放管控"实现
-        conn = pymysql.connect(
-            host=db_conf['HOST'],
-            port=int(db_conf['PORT']),  # 强制整数，避免格式错误
-            user=db_conf['USER'],
-            password=db_conf['PASSWORD'],
-            database=db_conf['NAME'],  # 仅连接业务数据库DB_lab1
-            charset='utf8mb4',  # 保证中文数据完整性
-            cursorclass=pymysql.cursors.DictCursor,
-            connect_timeout=10,  # 防僵死连接
-            autocommit=False,  # 支持事务
-        )
+        try:
+            with start_span('db.connect', 'client', {'db.system': 'mysql', 'db.name': db_conf['NAME']}):
+                conn = pymysql.connect(
+                    host=db_conf['HOST'],
+                    port=int(db_conf['PORT']),  # 强制整数，避免格式错误
+                    user=db_conf['USER'],
+                    password=db_conf['PASSWORD'],
+                    database=db_conf['NAME'],  # 仅连接业务数据库DB_lab1
+                    charset='utf8mb4',  # 保证中文数据完整性
+                    cursorclass=pymysql.cursors.DictCursor,
+                    connect_timeout=connect_timeout,  # 防僵死连接
+                    autocommit=False,  # 支持事务
+                )
+        except pymysql.Error as e:
+            code = e.args[0] if e.args else 0
+            if code in _UNAVAILABLE_CODES:
+                # 连接超时受请求预算截短时不算作数据库超时（只计一次失败）
+                timed_out = 'timed out' in str(e) and connect_timeout >= 10
+                db_breaker.record_failure(f"连接失败（错误码：{code}）", timeout=timed_out, probe=probe)
+            else:
+                # 认证、权限等错误说明服务端有响应，按可用处理
+                db_breaker.record_success(probe=probe)
+            raise
+        except Exception:
+            # 配置等本地错误与数据库是否可用无关，只归还试探名额
+            db_breaker.release_probe(probe)
+            raise
+        db_breaker.record_success(probe=probe)
+        connect_ns = time.perf_counter_ns() - connect_start
+        record_connect(connect_ns)
+        metrics.db_connections.inc()
+        metrics.db_connect_duration.observe(connect_ns / 1e9)
 
         # 轻量校验：验证业务数据库连接存活
         if not conn.open:
@@ -30,6 +82,7 @@ def get_db_conn() -> Optional[pymysql.connections.Connection]:
     except pymysql.Error as e:
         error_code = e.args[0] if e.args else 0
         error_msg = str(e)
+        metrics.db_errors.inc(code=error_code)
         # 细化错误提示，关联文档段落（便于答辩排查）
         error_map = {
             1045: "用户名/密码错误",
@@ -41,6 +94,8 @@ def get_db_conn() -> Optional[pymysql.connections.Connection]:
         }
         raise Exception(f"数据库连接失败（错误码：{error_code}）：{error_map.get(error_code, error_msg)}")
 
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
         # 资源释放：确保异常时关闭连接
         if conn and conn.open:
@@ -48,15 +103,114 @@ def get_db_conn() -> Optional[pymysql.connections.Connection]:
         raise Exception(f"数据库连接异常：{str(e)}")
 
 
+def _apply_deadline(cursor, sql: str, kind: str, remaining: float):
+    """
+    按剩余预算限制本条SQL：SELECT加MAX_EXECUTION_TIME提示由服务端自行中止，
+    所有语句设置套接字读写超时兜底（SELECT多留KILL_GRACE，优先让服务端中止）
+    返回 (改写后的SQL, 需要恢复超时的连接)
+    """
+    if remaining <= 0:
+        raise expire('before_query')
+    timeout = remaining
+    if kind == 'select' and '/*+' not in sql:
+        ms = max(int(remaining * 1000), 1)
+        sql = _SELECT_RE.sub(lambda m: f"{m.group(0)} /*+ MAX_EXECUTION_TIME({ms}) */", sql, count=1)
+        timeout += get_deadline_config()['KILL_GRACE']
+    conn = cursor.connection
+    # pymysql没有按语句的超时参数，直接设置底层套接字（读写共用），执行后恢复为连接的read_timeout
+    sock = getattr(conn, '_sock', None)
+    if sock is None:
+        return sql, None
+    sock.settimeout(timeout)
+    return sql, conn
+
+
+def kill_query(thread_id: int) -> None:
+    """用独立连接中止指定连接上正在执行的语句（客户端超时后服务端仍在执行时调用）"""
+    db_conf = settings.DATABASES['default']
+    killer = None
+    try:
+        killer = pymysql.connect(
+            host=db_conf['HOST'], port=int(db_conf['PORT']), user=db_conf['USER'],
+            password=db_conf['PASSWORD'], database=db_conf['NAME'], charset='utf8mb4',
+            connect_timeout=2, read_timeout=2, write_timeout=2,
+        )
+        with killer.cursor() as cursor:
+            cursor.execute("KILL QUERY %s", (int(thread_id),))
+    except pymysql.Error as e:
+        # 语句已结束（1094：线程不存在）等情况无需处理
+        logger.warning(f"KILL QUERY {thread_id} 失败：{str(e)}")
+    finally:
+        if killer is not None and killer.open:
+            killer.close()
+
+
+def execute_sql(cursor, sql: str, params=None, many: bool = False) -> int:
+    """
+    执行SQL的统一入口（计入当前请求的查询次数与数据库耗时，以及进程级指标）
+    当前请求有截止时间时（见core/utils/deadline.py）按剩余预算限制执行时间，超时抛出DeadlineExceeded
+    """
+    kind = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else 'other'
+    if kind not in _QUERY_KINDS:
+        kind = 'other'
+    remaining = remaining_time()
+    timed_conn = None
+    thread_id = None
+    statement = sql
+    if remaining is not None:
+        statement, timed_conn = _apply_deadline(cursor, sql, kind, remaining)
+        thread_id = cursor.connection.server_thread_id[0] if timed_conn is not None else None
+    query_start = time.perf_counter_ns()
+    try:
+        with start_span(f"db.{kind}", 'client', {
+            'db.system': 'mysql', 'db.operation': kind, 'db.statement': sql.strip()[:500],
+        }) as span:
+            if many:
+                result = cursor.executemany(statement, params)
+            else:
+                result = cursor.execute(statement, params or ())
+            if span is not None:
+                span.set_attribute('db.rows_affected', cursor.rowcount)
+            return result
+    except pymysql.Error as e:
+        code = e.args[0] if e.args else 0
+        metrics.db_errors.inc(code=code)
+        if remaining is not None and code in _SERVER_TIMEOUT_CODES:
+            raise expire('server_timeout') from e
+        if timed_conn is not None and code == _CLIENT_TIMEOUT_CODE and remaining_time() <= 0:
+            # 客户端已放弃（pymysql关闭了连接），服务端的语句仍在执行，需主动中止
+            if thread_id:
+                kill_query(thread_id)
+            raise expire('socket_timeout') from e
+        if code in _UNAVAILABLE_CODES:
+            # 已建立的连接中途丢失同样计入熔断器（读超时视为超时）
+            db_breaker.record_failure(f"查询失败（错误码：{code}）", timeout=code == _CLIENT_TIMEOUT_CODE)
+        raise
+    finally:
+        if timed_conn is not None and timed_conn._sock is not None:
+            timed_conn._sock.settimeout(timed_conn._read_timeout)
+        duration_ns = time.perf_counter_ns() - query_start
+        record_query(duration_ns, sql, params)
+        metrics.db_queries.inc(kind=kind)
+        metrics.db_query_duration.observe(duration_ns / 1e9, kind=kind)
+
+
 def exec_query(
         sql: str,
         params: Optional[Union[Tuple, Dict]] = None,
         return_single: bool = False,
-        conn: Optional[pymysql.connections.Connection] = None
-) -> Union[List[Dict], Dict, None]:
+        conn: Optional[pymysql.connections.Connection] = None,
+        row_format: str = 'dict'
+) -> Union[List[Dict], Dict, None, Any]:
     """
     通用查询工具（参数化防注入，支持单条结果返回）
+    row_format见core/utils/rows.py：默认dict；大结果集可用tuple/row（每行一个元组，省去每行的字典），
+    或columns/numpy按列返回（数值列存为连续数组，不再逐行创建对象）
     """
+    if row_format not in ROW_FORMATS:
+        raise ValueError(f"不支持的结果格式：{row_format}（可选：{', '.join(ROW_FORMATS)}）")
+    if return_single and row_format in ('columns', 'numpy'):
+        raise ValueError("按列返回的结果不支持return_single")
     local_conn = None
     cursor = None
     try:
@@ -66,12 +220,17 @@ def exec_query(
         else:
             local_conn = get_db_conn()
 
-        cursor = local_conn.cursor()
+        # 非dict格式使用元组游标，由format_rows按需转换
+        cursor = local_conn.cursor() if row_format == 'dict' else local_conn.cursor(pymysql.cursors.Cursor)
         # 参数化查询：防范SQL注入
-        cursor.execute(sql, params or ())
+        execute_sql(cursor, sql, params)
         result = cursor.fetchall()
+        if row_format != 'dict':
+            result = format_rows(result, cursor.description, row_format)
         # 支持返回单条结果（简化业务层代码，如查询单个商品/客户）
         return result[0] if (return_single and result) else result
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
     except Exception as e:
         # 补充SQL上下文，便于答辩时定位问题
         error_detail = f"查询失败（SQL片段：{sql[:100]}... | 参数：{params}）：{str(e)}"
@@ -85,6 +244,45 @@ def exec_query(
             local_conn.close()
 
 
+def iter_query(
+        sql: str,
+        params: Optional[Union[Tuple, Dict]] = None,
+        row_format: str = 'tuple',
+        batch_size: int = 10000
+) -> Iterator[Any]:
+    """
+    流式查询：服务端游标逐批读取，每批按row_format转换后返回，内存中只保留一批
+    适用于统计、导出等需要遍历大量行的场景；迭代期间独占一个连接，不支持事务连接
+        for batch in iter_query("SELECT id, qty FROM shop_order_item", row_format='numpy'):
+            ...
+    """
+    if row_format not in ROW_FORMATS:
+        raise ValueError(f"不支持的结果格式：{row_format}（可选：{', '.join(ROW_FORMATS)}）")
+    conn = None
+    cursor = None
+    exhausted = False
+    try:
+        conn = get_db_conn()
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor if row_format == 'dict' else pymysql.cursors.SSCursor)
+        execute_sql(cursor, sql, params)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                exhausted = True
+                break
+            yield batch if row_format == 'dict' else format_rows(batch, cursor.description, row_format)
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
+    except Exception as e:
+        raise Exception(f"查询失败（SQL片段：{sql[:100]}... | 参数：{params}）：{str(e)}")
+    finally:
+        # 提前结束迭代时不关闭游标（会读完剩余的行），直接关闭连接丢弃未读结果
+        if cursor and exhausted:
+            cursor.close()
+        if conn and conn.open:
+            conn.close()
+
+
 def exec_update(
         sql: str,
         params: Optional[Union[Tuple, Dict]] = None,
@@ -109,9 +307,9 @@ def exec_update(
 
         # 批量/单条执行分支
         if batch and params_list and isinstance(params_list, list):
-            cursor.executemany(sql, params_list)  # 批量执行效率高于循环单条
+            execute_sql(cursor, sql, params_list, many=True)  # 批量执行效率高于循环单条
         else:
-            cursor.execute(sql, params or ())
+            execute_sql(cursor, sql, params)
 
         # 事务提交：所有操作成功才确认
         # 注意：如果是外部传入的连接，由外部控制提交
@@ -120,7 +318,7 @@ def exec_update(
 
         # 返回自增ID（插入数据时用，如创建客户/订单）或影响行数（修改/删除时用）
         if return_id:
-            cursor.execute("SELECT LAST_INSERT_ID()")
+            execute_sql(cursor, "SELECT LAST_INSERT_ID()")
             result = cursor.fetchone()
             return result['LAST_INSERT_ID()'] if result else 0
         return cursor.rowcount
@@ -128,6 +326,8 @@ def exec_update(
         # 事务回滚：任意步骤失败则恢复初始状态
         if local_conn and local_conn.open:
             local_conn.rollback()
+        if isinstance(e, (DeadlineExceeded, CircuitOpenError)):
+            raise
         error_detail = f"更新失败（SQL片段：{sql[:100]}... | 批量：{batch}）：{str(e)}"
         raise Exception(error_detail)
     finally:
@@ -137,25 +337,55 @@ def exec_update(
             local_conn.close()
 
 
+def on_commit(conn: Optional[pymysql.connections.Connection], callback: Callable[[], None]) -> None:
+    """
+    事务提交后执行回调（如推送实时事件），回滚时丢弃；未传入事务连接时立即执行
+    只对with_transaction管理的连接生效
+    """
+    if conn is None or not hasattr(conn, '_on_commit'):
+        callback()
+    else:
+        conn._on_commit.append(callback)
+
+
+def _run_on_commit(callbacks: List[Callable[[], None]]) -> None:
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"事务提交后回调执行失败：{str(e)}")
+
+
 def with_transaction(func):
     """
     事务装饰器：控制复杂业务原子性（如订单创建：客户→订单→明细→库存）
     """
     def wrapper(*args, **kwargs):
         conn = None
-        try:
-            conn = get_db_conn()
-            # 传入连接确保多步操作共用同一事务
-            result = func(conn, *args, **kwargs)
-            conn.commit()
-            return result
-        except Exception as e:
-            if conn and conn.open:
-                conn.rollback()  # 异常时回滚，符合ACID特性
-            raise Exception(f"事务执行失败：{str(e)}")
-        finally:
-            if conn and conn.open:
-                conn.close()  # 释放连接
+        with start_span(f"transaction {func.__name__}", attributes={'db.system': 'mysql'}) as span:
+            try:
+                conn = get_db_conn()
+                conn._on_commit = []
+                # 传入连接确保多步操作共用同一事务
+                result = func(conn, *args, **kwargs)
+                conn.commit()
+                metrics.db_transactions.inc(result='commit')
+                if span is not None:
+                    span.set_attribute('db.transaction.outcome', 'commit')
+                _run_on_commit(conn._on_commit)
+                return result
+            except Exception as e:
+                if conn and conn.open:
+                    conn.rollback()  # 异常时回滚，符合ACID特性
+                metrics.db_transactions.inc(result='rollback')
+                if span is not None:
+                    span.set_attribute('db.transaction.outcome', 'rollback')
+                if isinstance(e, (DeadlineExceeded, CircuitOpenError)):
+                    raise
+                raise Exception(f"事务执行失败：{str(e)}")
+            finally:
+                if conn and conn.open:
+                    conn.close()  # 释放连接
 
     return wrapper
 
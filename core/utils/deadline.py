@@ -0,0 +1,103 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from django.conf import settings
+from core.utils import metrics
+
+# 默认配置，可在settings.REQUEST_DEADLINE中按键覆盖
+DEFAULT_DEADLINE_CONFIG = {
+    'ENABLED': True,
+    'DEFAULT_BUDGET': 10.0,  # 请求的默认时间预算（秒）
+    'PATH_BUDGETS': {},  # 按路径前缀覆盖预算，如 {'/dashboard/': 15}，最长前缀优先；None表示不限
+    'KILL_GRACE': 0.2,  # SELECT的套接字超时比预算多留的时间（秒），先让服务端按MAX_EXECUTION_TIME自行中止
+}
+
+deadline_exceeded = metrics.Counter('deadline_exceeded', "超出请求时间预算的SQL数：before_query/server_timeout/socket_timeout",
+                                    ['reason'])
+
+
+class DeadlineExceeded(Exception):
+    """请求时间预算用尽（查询未执行或已被中止）"""
+
+
+class Deadline:
+    """一个请求的截止时间（单调时钟）；exceeded在查询层因超时中止时置位，performance_log据此返回504"""
+    __slots__ = ('expires_at', 'budget', 'exceeded')
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.exceeded = False
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+# 截止时间随contextvars传递：同一请求内的查询（包括sync_to_async线程中执行的）都能读到
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar('current_deadline', default=None)
+
+
+def get_deadline_config() -> Dict:
+    """合并默认配置与settings.REQUEST_DEADLINE"""
+    return {**DEFAULT_DEADLINE_CONFIG, **getattr(settings, 'REQUEST_DEADLINE', {})}
+
+
+def get_budget(path: str, config: Optional[Dict] = None) -> Optional[float]:
+    """路径对应的时间预算（秒），None表示不限制"""
+    config = config or get_deadline_config()
+    if not config['ENABLED']:
+        return None
+    budget = config['DEFAULT_BUDGET']
+    matched = ''
+    for prefix, value in config['PATH_BUDGETS'].items():
+        if path.startswith(prefix) and len(prefix) > len(matched):
+            matched, budget = prefix, value
+    return budget
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def remaining_time() -> Optional[float]:
+    """当前截止时间的剩余秒数（可能为负），没有截止时间时为None"""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def expire(reason: str, message: Optional[str] = None) -> DeadlineExceeded:
+    """标记当前请求超时并返回异常（由调用方抛出）"""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.exceeded = True
+    deadline_exceeded.inc(reason=reason)
+    if message is None:
+        message = f"请求超时：已超出 {deadline.budget:g} 秒的时间预算" if deadline is not None else "请求超时"
+    return DeadlineExceeded(message)
+
+
+def check_deadline() -> None:
+    """预算已用尽时抛出DeadlineExceeded（长循环/多步操作中间可主动调用）"""
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise expire('before_query')
+
+
+@contextmanager
+def request_deadline(budget: Optional[float]):
+    """
+    设置截止时间（嵌套时取更早的一个），budget为None时沿用外层：
+        with request_deadline(5):
+            get_order_list()
+    """
+    outer = _current_deadline.get()
+    if budget is None or (outer is not None and outer.remaining() <= budget):
+        yield outer
+        return
+    deadline = Deadline(budget)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
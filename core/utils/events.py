@@ -0,0 +1,357 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import queue
+import socket
+import stat
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from django.conf import settings
+from core.utils import metrics
+from core.utils.db import on_commit
+
+logger = logging.getLogger(__name__)
+
+# 默认配置，可在settings.LIVE_EVENTS中按键覆盖
+DEFAULT_EVENTS_CONFIG = {
+    'ENABLED': True,
+    'FANOUT': True,  # 通过本机Unix数据报套接字把事件广播给其他工作进程
+    'DIR': None,  # 各进程套接字所在目录（须为本用户所有，权限0700），未配置时为 系统临时目录/relation_db_events-<uid>
+    'QUEUE_SIZE': 256,  # 单个连接的待发送事件上限，积压超出时改发reset（客户端整体刷新）
+    'REPLAY_SIZE': 500,  # 进程内保留的最近事件数，断线重连时按Last-Event-ID补发
+    'HEARTBEAT': 15,  # 无事件时发送注释行的间隔（秒），防止代理断开空闲连接
+    'RETRY': 3000,  # 客户端断线后的重连间隔（毫秒）
+}
+
+EVENT_TYPES = ('order.created', 'order.status', 'order.deleted', 'stock.changed')
+# 订阅者积压过多或重连时补发不全，通知客户端整体刷新
+RESET = {'id': None, 'type': 'reset', 'data': {}}
+
+events_published = metrics.Counter('live_events_published', "发布的实时事件数", ['type'])
+events_dropped = metrics.Counter('live_events_dropped', "未送达的实时事件数", ['reason'])
+event_streams = metrics.Gauge('live_event_streams', "打开的SSE连接数", multiprocess_mode='livesum')
+
+_FANOUT_SUPPORTED = hasattr(socket, 'AF_UNIX')
+_MAX_DATAGRAM = 60000
+
+
+def get_events_config() -> Dict:
+    """合并默认配置与settings.LIVE_EVENTS"""
+    return {**DEFAULT_EVENTS_CONFIG, **getattr(settings, 'LIVE_EVENTS', {})}
+
+
+def _event_dir(config: Dict, create: bool = False) -> Optional[str]:
+    """
+    套接字目录：只有本用户可访问（0700），否则本机其他用户可以绑定套接字接收订单事件或伪造事件
+    目录已存在但不属于当前用户时抛出异常；create为False且目录不存在时返回None
+    """
+    uid = os.getuid() if hasattr(os, 'getuid') else None
+    default_name = f"relation_db_events-{uid}" if uid is not None else 'relation_db_events'
+    directory = str(config['DIR'] or os.path.join(tempfile.gettempdir(), default_name))
+    if create:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    try:
+        st = os.lstat(directory)
+    except FileNotFoundError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or (uid is not None and st.st_uid != uid):
+        raise Exception(f"实时事件目录 {directory} 不是当前用户所有的目录，已停用跨进程广播")
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        os.chmod(directory, 0o700)
+    return directory
+
+
+class _Subscriber:
+    """一个SSE连接的待发送队列；积压超出上限时清空并改发RESET"""
+
+    def deliver(self, event: Dict) -> None:
+        raise NotImplementedError
+
+    def _overflow(self, q) -> None:
+        events_dropped.inc(reason='overflow')
+        while True:
+            try:
+                q.get_nowait()
+            except (queue.Empty, asyncio.QueueEmpty):
+                break
+        q.put_nowait(RESET)
+
+
+class _ThreadSubscriber(_Subscriber):
+    """WSGI下的连接：请求线程阻塞在queue.Queue上"""
+
+    def __init__(self, size: int):
+        self.queue = queue.Queue(maxsize=size)
+
+    def deliver(self, event: Dict) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self._overflow(self.queue)
+
+    def get(self, timeout: float) -> Optional[Dict]:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class _AsyncSubscriber(_Subscriber):
+    """ASGI下的连接：事件经call_soon_threadsafe投递到连接所在的事件循环"""
+
+    def __init__(self, size: int):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=size)
+
+    def _put(self, event: Dict) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self._overflow(self.queue)
+
+    def deliver(self, event: Dict) -> None:
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    async def get(self, timeout: float) -> Optional[Dict]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class _Fanout:
+    """
+    本机多进程广播：有SSE连接的进程在DIR下绑定 <pid>.sock 并由后台线程接收，
+    发布方向目录内其他进程的套接字各发一个数据报（非阻塞，对方积压时丢弃）
+    进程异常退出留下的套接字在发送失败时清理
+    """
+
+    def __init__(self, bus: 'EventBus'):
+        self.bus = bus
+        self._lock = threading.Lock()
+        self._pid = None
+        self._send_sock: Optional[socket.socket] = None
+        self._recv_path: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _sender(self) -> socket.socket:
+        if self._send_sock is None or self._pid != os.getpid():
+            with self._lock:
+                if self._send_sock is None or self._pid != os.getpid():
+                    self._send_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                    self._send_sock.setblocking(False)
+                    self._pid = os.getpid()
+                    self._recv_path = None
+                    self._thread = None
+        return self._send_sock
+
+    def send(self, event: Dict, config: Dict) -> None:
+        payload = json.dumps(event, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+        if len(payload) > _MAX_DATAGRAM:
+            events_dropped.inc(reason='too_large')
+            return
+        directory = _event_dir(config)
+        if directory is None:
+            return
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return
+        sock = self._sender()
+        own = f"{os.getpid()}.sock"
+        for name in names:
+            if not name.endswith('.sock') or name == own:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                sock.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 进程已退出，套接字文件残留
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except (BlockingIOError, OSError):
+                events_dropped.inc(reason='fanout')
+
+    def ensure_listening(self, config: Dict) -> None:
+        """本进程有订阅者时才开始接收其他进程的事件（惰性绑定）"""
+        self._sender()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            directory = _event_dir(config, create=True)
+            path = os.path.join(directory, f"{os.getpid()}.sock")
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            recv_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            recv_sock.bind(path)
+            self._recv_path = path
+            self._thread = threading.Thread(target=self._run, args=(recv_sock,), name='live-events', daemon=True)
+            self._thread.start()
+            atexit.register(self._cleanup, path)
+
+    def _run(self, recv_sock: socket.socket) -> None:
+        while True:
+            try:
+                payload = recv_sock.recv(_MAX_DATAGRAM)
+                self.bus.dispatch(json.loads(payload.decode('utf-8')))
+            except Exception as e:
+                logger.error(f"接收实时事件失败：{str(e)}")
+
+    @staticmethod
+    def _cleanup(path: str) -> None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class EventBus:
+    """
+    进程内发布/订阅：写操作（订单、库存）提交后发布事件，分发给本进程全部SSE连接，
+    并通过_Fanout转发给其他工作进程；N个打开的页面只需一次广播，不再各自整页刷新
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: List[_Subscriber] = []
+        self._recent: deque = deque(maxlen=DEFAULT_EVENTS_CONFIG['REPLAY_SIZE'])
+        self._last_id = 0
+        self._fanout = _Fanout(self)
+
+    def _next_id(self) -> str:
+        # 纳秒时间戳作为事件ID（跨进程大致有序），同一进程内严格递增
+        with self._lock:
+            self._last_id = max(self._last_id + 1, time.time_ns())
+            return str(self._last_id)
+
+    def publish(self, event_type: str, data: Dict) -> None:
+        """发布事件（在写操作的事务提交后调用，见db.on_commit）"""
+        config = get_events_config()
+        if not config['ENABLED']:
+            return
+        event = {'id': self._next_id(), 'type': event_type, 'data': data}
+        events_published.inc(type=event_type)
+        self.dispatch(event)
+        if config['FANOUT'] and _FANOUT_SUPPORTED:
+            try:
+                self._fanout.send(event, config)
+            except Exception as e:
+                logger.error(f"实时事件跨进程广播失败：{str(e)}")
+
+    def dispatch(self, event: Dict) -> None:
+        """投递给本进程的订阅者（本进程发布或其他进程转发的事件）"""
+        with self._lock:
+            self._recent.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.deliver(event)
+            except RuntimeError:
+                # 连接所在的事件循环已关闭
+                self.unsubscribe(subscriber)
+
+    def subscribe(self, is_async: bool) -> _Subscriber:
+        config = get_events_config()
+        subscriber = _AsyncSubscriber(config['QUEUE_SIZE']) if is_async else _ThreadSubscriber(config['QUEUE_SIZE'])
+        if config['FANOUT'] and _FANOUT_SUPPORTED:
+            try:
+                self._fanout.ensure_listening(config)
+            except Exception as e:
+                # 只影响接收其他进程的事件，本进程发布的事件照常推送
+                logger.error(f"实时事件跨进程接收启动失败：{str(e)}")
+        with self._lock:
+            if self._recent.maxlen != config['REPLAY_SIZE']:
+                self._recent = deque(self._recent, maxlen=config['REPLAY_SIZE'])
+            self._subscribers.append(subscriber)
+        event_streams.inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber) -> None:
+        with self._lock:
+            if subscriber not in self._subscribers:
+                return
+            self._subscribers.remove(subscriber)
+        event_streams.dec()
+
+    def replay(self, last_event_id: Optional[str]) -> List[Dict]:
+        """断线期间错过的事件；超出保留范围时返回[RESET]"""
+        try:
+            last = int(last_event_id)
+        except (TypeError, ValueError):
+            return []
+        with self._lock:
+            recent = list(self._recent)
+        missed = [event for event in recent if int(event['id']) > last]
+        if recent and int(recent[0]['id']) > last and len(recent) == self._recent.maxlen:
+            return [RESET]
+        return missed
+
+
+event_bus = EventBus()
+
+
+def publish_event(event_type: str, data: Dict, conn=None) -> None:
+    """写操作调用：传入事务连接时在提交后发布，回滚则不发布"""
+    on_commit(conn, lambda: event_bus.publish(event_type, data))
+
+
+def format_event(event: Dict) -> str:
+    """SSE报文：id/event/data三行加空行"""
+    lines = []
+    if event['id']:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event['data'], ensure_ascii=False, default=str)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def event_stream(last_event_id: Optional[str] = None) -> Iterator[str]:
+    """WSGI下的SSE生成器（每个连接占用一个请求线程，开发服务器使用）"""
+    config = get_events_config()
+    subscriber = event_bus.subscribe(is_async=False)
+    try:
+        yield f"retry: {config['RETRY']}\n\n"
+        # 先订阅再补发：补发期间到达的事件已在队列中，按ID去重
+        backlog = event_bus.replay(last_event_id)
+        replayed = {event['id'] for event in backlog}
+        for event in backlog:
+            yield format_event(event)
+        while True:
+            event = subscriber.get(config['HEARTBEAT'])
+            if event is None:
+                yield ': ping\n\n'
+            elif event['id'] is None or event['id'] not in replayed:
+                yield format_event(event)
+    finally:
+        event_bus.unsubscribe(subscriber)
+
+
+async def async_event_stream(last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+    """ASGI下的SSE生成器（连接只占用一个协程）"""
+    config = get_events_config()
+    subscriber = event_bus.subscribe(is_async=True)
+    try:
+        yield f"retry: {config['RETRY']}\n\n"
+        backlog = event_bus.replay(last_event_id)
+        replayed = {event['id'] for event in backlog}
+        for event in backlog:
+            yield format_event(event)
+        while True:
+            event = await subscriber.get(config['HEARTBEAT'])
+            if event is None:
+                yield ': ping\n\n'
+            elif event['id'] is None or event['id'] not in replayed:
+                yield format_event(event)
+    finally:
+        event_bus.unsubscribe(subscriber)
@@ -0,0 +1,78 @@
+from typing import Callable, Dict, NamedTuple, Tuple
+from django.conf import settings
+from django.template.loader import render_to_string
+from core.utils.versions import get_versions
+
+# 默认配置，可在settings.FRAGMENT_CACHE中按键覆盖
+DEFAULT_FRAGMENT_CONFIG = {
+    'TIMEOUT': 600,  # 按版本号缓存的分块最长保留（秒），版本变化后旧缓存自然失效
+    'ACCESS_LOG_TIMEOUT': 5,  # 访问日志每个请求都在变化，按短时间缓存
+}
+
+
+class Panel(NamedTuple):
+    """页面分块：模板、依赖的数据表（版本号作为缓存键）、数据加载函数"""
+    template: str
+    tables: Tuple[str, ...]
+    loader: Callable[[], Dict]
+    timeout_key: str = 'TIMEOUT'
+
+
+def _orders():
+    from core.utils.order_tools import get_order_list
+    return {'orders': lambda: get_order_list(limit=50)}
+
+
+def _products():
+    from core.utils.product_tools import get_product_list
+    return {'products': lambda: get_product_list(limit=100)}
+
+
+def _customers():
+    from core.utils.customer_tools import get_customer_list
+    return {'customers': lambda: get_customer_list(limit=100)}
+
+
+def _access_logs():
+    from core.utils.performance import get_access_logs
+    return {'access_logs': lambda: get_access_logs(limit=50)}
+
+
+# 数据以无参函数传入模板：{% cache %}命中时分块内的变量不会被求值，也就不会执行查询
+# product_stock为库存专用版本号（与商品目录版本号分开，扣减库存不会使目录缓存失效）
+PANELS: Dict[str, Panel] = {
+    'orders': Panel('fragments/orders_panel.html',
+                    ('shop_order', 'shop_order_item', 'customer', 'product'), _orders),
+    'products': Panel('fragments/products_panel.html',
+                      ('product', 'category', 'product_category', 'product_stock'), _products),
+    'customers': Panel('fragments/customers_panel.html', ('customer', 'shop_order'), _customers),
+    'customer_options': Panel('fragments/customer_options.html', ('customer',), _customers),
+    'access_logs': Panel('fragments/access_logs_panel.html', (), _access_logs, 'ACCESS_LOG_TIMEOUT'),
+}
+
+
+def get_fragment_config() -> Dict:
+    """合并默认配置与settings.FRAGMENT_CACHE"""
+    return {**DEFAULT_FRAGMENT_CONFIG, **getattr(settings, 'FRAGMENT_CACHE', {})}
+
+
+def panel_version(panel: Panel) -> str:
+    """分块的版本串（依赖表版本号按顺序拼接，一次主键查询）"""
+    if not panel.tables:
+        return '0'
+    versions = get_versions(panel.tables)
+    return '.'.join(str(versions[table]) for table in panel.tables)
+
+
+def render_fragment(name: str, request=None) -> Dict:
+    """渲染分块HTML，返回 {'html': ..., 'version': ...}；缓存命中时只读取版本号"""
+    panel = PANELS.get(name)
+    if panel is None:
+        raise Exception(f"分块必须为：{', '.join(PANELS)}（当前：{name}）")
+    version = panel_version(panel)
+    context = {
+        'version': version,
+        'timeout': get_fragment_config()[panel.timeout_key],
+        **panel.loader(),
+    }
+    return {'html': render_to_string(panel.template, context, request=request), 'version': version}
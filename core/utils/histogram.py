@@ -0,0 +1,262 @@
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.db import connection
+from core.utils.scheduler import background_tasks
+
+# 对数-线性分桶（HDR风格）：每个2的幂区间再等分为SUB_BUCKETS个子桶，相对误差约 1/SUB_BUCKETS
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS  # 32
+HALF_SUB_BUCKETS = SUB_BUCKETS >> 1  # 16
+
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+# 默认配置，可在settings.LATENCY_HISTOGRAM中按键覆盖
+DEFAULT_HISTOGRAM_CONFIG = {
+    'WINDOW_SECONDS': 60,  # 时间窗口长度（秒）
+    'PERSIST_INTERVAL': 10.0,  # 持久化间隔（秒）
+}
+
+
+def bucket_index(value_us: int) -> int:
+    """耗时（微秒）对应的桶下标：小于SUB_BUCKETS线性分桶，之后每个2的幂区间HALF_SUB_BUCKETS个桶"""
+    if value_us < SUB_BUCKETS:
+        return max(value_us, 0)
+    shift = value_us.bit_length() - SUB_BUCKET_BITS
+    return shift * HALF_SUB_BUCKETS + (value_us >> shift)
+
+
+def bucket_bounds(index: int) -> Tuple[int, int]:
+    """桶下标对应的取值区间 [下界, 上界)"""
+    if index < SUB_BUCKETS:
+        return index, index + 1
+    shift = index // HALF_SUB_BUCKETS - 1
+    mantissa = index - shift * HALF_SUB_BUCKETS
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+class LatencyHistogram:
+    """
+    可合并的流式耗时直方图（稀疏桶计数，单位微秒）
+    分桶规则固定，不同进程/窗口的直方图直接按桶相加即可合并
+    """
+    __slots__ = ('buckets', 'count', 'total_us', 'max_us')
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    def record(self, value_us: int, weight: int = 1) -> None:
+        value_us = int(value_us)
+        index = bucket_index(value_us)
+        self.buckets[index] = self.buckets.get(index, 0) + weight
+        self.count += weight
+        self.total_us += value_us * weight
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def merge(self, other: 'LatencyHistogram') -> 'LatencyHistogram':
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+        self.count += other.count
+        self.total_us += other.total_us
+        self.max_us = max(self.max_us, other.max_us)
+        return self
+
+    def percentile(self, p: float) -> Optional[int]:
+        """第p百分位耗时（微秒，取桶中点，不超过最大值）"""
+        if not self.count:
+            return None
+        target = max(1, -(-self.count * p // 100))  # 向上取整的排名
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                lower, upper = bucket_bounds(index)
+                return min((lower + upper - 1) // 2, self.max_us)
+        return self.max_us
+
+    def summary(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Dict:
+        """汇总：请求数、平均/最大耗时及各百分位（单位秒，与access_logs.duration一致）"""
+        result = {
+            'count': self.count,
+            'avg_duration': round(self.total_us / self.count / 1e6, 6) if self.count else None,
+            'max_duration': round(self.max_us / 1e6, 6) if self.count else None,
+        }
+        for p in percentiles:
+            value = self.percentile(p)
+            result[f"p{str(p).replace('.', '')}"] = round(value / 1e6, 6) if value is not None else None
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(self.buckets, separators=(',', ':'))
+
+    @classmethod
+    def from_row(cls, buckets_json: str, count: int, total_us: int, max_us: int) -> 'LatencyHistogram':
+        hist = cls()
+        hist.buckets = {int(k): v for k, v in json.loads(buckets_json or '{}').items()}
+        hist.count = count
+        hist.total_us = total_us
+        hist.max_us = max_us
+        return hist
+
+
+class HistogramStore:
+    """
+    进程内按(路径, 时间窗口)维护直方图，周期性持久化到latency_histogram表
+    每个进程写自己的行（worker列区分），查询时合并，多进程无需协调
+    """
+
+    def __init__(self, window_seconds: int = 60):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, int], LatencyHistogram] = {}
+        self._dirty = set()
+        self._pid = os.getpid()
+
+    def _check_fork(self) -> None:
+        """fork出的子进程丢弃继承自父进程的数据，避免重复计数"""
+        if self._pid != os.getpid():
+            self._histograms = {}
+            self._dirty = set()
+            self._pid = os.getpid()
+
+    def record(self, path: str, duration: float, weight: int = 1, at: Optional[float] = None) -> None:
+        """记录一次请求耗时（秒）"""
+        at = time.time() if at is None else at
+        window = int(at // self.window_seconds * self.window_seconds)
+        key = (path, window)
+        with self._lock:
+            self._check_fork()
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = LatencyHistogram()
+            hist.record(int(duration * 1e6), weight)
+            self._dirty.add(key)
+
+    def persist(self) -> int:
+        """把有变化的窗口写入数据库（覆盖本进程的行），并释放已结束窗口的内存，返回写入行数"""
+        from core.models import LatencyHistogram as LatencyHistogramModel
+
+        current_window = int(time.time() // self.window_seconds * self.window_seconds)
+        with self._lock:
+            self._check_fork()
+            dirty = {key: self._histograms[key] for key in self._dirty}
+            snapshot = [
+                (key, hist.to_json(), hist.count, hist.total_us, hist.max_us)
+                for key, hist in dirty.items()
+            ]
+            self._dirty = set()
+            # 已结束的窗口写入后不会再变化，从内存中移除
+            for key in [k for k in self._histograms if k[1] < current_window and k not in dirty]:
+                del self._histograms[key]
+
+        if not snapshot:
+            return 0
+
+        worker = worker_id()
+        rows = [
+            LatencyHistogramModel(
+                path=path,
+                window_start=datetime.fromtimestamp(window, tz=dt_timezone.utc),
+                window_seconds=self.window_seconds,
+                worker=worker,
+                count=count,
+                total_us=total_us,
+                max_us=max_us,
+                buckets=buckets,
+            )
+            for (path, window), buckets, count, total_us, max_us in snapshot
+        ]
+        # MySQL的ON DUPLICATE KEY UPDATE不能指定冲突列，按唯一键自动匹配
+        unique_fields = ['path', 'window_start', 'worker'] \
+            if connection.features.supports_update_conflicts_with_target else None
+        try:
+            LatencyHistogramModel.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=['count', 'total_us', 'max_us', 'buckets'],
+            )
+        except Exception:
+            # 写入失败时恢复脏标记，下次重试
+            with self._lock:
+                self._dirty.update(key for key, *_ in snapshot if key in self._histograms)
+            raise
+        return len(rows)
+
+    def local_histograms(self) -> Dict[Tuple[str, int], LatencyHistogram]:
+        """本进程内存中的直方图（尚未持久化的实时数据）"""
+        with self._lock:
+            self._check_fork()
+            return dict(self._histograms)
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()[:50]}:{os.getpid()}"
+
+
+def get_histogram_config() -> Dict:
+    """合并默认配置与settings.LATENCY_HISTOGRAM"""
+    return {**DEFAULT_HISTOGRAM_CONFIG, **getattr(settings, 'LATENCY_HISTOGRAM', {})}
+
+
+def load_histograms(
+        start: datetime,
+        end: Optional[datetime] = None,
+        path: Optional[str] = None
+) -> Dict[str, LatencyHistogram]:
+    """读取时间范围内的直方图行并按路径合并（跨进程、跨窗口）"""
+    from core.models import LatencyHistogram as LatencyHistogramModel
+
+    queryset = LatencyHistogramModel.objects.filter(window_start__gte=start)
+    if end is not None:
+        queryset = queryset.filter(window_start__lt=end)
+    if path:
+        queryset = queryset.filter(path=path)
+
+    merged: Dict[str, LatencyHistogram] = {}
+    for row in queryset.values_list('path', 'buckets', 'count', 'total_us', 'max_us').iterator():
+        row_path, buckets, count, total_us, max_us = row
+        hist = LatencyHistogram.from_row(buckets, count, total_us, max_us)
+        if row_path in merged:
+            merged[row_path].merge(hist)
+        else:
+            merged[row_path] = hist
+    return merged
+
+
+def get_latency_percentiles(
+        minutes: int = 60,
+        path: Optional[str] = None,
+        percentiles: Iterable[float] = DEFAULT_PERCENTILES
+) -> List[Dict]:
+    """
+    按路径统计最近minutes分钟的耗时百分位（合并直方图，不扫描access_logs原始行）
+    """
+    start = datetime.now(tz=dt_timezone.utc) - timedelta(minutes=minutes)
+    merged = load_histograms(start, path=path)
+
+    total = LatencyHistogram()
+    result = []
+    for row_path, hist in merged.items():
+        total.merge(hist)
+        result.append({'path': row_path, **hist.summary(percentiles)})
+    result.sort(key=lambda r: r['count'], reverse=True)
+    if not path and result:
+        result.insert(0, {'path': '*', **total.summary(percentiles)})
+    return result
+
+
+latency_store = HistogramStore(window_seconds=get_histogram_config()['WINDOW_SECONDS'])
+
+# 持久化由后台任务调度线程周期执行，不占用请求线程；进程退出前再写一次，避免丢失最后一个窗口
+background_tasks.add_task(latency_store.persist, get_histogram_config()['PERSIST_INTERVAL'], run_at_exit=True,
+                          name='persist_latency_histograms')
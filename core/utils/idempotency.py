@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import re
+from typing import Dict, Optional
+import pymysql
+from django.conf import settings
+from django.utils import timezone
+from core.utils import metrics
+from core.utils.db import exec_query, exec_update
+from core.utils.scheduler import background_tasks
+from core.utils.retention import purge_in_chunks
+
+logger = logging.getLogger(__name__)
+
+# 默认配置，可在settings.IDEMPOTENCY中按键覆盖
+DEFAULT_IDEMPOTENCY_CONFIG = {
+    'ENABLED': True,
+    'HEADER': 'Idempotency-Key',
+    'TTL': 24 * 3600,  # 幂等键保留时间（秒），过期后同一键视为新请求
+    'PURGE_INTERVAL': 600,  # 后台清理过期键的间隔（秒）
+    'PURGE_CHUNK_SIZE': 1000,
+}
+
+# 键只允许可打印的常见字符（UUID、时间戳加随机串等），长度与表字段一致
+IDEMPOTENCY_KEY_RE = re.compile(r'^[0-9A-Za-z_.:-]{1,128}$')
+
+idempotency_requests = metrics.Counter('idempotency_requests', "携带幂等键的请求数：executed首次执行，replayed返回已保存结果",
+                                       ['scope', 'result'])
+
+
+class IdempotencyError(Exception):
+    """幂等键不合法，或同一键对应了不同的请求参数"""
+
+
+def get_idempotency_config() -> Dict:
+    """合并默认配置与settings.IDEMPOTENCY"""
+    return {**DEFAULT_IDEMPOTENCY_CONFIG, **getattr(settings, 'IDEMPOTENCY', {})}
+
+
+def request_fingerprint(params: Dict) -> str:
+    """请求参数摘要（键排序后的JSON做SHA-256），用于识别同一键被用于不同请求"""
+    raw = json.dumps(params, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class IdempotencyClaim:
+    """
+    一次携带幂等键的写请求：
+      lookup()      事务外的快速查询，已完成的请求直接返回结果，不进入加锁事务
+      acquire(conn) 事务内第一步插入键行；并发的相同键在唯一索引上等待首个事务结束，
+                    首个事务提交则返回其结果，回滚则本请求接着执行；已过期的同名键原地覆盖
+      save(conn)    事务内保存结果，随业务写入一起提交
+    """
+
+    def __init__(self, scope: str, key: str, request_hash: str, ttl: Optional[int] = None):
+        if not IDEMPOTENCY_KEY_RE.match(key or ''):
+            raise IdempotencyError("幂等键只能包含字母、数字及 _ . : -，长度不超过128")
+        self.scope = scope[:64]
+        self.key = key
+        self.request_hash = request_hash
+        self.ttl = ttl if ttl is not None else get_idempotency_config()['TTL']
+        self.replayed = False
+        self.conflict = False  # 同一键对应了不同参数（事务内发现时异常会被包装，调用方据此区分）
+        self.result = None
+
+    def _check(self, row: Dict):
+        if row['request_hash'] != self.request_hash:
+            self.conflict = True
+            raise IdempotencyError(f"幂等键 {self.key} 已用于参数不同的请求，请使用新的幂等键")
+        self.replayed = True
+        self.result = json.loads(row['result']) if row['result'] is not None else None
+        idempotency_requests.inc(scope=self.scope, result='replayed')
+        return self.result
+
+    def lookup(self) -> bool:
+        """查询已提交的结果，存在时返回True（结果见self.result）"""
+        row = exec_query(
+            "SELECT request_hash, result FROM idempotency_key "
+            "WHERE scope = %s AND idem_key = %s AND expire_time >= UTC_TIMESTAMP(6)",
+            (self.scope, self.key), return_single=True
+        )
+        if not row:
+            return False
+        self._check(row)
+        return True
+
+    def acquire(self, conn: pymysql.connections.Connection) -> bool:
+        """在业务事务中占用幂等键；该键已有提交的结果时返回True（结果见self.result），调用方应直接返回"""
+        for _ in range(3):
+            # 先INSERT IGNORE：同键的事务未结束时在唯一索引记录上等待，对方提交后返回0行（重复），回滚后插入成功
+            # （不能先DELETE过期行：REPEATABLE READ下两个首次请求会各持间隙锁再互相等待插入，导致死锁1213）
+            inserted = exec_update(
+                "INSERT IGNORE INTO idempotency_key (scope, idem_key, request_hash, create_time, expire_time) "
+                "VALUES (%s, %s, %s, UTC_TIMESTAMP(6), UTC_TIMESTAMP(6) + INTERVAL %s SECOND)",
+                (self.scope, self.key, self.request_hash, int(self.ttl)), conn=conn
+            )
+            if inserted:
+                idempotency_requests.inc(scope=self.scope, result='executed')
+                return False
+            # 加锁读：读取最新提交的行（不受事务快照影响），并持有行锁以便原地更新过期行
+            row = exec_query(
+                "SELECT request_hash, result, expire_time < UTC_TIMESTAMP(6) AS expired FROM idempotency_key "
+                "WHERE scope = %s AND idem_key = %s FOR UPDATE",
+                (self.scope, self.key), return_single=True, conn=conn
+            )
+            if not row:
+                # 读取前该行已被清理任务删除，重新插入
+                continue
+            if row['expired']:
+                # 过期的同名键视为新请求：原地覆盖，不删除再插入
+                exec_update(
+                    "UPDATE idempotency_key SET request_hash = %s, result = NULL, create_time = UTC_TIMESTAMP(6), "
+                    "expire_time = UTC_TIMESTAMP(6) + INTERVAL %s SECOND WHERE scope = %s AND idem_key = %s",
+                    (self.request_hash, int(self.ttl), self.scope, self.key), conn=conn
+                )
+                idempotency_requests.inc(scope=self.scope, result='executed')
+                return False
+            self._check(row)
+            return True
+        raise Exception(f"幂等键 {self.key} 状态异常，请重试")
+
+    def save(self, conn: pymysql.connections.Connection, result) -> None:
+        """保存执行结果（与业务写入同一事务）"""
+        exec_update(
+            "UPDATE idempotency_key SET result = %s WHERE scope = %s AND idem_key = %s",
+            (json.dumps(result, ensure_ascii=False, default=str), self.scope, self.key), conn=conn
+        )
+        self.result = result
+
+
+def claim_from_request(request, scope: str) -> Optional[IdempotencyClaim]:
+    """从请求头创建幂等声明（未携带幂等键或未启用时返回None）；作用域按用户隔离"""
+    config = get_idempotency_config()
+    key = request.headers.get(config['HEADER'])
+    if not config['ENABLED'] or not key:
+        return None
+    params = {k: request.POST.getlist(k) for k in request.POST if k != 'csrfmiddlewaretoken'}
+    user_id = request.user.pk if getattr(request.user, 'is_authenticated', False) else 0
+    return IdempotencyClaim(f"{scope}:{user_id}", key.strip(), request_fingerprint(params), config['TTL'])
+
+
+def purge_expired_keys() -> None:
+    """分批删除过期的幂等键（后台线程周期执行）"""
+    config = get_idempotency_config()
+    try:
+        result = purge_in_chunks('idempotency_key', 'id', 'expire_time', timezone.now(),
+                                 chunk_size=config['PURGE_CHUNK_SIZE'], pause=0, time_budget=5)
+        if result['deleted']:
+            logger.info(f"清理过期幂等键 {result['deleted']} 条")
+    except Exception as e:
+        logger.error(f"清理过期幂等键失败：{str(e)}")
+
+
+background_tasks.add_task(purge_expired_keys, get_idempotency_config()['PURGE_INTERVAL'])
@@ -0,0 +1,190 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# 默认配置，可在settings.ACCESS_LOG_BUFFER中按键覆盖
+DEFAULT_BUFFER_CONFIG = {
+    'ENABLED': True,  # False时退化为请求线程同步写入
+    'MAX_QUEUE': 10000,  # 内存队列上限（条）
+    'BATCH_SIZE': 200,  # 攒够多少条写一次
+    'FLUSH_INTERVAL': 2.0,  # 最长多少秒写一次（秒）
+    'OVERFLOW': 'drop',  # 队列满时：drop丢弃 / block阻塞等待
+    'BLOCK_TIMEOUT': 0.05,  # block策略下最长等待（秒），超时仍计为丢弃
+    'SHUTDOWN_TIMEOUT': 5.0,  # 进程退出时等待刷盘的最长时间（秒）
+}
+
+_STOP = object()
+
+
+class _FlushMarker:
+    """同步刷盘标记：后台线程写完标记之前的记录后置位"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class BufferedLogWriter:
+    """
+    有界内存队列 + 后台线程批量写入（按条数或时间间隔触发）
+    请求线程只做入队，不再承担数据库往返
+    """
+
+    def __init__(
+            self,
+            write_batch: Callable[[List], None],
+            max_queue: int = 10000,
+            batch_size: int = 200,
+            flush_interval: float = 2.0,
+            overflow: str = 'drop',
+            block_timeout: float = 0.05,
+            name: str = 'log-writer'
+    ):
+        if overflow not in ('drop', 'block'):
+            raise Exception(f"溢出策略必须为：drop、block（当前：{overflow}）")
+        self.write_batch = write_batch
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.name = name
+        self._lock = threading.Lock()
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._counters = {'enqueued': 0, 'flushed': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+
+    def ensure_started(self) -> queue.Queue:
+        """惰性启动后台线程；fork出的子进程（如prefork服务器）重新创建队列和线程"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return self._queue
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.max_queue)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return self._queue
+
+    def submit(self, record) -> bool:
+        """记录入队，返回是否成功（队列满按溢出策略丢弃或阻塞）"""
+        q = self.ensure_started()
+        try:
+            if self.overflow == 'block':
+                q.put(record, timeout=self.block_timeout)
+            else:
+                q.put_nowait(record)
+        except queue.Full:
+            self._incr('dropped')
+            return False
+        self._incr('enqueued')
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待当前已入队的记录全部写入，返回是否在超时内完成"""
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        marker = _FlushMarker()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """停止后台线程，停止前写完队列中的剩余记录"""
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.error(f"{self.name} 关闭失败：队列已满，剩余 {self._queue.qsize()} 条日志未写入")
+            return
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """计数器快照：入队/写入/丢弃/写入失败/批次数/当前队列长度"""
+        with self._lock:
+            counters = dict(self._counters)
+        counters['queued'] = self._queue.qsize() if self._queue is not None else 0
+        return counters
+
+    def _incr(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[key] += n
+
+    def _run(self) -> None:
+        q = self._queue
+        while True:
+            batch = []
+            markers = []
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = q.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                if isinstance(item, _FlushMarker):
+                    markers.append(item)
+                    break
+                batch.append(item)
+
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.done.set()
+            if stop:
+                close_old_connections()
+                return
+
+    def _write(self, batch: List) -> None:
+        try:
+            close_old_connections()  # 后台线程独立持有数据库连接，失效时重建
+            self.write_batch(batch)
+            self._incr('flushed', len(batch))
+            self._incr('batches')
+        except Exception as e:
+            self._incr('failed', len(batch))
+            logger.error(f"{self.name} 批量写入失败（{len(batch)}条）：{str(e)}")
+
+
+def get_buffer_config() -> Dict:
+    """合并默认配置与settings.ACCESS_LOG_BUFFER"""
+    return {**DEFAULT_BUFFER_CONFIG, **getattr(settings, 'ACCESS_LOG_BUFFER', {})}
+
+
+def _write_access_logs(batch: List) -> None:
+    from core.models import AccessLog
+    AccessLog.objects.bulk_create(batch, batch_size=500)
+
+
+_config = get_buffer_config()
+
+access_log_writer = BufferedLogWriter(
+    _write_access_logs,
+    max_queue=_config['MAX_QUEUE'],
+    batch_size=_config['BATCH_SIZE'],
+    flush_interval=_config['FLUSH_INTERVAL'],
+    overflow=_config['OVERFLOW'],
+    block_timeout=_config['BLOCK_TIMEOUT'],
+    name='access-log-writer',
+)
+
+# 进程退出前刷盘，避免丢失队列中的日志
+atexit.register(access_log_writer.close, _config['SHUTDOWN_TIMEOUT'])
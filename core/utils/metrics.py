@@ -0,0 +1,400 @@
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+
+# 多进程模式：每个进程把指标值写入共享目录下自己的mmap文件，抓取时合并目录内全部文件
+# 未配置MULTIPROC_DIR时退化为单进程内存存储
+
+# 默认配置，可在settings.METRICS中按键覆盖
+DEFAULT_METRICS_CONFIG = {
+    'MULTIPROC_DIR': None,  # 多进程共享目录（每次部署启动前需清空）
+    'ALLOWED_IPS': ('127.0.0.1', '::1'),  # 允许匿名抓取/metrics/的来源IP，其他来源需staff登录
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+GAUGE_MODES = ('sum', 'max', 'all', 'livesum')  # 多进程下gauge的合并方式；all按pid分别输出
+
+
+class _MmapStore:
+    """
+    单进程的mmap值文件：头部4字节为已用长度，之后依次为
+    [4字节键长][键（UTF-8，按8字节对齐补空格）][8字节double值]
+    写入只改自己进程的文件，其他进程只读，无需跨进程锁
+    """
+    INITIAL_SIZE = 1 << 16
+
+    def __init__(self, filename: str):
+        self._lock = threading.Lock()
+        self._file = open(filename, 'a+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            self._file.truncate(self.INITIAL_SIZE)
+            size = self.INITIAL_SIZE
+        self._capacity = size
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        self._positions: Dict[str, int] = {}
+        self._used = struct.unpack_from('i', self._mmap, 0)[0]
+        if self._used == 0:
+            self._used = 8
+            struct.pack_into('i', self._mmap, 0, self._used)
+        for key, _, pos in _iter_entries(self._mmap, self._used):
+            self._positions[key] = pos
+
+    def _init_value(self, key: str) -> int:
+        encoded = key.encode('utf-8')
+        padded = encoded + b' ' * (8 - (len(encoded) + 4) % 8)
+        entry = struct.pack(f'i{len(padded)}sd', len(encoded), padded, 0.0)
+        while self._used + len(entry) > self._capacity:
+            self._capacity *= 2
+            self._file.truncate(self._capacity)
+            self._mmap = mmap.mmap(self._file.fileno(), self._capacity)
+        self._mmap[self._used:self._used + len(entry)] = entry
+        self._used += len(entry)
+        struct.pack_into('i', self._mmap, 0, self._used)  # 最后更新长度，读者不会读到半条记录
+        pos = self._used - 8
+        self._positions[key] = pos
+        return pos
+
+    def inc(self, key: str, amount: float) -> None:
+        with self._lock:
+            pos = self._positions.get(key)
+            if pos is None:
+                pos = self._init_value(key)
+            value = struct.unpack_from('d', self._mmap, pos)[0]
+            struct.pack_into('d', self._mmap, pos, value + amount)
+
+    def set(self, key: str, value: float) -> None:
+        with self._lock:
+            pos = self._positions.get(key)
+            if pos is None:
+                pos = self._init_value(key)
+            struct.pack_into('d', self._mmap, pos, value)
+
+    def get(self, key: str) -> float:
+        with self._lock:
+            pos = self._positions.get(key)
+            return struct.unpack_from('d', self._mmap, pos)[0] if pos is not None else 0.0
+
+
+class _DictStore:
+    """单进程内存存储（未配置共享目录时使用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = {}
+
+    def inc(self, key: str, amount: float) -> None:
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, key: str, value: float) -> None:
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, key: str) -> float:
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def items(self) -> List[Tuple[str, float]]:
+        with self._lock:
+            return list(self._values.items())
+
+
+def _iter_entries(data, used: int):
+    pos = 8
+    while pos < used:
+        key_len = struct.unpack_from('i', data, pos)[0]
+        pos += 4
+        key = bytes(data[pos:pos + key_len]).decode('utf-8')
+        pos += key_len + (8 - (key_len + 4) % 8)
+        value = struct.unpack_from('d', data, pos)[0]
+        yield key, value, pos
+        pos += 8
+
+
+def _read_file(filename: str) -> List[Tuple[str, float]]:
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if len(data) < 8:
+        return []
+    used = struct.unpack_from('i', data, 0)[0]
+    return [(key, value) for key, value, _ in _iter_entries(data, min(used, len(data)))]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """指标注册表：记录指标定义，按进程选择存储，抓取时合并输出文本格式"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, '_Metric'] = {}
+        self._store = None
+        self._pid = None
+
+    def multiproc_dir(self) -> Optional[str]:
+        return get_metrics_config()['MULTIPROC_DIR']
+
+    def store(self):
+        """当前进程的存储；fork后的子进程使用自己的新文件"""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    directory = self.multiproc_dir()
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                        self._store = _MmapStore(os.path.join(directory, f"metrics_{pid}.db"))
+                    else:
+                        self._store = _DictStore()
+                    self._pid = pid
+        return self._store
+
+    def register(self, metric: '_Metric') -> '_Metric':
+        with self._lock:
+            if metric.name in self._metrics:
+                raise Exception(f"指标 {metric.name} 重复注册")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def _collect_values(self) -> List[Tuple[int, str, float]]:
+        """收集(pid, 键, 值)：多进程模式读取目录下全部进程文件"""
+        directory = self.multiproc_dir()
+        if not directory:
+            store = self.store()
+            return [(os.getpid(), key, value) for key, value in store.items()]
+        self.store()  # 确保本进程文件存在
+        values = []
+        for filename in glob.glob(os.path.join(directory, 'metrics_*.db')):
+            try:
+                pid = int(os.path.basename(filename)[len('metrics_'):-len('.db')])
+            except ValueError:
+                continue
+            values.extend((pid, key, value) for key, value in _read_file(filename))
+        return values
+
+    def generate_latest(self) -> str:
+        """合并所有进程的值，输出Prometheus文本格式（0.0.4）"""
+        merged: Dict[Tuple[str, str, Tuple], float] = {}
+        live_cache: Dict[int, bool] = {}
+        for pid, key, value in self._collect_values():
+            metric_type, mode, name, sample, labels = json.loads(key)
+            labels = tuple(tuple(pair) for pair in labels)
+            if metric_type == 'gauge' and mode in ('all', 'livesum'):
+                if pid not in live_cache:
+                    live_cache[pid] = _pid_alive(pid)
+                if not live_cache[pid]:
+                    continue
+                if mode == 'all':
+                    labels = labels + (('pid', str(pid)),)
+            sample_key = (name, sample, labels)
+            if metric_type == 'gauge' and mode == 'max':
+                merged[sample_key] = max(merged.get(sample_key, value), value)
+            else:
+                merged[sample_key] = merged.get(sample_key, 0.0) + value
+
+        by_metric: Dict[str, List[Tuple[str, Tuple, float]]] = {}
+        for (name, sample, labels), value in merged.items():
+            by_metric.setdefault(name, []).append((sample, labels, value))
+
+        lines = []
+        for name in sorted(by_metric):
+            metric = self._metrics.get(name)
+            samples = by_metric[name]
+            if metric is not None:
+                lines.append(f"# HELP {name} {_escape_help(metric.documentation)}")
+                lines.append(f"# TYPE {name} {metric.type_name}")
+                if isinstance(metric, Histogram):
+                    samples = metric.cumulative(samples)
+            for sample, labels, value in sorted(samples, key=_sample_sort_key):
+                lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _sample_sort_key(item):
+    sample, labels, _ = item
+    le = dict(labels).get('le')
+    return sample, tuple(pair for pair in labels if pair[0] != 'le'), float(le) if le is not None else 0.0
+
+
+def _escape_help(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ''
+    escaped = [
+        f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(10), chr(92) + "n").replace(chr(34), chr(92) + chr(34))}"'
+        for k, v in labels
+    ]
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def get_metrics_config() -> Dict:
+    """合并默认配置与settings.METRICS"""
+    return {**DEFAULT_METRICS_CONFIG, **getattr(settings, 'METRICS', {})}
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric:
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 registry: MetricsRegistry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        self._key_cache: Dict[Tuple, str] = {}
+        registry.register(self)
+
+    def _mode(self) -> str:
+        return ''
+
+    def _labels(self, labels: Dict) -> Tuple[Tuple[str, str], ...]:
+        if set(labels) != set(self.labelnames):
+            raise Exception(f"指标 {self.name} 的标签必须为：{', '.join(self.labelnames) or '无'}（当前：{list(labels)}）")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def _key(self, sample: str, labels: Tuple[Tuple[str, str], ...]) -> str:
+        cache_key = (sample, labels)
+        key = self._key_cache.get(cache_key)
+        if key is None:
+            key = json.dumps([self.type_name, self._mode(), self.name, sample, [list(p) for p in labels]],
+                             ensure_ascii=False)
+            self._key_cache[cache_key] = key
+        return key
+
+
+class Counter(_Metric):
+    """单调递增计数器（多进程求和）"""
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 registry: MetricsRegistry = REGISTRY):
+        if not name.endswith('_total'):
+            name += '_total'
+        super().__init__(name, documentation, labelnames, registry)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise Exception(f"计数器 {self.name} 只能递增")
+        self.registry.store().inc(self._key(self.name, self._labels(labels)), amount)
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值，multiprocess_mode决定多进程合并方式"""
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 registry: MetricsRegistry = REGISTRY, multiprocess_mode: str = 'livesum'):
+        if multiprocess_mode not in GAUGE_MODES:
+            raise Exception(f"gauge合并方式必须为：{', '.join(GAUGE_MODES)}（当前：{multiprocess_mode}）")
+        self.multiprocess_mode = multiprocess_mode
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _mode(self) -> str:
+        return self.multiprocess_mode
+
+    def set(self, value: float, **labels) -> None:
+        self.registry.store().set(self._key(self.name, self._labels(labels)), value)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        self.registry.store().inc(self._key(self.name, self._labels(labels)), amount)
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """分桶直方图：存储各桶独立计数，输出时转为累计的le桶"""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 registry: MetricsRegistry = REGISTRY, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        buckets = sorted(float(b) for b in buckets)
+        if buckets[-1] != float('inf'):
+            buckets.append(float('inf'))
+        self.buckets = tuple(buckets)
+        self._bucket_labels = tuple(_format_value(b) for b in self.buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, **labels) -> None:
+        label_pairs = self._labels(labels)
+        store = self.registry.store()
+        for bound, le in zip(self.buckets, self._bucket_labels):
+            if value <= bound:
+                store.inc(self._key(f"{self.name}_bucket", label_pairs + (('le', le),)), 1)
+                break
+        store.inc(self._key(f"{self.name}_sum", label_pairs), value)
+        store.inc(self._key(f"{self.name}_count", label_pairs), 1)
+
+    def cumulative(self, samples: List[Tuple[str, Tuple, float]]) -> List[Tuple[str, Tuple, float]]:
+        """把各桶独立计数转换为Prometheus要求的累计计数，并补齐缺失的桶"""
+        bucket_name = f"{self.name}_bucket"
+        per_series: Dict[Tuple, Dict[str, float]] = {}
+        others = []
+        for sample, labels, value in samples:
+            if sample == bucket_name:
+                base = tuple(pair for pair in labels if pair[0] != 'le')
+                per_series.setdefault(base, {})[dict(labels)['le']] = value
+            else:
+                others.append((sample, labels, value))
+        result = others
+        for base, counts in per_series.items():
+            running = 0.0
+            for le in self._bucket_labels:
+                running += counts.get(le, 0.0)
+                result.append((bucket_name, base + (('le', le),), running))
+        return result
+
+
+# ---- 应用指标 ----
+
+http_requests = Counter('http_requests', "HTTP请求数", ['route', 'method', 'status'])
+http_request_duration = Histogram('http_request_duration_seconds', "HTTP请求耗时（秒）", ['route'])
+http_request_exceptions = Counter('http_request_exceptions', "视图抛出的异常数", ['route', 'error_class'])
+http_request_phase_seconds = Counter('http_request_phase_seconds', "请求各阶段累计耗时（秒）：connect/sql/render/view",
+                                     ['route', 'phase'])
+http_requests_in_progress = Gauge('http_requests_in_progress', "处理中的请求数", multiprocess_mode='livesum')
+
+db_queries = Counter('db_queries', "pymysql工具函数执行的SQL数", ['kind'])
+db_query_duration = Histogram('db_query_duration_seconds', "pymysql工具函数的SQL耗时（秒）", ['kind'],
+                              buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+db_errors = Counter('db_errors', "数据库错误数", ['code'])
+db_connections = Counter('db_connections', "新建的数据库连接数")
+db_connect_duration = Histogram('db_connect_duration_seconds', "建立数据库连接耗时（秒）",
+                                buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0, 10.0))
+db_transactions = Counter('db_transactions', "with_transaction事务数", ['result'])
+
+orders_created = Counter('orders_created', "创建成功的订单数")
+orders_deleted = Counter('orders_deleted', "删除的订单数")
+order_status_changes = Counter('order_status_changes', "订单状态变更数", ['status'])
+stock_conflicts = Counter('stock_conflicts', "库存不足导致的扣减失败数")
+
+access_log_records = Counter('access_log_records', "访问日志写入结果", ['result'])
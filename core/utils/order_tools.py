@@ -1,7 +1,12 @@
 import datetime
-from core.utils.db import exec_query, exec_update, with_transaction
-from core.utils.product_tools import get_product, update_product_stock
-from typing import List, Dict
+from core.utils.db import exec_query, exec_update, with_transaction, on_commit
+from core.utils.product_tools import decrement_stock_batch
+from core.utils import metrics
+from core.utils.versions import bump_version
+from core.utils.events import publish_event
+from core.utils.singleflight import single_flight
+from core.utils.idempotency import IdempotencyClaim
+from typing import List, Dict, Optional
 import time
 
 @with_transaction
@@ -10,9 +15,17 @@ def create_order(
         cust_name: str,
         cust_phone: str,
         cust_addr: str,
-        items: List[str]
+        items: List[str],
+        idempotency: Optional[IdempotencyClaim] = None
 ) -> str:
+    """
+    创建订单；传入幂等声明时，键行与订单在同一事务中写入，重复请求直接返回首次的结果
+    """
     try:
+        # 步骤0：占用幂等键（先于商品行锁，相同键的并发请求在键上等待，不去争抢商品锁）
+        if idempotency is not None and idempotency.acquire(conn):
+            return idempotency.result
+
         # print(f"开始创建订单，客户: {cust_name}, 电话: {cust_phone}, 商品项: {items}")
 
         # 在函数内部导入，避免循环导入
@@ -46,6 +59,7 @@ def create_order(
         # 步骤3：计算订单总金额+校验商品（使用已锁定的商品）
         total_amount = 0.0
         item_params = []
+        locked_stock = {}  # 商品行已加锁，读到的库存在本事务内不会被并发修改
 
         for item in items:
             if not item.strip():
@@ -64,6 +78,8 @@ def create_order(
                 if not product:
                     raise Exception(f"商品ID {product_id} 不存在")
 
+                locked_stock[product['product_id']] = product['stock']
+
                 # 检查库存
                 if product['stock'] < quantity:
                     raise Exception(f"商品「{product['name']}」库存不足（当前：{product['stock']}，需要：{quantity}）")
@@ -103,24 +119,34 @@ def create_order(
             exec_update(sql=item_sql, params_list=item_params, batch=True, conn=conn)
             # print("订单明细插入成功")
 
-        # 步骤6：扣减商品库存（使用已锁定的连接）
+        # 步骤6：扣减商品库存（使用已锁定的连接，一条条件UPDATE批量扣减并校验）
+        reduce_items = {}
         for item in items:
             if not item.strip():
                 continue
 
             product_id, quantity = item.split(':')
-            # print(f"扣减库存，商品ID: {product_id}, 数量: {quantity}")
-
-            # 直接使用当前事务连接扣减库存
-            update_sql = "UPDATE product SET stock = stock - %s WHERE product_id = %s"
-            exec_update(update_sql, (int(quantity), int(product_id)), conn=conn)
-
-            # 验证库存
-            check_sql = "SELECT stock FROM product WHERE product_id = %s"
-            updated_stock = exec_query(check_sql, (int(product_id),), return_single=True, conn=conn)
-            # print(f"商品 {product_id} 扣减后库存: {updated_stock['stock']}")
-
+            reduce_items[int(product_id)] = reduce_items.get(int(product_id), 0) + int(quantity)
+
+        # 剩余库存由加锁读到的库存直接算出，不再回读
+        decrement_stock_batch(reduce_items, conn=conn, return_remaining=False)
+        remaining = {pid: locked_stock[pid] - qty for pid, qty in reduce_items.items()}
+        # print(f"扣减后库存: {remaining}")
+
+        # 版本号在事务提交后递增（与core/signals.py一致）：若在事务内递增，所有下单/删单都会锁住同样的
+        # data_version行直到提交，互相排队；提交后递增也保证缓存不会在提交前按新版本号读到旧数据
+        # customer:<id>为客户级版本号，customer_detail据此计算ETag
+        on_commit(conn, lambda: bump_version('shop_order', 'shop_order_item', 'product_stock', f'customer:{cust_id}'))
+        # 实时事件在事务提交后推送（回滚不推送）
+        publish_event('order.created', {'order_id': order_id, 'order_code': order_code, 'customer_id': cust_id,
+                                        'total_amount': total_amount}, conn=conn)
+        publish_event('stock.changed', {'stock': remaining}, conn=conn)
+
+        # 事务提交由with_transaction在返回后完成，提交失败会抛出异常，计数偏差可忽略
+        metrics.orders_created.inc()
         result_msg = f"订单创建成功！编号：{order_code}，总金额：{total_amount}元"
+        if idempotency is not None:
+            idempotency.save(conn, result_msg)
         # print(result_msg)
         return result_msg
 
@@ -132,10 +158,12 @@ def create_order(
         raise Exception(error_msg)
 
 
+@single_flight
 def get_order_list(limit: int = 50) -> List[Dict]:
     """
     查询订单列表（跨5表Join，满足实验一"跨数据表操作"基本功能
     关联表：shop_order（订单）→ customer（客户）→ shop_order_item（明细）→ product（商品）→ category（分类）
+    并发的相同调用经single_flight合并为一次查询
     """
     sql = """
           SELECT o.order_id, \
@@ -168,11 +196,16 @@ def update_order_status(order_id: int, status: str) -> str:
         raise Exception(f"状态必须为：{', '.join(valid_status)}（参考表shop_order的status字段注释）")
 
     # 先校验订单存在
-    if not exec_query("SELECT order_id FROM shop_order WHERE order_id = %s", (order_id,)):
+    order = exec_query("SELECT order_id, customer_id FROM shop_order WHERE order_id = %s", (order_id,),
+                       return_single=True)
+    if not order:
         raise Exception(f"订单ID {order_id} 不存在（表：shop_order）")
 
     sql = "UPDATE shop_order SET status = %s WHERE order_id = %s"
     exec_update(sql, (status, order_id))
+    bump_version('shop_order', f"customer:{order['customer_id']}")
+    publish_event('order.status', {'order_id': order_id, 'customer_id': order['customer_id'], 'status': status})
+    metrics.order_status_changes.inc(status=status)
     return f"订单 {order_id} 状态更新为：{status}"
 
 
@@ -182,7 +215,9 @@ def delete_order(conn, order_id: int) -> str:
     删除订单
     """
     # 先检查订单是否存在
-    if not exec_query("SELECT order_id FROM shop_order WHERE order_id = %s", (order_id,), conn=conn):
+    order = exec_query("SELECT order_id, customer_id FROM shop_order WHERE order_id = %s", (order_id,),
+                       return_single=True, conn=conn)
+    if not order:
         raise Exception(f"订单ID {order_id} 不存在（表：shop_order）")
 
     # 获取订单中的商品信息，用于恢复库存
@@ -209,5 +244,11 @@ def delete_order(conn, order_id: int) -> str:
     # 再删除订单
     delete_order_sql = "DELETE FROM shop_order WHERE order_id = %s"
     exec_update(delete_order_sql, (order_id,), conn=conn)
+    # 版本号在事务提交后递增（不在事务内持有data_version行锁）
+    on_commit(conn, lambda: bump_version('shop_order', 'shop_order_item', 'product_stock',
+                                         f"customer:{order['customer_id']}"))
+    publish_event('order.deleted', {'order_id': order_id, 'customer_id': order['customer_id']}, conn=conn)
+    publish_event('stock.changed', {'restored': {item['product_id']: item['quantity'] for item in items}}, conn=conn)
+    metrics.orders_deleted.inc()
 
     return f"订单 {order_id} 已删除（含关联明细：shop_order_item）"
\ No newline at end of file
@@ -1,59 +1,212 @@
 import time
+import random
+from django.conf import settings
 from django.utils import timezone
-from django.http import HttpResponseBase
-from django.db import DatabaseError
-from django.contrib.auth.models import User
-from core.utils.db import exec_update, exec_query
+from django.http import HttpResponseBase, JsonResponse
+from django.db import DatabaseError, connection
+from django.db.models import F
+from core.utils.db import exec_query
 from core.models import AccessLog
+from core.utils.log_writer import access_log_writer, get_buffer_config
+from core.utils.scheduler import background_tasks
+from core.utils.histogram import LatencyHistogram, latency_store, load_histograms
+from core.utils.rollup import query_rollups, summarize_rollups
+from core.utils.request_stats import begin_request_stats, end_request_stats, current_stats, orm_query_wrapper
+from core.utils import metrics
+from core.utils.profiling import profile_reason, run_profiled
+from core.utils.query_audit import new_query_audit
+from core.utils.tracing import start_trace, STATUS_ERROR
+from core.utils.deadline import request_deadline, get_budget
+from core.utils.circuit_breaker import CircuitOpenError
+from core.utils.rows import TupleRows
 import logging
 
 # 创建logger用于记录错误
 logger = logging.getLogger(__name__)
 
+# 访问日志采样默认配置，可在settings.ACCESS_LOG_SAMPLING中按键覆盖
+DEFAULT_SAMPLING_CONFIG = {
+    'DEFAULT_RATE': 1,  # 默认每N个普通请求记录1个（1=全部记录）
+    'PATH_RATES': {},  # 按路径前缀覆盖采样率，如 {'/login/': 10}
+    'SLOW_THRESHOLD': 1.0,  # 耗时超过该秒数的请求总是记录
+}
+
 
 def performance_log(view_func):
     """
-    装饰器：记录视图访问性能（用户、路径、耗时、IP）
+    装饰器：记录视图访问性能（用户、路径、耗时、IP、状态码、异常、响应大小、数据库查询次数与耗时）
+    耗时按阶段拆分（连接/SQL/模板渲染/视图逻辑），并写入Server-Timing响应头；支持按需剖析单个请求
     """
 
-    def wrapper(request, *args, **kwargs) -> HttpResponseBase:
-        # 记录请求初始信息
+    def handle(request, route, *args, **kwargs) -> HttpResponseBase:
+        # 记录请求初始信息（时间戳用于日志，耗时用单调时钟perf_counter_ns计算）
         start_time = timezone.now()
+        start_ns = time.perf_counter_ns()
         user = request.user
         access_path = request.path  # 如：/order/
         client_ip = get_client_ip(request)  # 使用函数获取客户端IP
 
-        # 执行业务视图函数
+        # 统计本请求的数据库查询：pymysql工具函数经db.execute_sql计入，ORM查询经execute_wrapper计入
+        # 查询审计按SQL指纹计数，检测N+1与重复查询（见core/utils/query_audit.py）
+        audit = new_query_audit()
+        stats_token = begin_request_stats(audit)
+        stats = current_stats()
+        metrics.http_requests_in_progress.inc()
+        # 按需剖析（签名请求头 / staff的URL参数 / 随机采样，见core/utils/profiling.py）
+        profiling = profile_reason(request)
+
+        # 执行业务视图函数（请求时间预算经contextvars传到查询层，见core/utils/deadline.py）
+        deadline = None
         try:
-            response = view_func(request, *args, **kwargs)
+            with connection.execute_wrapper(orm_query_wrapper), request_deadline(get_budget(access_path)) as deadline:
+                if profiling:
+                    response = run_profiled(request, profiling, view_func, *args, **kwargs)
+                else:
+                    response = view_func(request, *args, **kwargs)
+            error_class = None
+            if deadline is not None and deadline.exceeded:
+                # 视图大多捕获异常后自行返回错误信息，这里统一改为超时响应
+                response, error_class = deadline_response(deadline), 'DeadlineExceeded'
+            elif stats.circuit_open is not None and response.status_code < 500:
+                # 同理，被熔断器拒绝的请求统一改为503（视图已自行返回5xx的保持不变，如健康检查）
+                response, error_class = circuit_open_response(stats.circuit_open), 'CircuitOpenError'
             status_code = response.status_code
-            error_message = None
         except Exception as e:
-            # 如果视图函数抛出异常，记录异常信息
-            end_time = timezone.now()
-            duration = round((end_time - start_time).total_seconds(), 4)
-            status_code = 500
-            error_message = str(e)
+            if deadline is not None and deadline.exceeded:
+                response, error_class = deadline_response(deadline), 'DeadlineExceeded'
+                status_code = response.status_code
+            elif isinstance(e, CircuitOpenError):
+                response, error_class = circuit_open_response(e), 'CircuitOpenError'
+                status_code = response.status_code
+            else:
+                # 如果视图函数抛出异常，记录异常信息
+                end_time = timezone.now()
+                total_ns = time.perf_counter_ns() - start_ns
+                duration = round(total_ns / 1e9, 4)
+                phases = stats.phases(total_ns)
+                record_request_metrics(request, route, 500, duration, phases, type(e).__name__)
+                log_performance(
+                    user, access_path, start_time, end_time, duration, client_ip,
+                    500, str(e), error_class=type(e).__name__, route=route,
+                    db_query_count=stats.query_count, db_time=round(stats.db_time, 4),
+                    connect_time=round(phases['connect'] / 1e9, 4), render_time=round(phases['render'] / 1e9, 4)
+                )
+                if audit is not None:
+                    audit.report(f"{request.method} {access_path}", raise_on_violation=False)
+                raise  # 重新抛出异常
+        finally:
+            end_request_stats(stats_token)
+            metrics.http_requests_in_progress.dec()
+
+        # 计算耗时并记录日志（写入access_logs表）
+        end_time = timezone.now()
+        total_ns = time.perf_counter_ns() - start_ns
+        duration = round(total_ns / 1e9, 4)  # 耗时（秒，保留4位小数）
+        phases = stats.phases(total_ns)
+        record_request_metrics(request, route, status_code, duration, phases)
+        if server_timing_allowed(request):
+            response['Server-Timing'] = server_timing_header(phases, total_ns, stats.query_count)
+
+        def log_response(rendered):
             log_performance(
                 user, access_path, start_time, end_time, duration, client_ip,
-                status_code, error_message
+                status_code, None, error_class=error_class, response_size=get_response_size(rendered), route=route,
+                db_query_count=stats.query_count, db_time=round(stats.db_time, 4),
+                connect_time=round(phases['connect'] / 1e9, 4), render_time=round(phases['render'] / 1e9, 4)
             )
-            raise  # 重新抛出异常
 
-        # 计算耗时并记录日志（写入access_logs表）
-        end_time = timezone.now()
-        duration = round((end_time - start_time).total_seconds(), 4)  # 耗时（秒，保留4位小数）
+        if getattr(response, 'is_rendered', True):
+            log_response(response)
+        else:
+            # TemplateResponse（如LoginView）在视图返回后才渲染，渲染前不能读取content，渲染完成后再记录大小
+            response.add_post_render_callback(log_response)
 
-        log_performance(
-            user, access_path, start_time, end_time, duration, client_ip,
-            status_code, error_message
-        )
+        if audit is not None:
+            audit.report(f"{request.method} {access_path}")  # 严格模式下违规即抛出QueryAuditError
 
         return response
 
+    def wrapper(request, *args, **kwargs) -> HttpResponseBase:
+        # 请求级追踪：根span覆盖整个请求，事务与查询span挂在其下（见core/utils/tracing.py）
+        route = get_route(request)
+        with start_trace(f"{request.method} {route}", request.headers.get('traceparent'), {
+            'http.method': request.method,
+            'http.route': route,
+            'http.target': request.get_full_path()[:500],
+        }) as span:
+            response = handle(request, route, *args, **kwargs)
+            if span is not None:
+                span.set_attribute('http.status_code', response.status_code)
+                if response.status_code >= 500:
+                    span.status = STATUS_ERROR
+                response['X-Trace-Id'] = span.trace.trace_id
+            return response
+
     return wrapper
 
 
+def deadline_response(deadline):
+    """请求时间预算用尽时的统一响应（504）"""
+    return JsonResponse(
+        {"code": 504, "msg": f"请求超时：处理时间超出 {deadline.budget:g} 秒的预算，请稍后重试或缩小查询范围"},
+        status=504
+    )
+
+
+def circuit_open_response(error):
+    """数据库熔断期间快速失败的统一响应（503，Retry-After为熔断器预计半开的秒数）"""
+    response = JsonResponse({"code": 503, "msg": str(error)}, status=503)
+    response['Retry-After'] = str(getattr(error, 'retry_after', 1))
+    return response
+
+
+def get_route(request):
+    """URL路由模板（如 order/<int:order_id>/），作为指标标签避免按具体ID产生大量时间序列"""
+    match = getattr(request, 'resolver_match', None)
+    return (match.route if match is not None and match.route else request.path)[:200]
+
+
+def server_timing_allowed(request):
+    """是否输出Server-Timing：SERVER_TIMING_HEADER为'staff'时只对staff用户或DEBUG模式输出"""
+    mode = getattr(settings, 'SERVER_TIMING_HEADER', 'staff')
+    if mode == 'staff':
+        return settings.DEBUG or getattr(request.user, 'is_staff', False)
+    return bool(mode)
+
+
+def server_timing_header(phases, total_ns, query_count):
+    """Server-Timing响应头（毫秒），浏览器开发者工具的Timing面板可直接展示各阶段"""
+    return ', '.join([
+        f'db;dur={phases["sql"] / 1e6:.2f};desc="SQL x{query_count}"',
+        f'conn;dur={phases["connect"] / 1e6:.2f};desc="DB connect"',
+        f'render;dur={phases["render"] / 1e6:.2f};desc="Template"',
+        f'view;dur={phases["view"] / 1e6:.2f};desc="View logic"',
+        f'total;dur={total_ns / 1e6:.2f}',
+    ])
+
+
+def record_request_metrics(request, route, status_code, duration, phases=None, error_class=None):
+    """更新进程级请求指标（计数、耗时分布、各阶段累计耗时、异常），供/metrics/抓取"""
+    try:
+        metrics.http_requests.inc(route=route, method=request.method, status=status_code)
+        metrics.http_request_duration.observe(duration, route=route)
+        for phase, phase_ns in (phases or {}).items():
+            metrics.http_request_phase_seconds.inc(phase_ns / 1e9, route=route, phase=phase)
+        if error_class:
+            metrics.http_request_exceptions.inc(route=route, error_class=error_class)
+    except Exception as e:
+        logger.error(f"请求指标记录失败：{str(e)}")
+
+
+def get_response_size(response):
+    """响应体大小（字节），流式响应或尚未渲染的TemplateResponse优先取Content-Length，无法预知时返回None"""
+    if getattr(response, 'streaming', False) or not getattr(response, 'is_rendered', True):
+        length = response.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+    content = getattr(response, 'content', None)
+    return len(content) if content is not None else None
+
+
 def get_client_ip(request):
     """获取客户端真实IP地址"""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -64,28 +217,99 @@ def get_client_ip(request):
     return ip.strip()
 
 
-def log_performance(user, path, start_time, end_time, duration, ip, status_code, error_message):
-    """记录性能日志到数据库"""
+def get_sampling_config():
+    """合并默认配置与settings.ACCESS_LOG_SAMPLING"""
+    return {**DEFAULT_SAMPLING_CONFIG, **getattr(settings, 'ACCESS_LOG_SAMPLING', {})}
+
+
+def get_sample_rate(path, config=None):
+    """路径的采样率N（记录1/N），按最长前缀匹配PATH_RATES，未匹配用DEFAULT_RATE"""
+    config = config or get_sampling_config()
+    rate = config['DEFAULT_RATE']
+    matched = -1
+    for prefix, prefix_rate in config['PATH_RATES'].items():
+        if path.startswith(prefix) and len(prefix) > matched:
+            rate, matched = prefix_rate, len(prefix)
+    return max(int(rate), 1)
+
+
+def sample_weight(path, duration, status_code, error_class):
+    """
+    采样决策：慢请求与错误请求总是记录（权重1）；
+    其余按1/N随机采样，被采中的记录权重为N，汇总时乘以权重即可无偏估计真实请求数
+    返回0表示不写入数据库
+    """
+    config = get_sampling_config()
+    if duration >= config['SLOW_THRESHOLD'] or (status_code or 0) >= 500 or error_class:
+        return 1
+    rate = get_sample_rate(path, config)
+    if rate == 1:
+        return 1
+    return rate if random.random() * rate < 1 else 0
+
+
+def log_performance(user, path, start_time, end_time, duration, ip, status_code, error_message,
+                    error_class=None, response_size=None, db_query_count=0, db_time=0.0,
+                    connect_time=0.0, render_time=0.0, route=None):
+    """记录性能日志（按采样策略决定是否写入；入队由后台线程批量写入，不阻塞请求线程）"""
     try:
-        # 使用Django ORM创建记录
-        AccessLog.objects.create(
+        background_tasks.ensure_started()  # 周期任务（汇总、清理等）在独立的调度线程中执行，不占用日志写入线程
+
+        if error_message:
+            logger.warning(f"请求异常 {path}（{error_class}）：{error_message}")
+
+        # 进程内耗时直方图覆盖全部请求（内存操作，不受采样影响），由后台任务周期持久化
+        # 按路由模板记录（与汇总表一致），按ID区分的URL合为一个直方图
+        latency_store.record(route or path, duration)
+
+        weight = sample_weight(path, duration, status_code, error_class)
+        if not weight:
+            metrics.access_log_records.inc(result='sampled_out')
+            return
+
+        record = AccessLog(
             user=user if user.is_authenticated else None,
             path=path,
+            route=route,
             start_time=start_time,
             end_time=end_time,
             duration=duration,
-            ip=ip
+            ip=ip,
+            status_code=status_code,
+            error_class=error_class[:100] if error_class else None,
+            response_size=response_size,
+            db_query_count=db_query_count,
+            db_time=db_time,
+            connect_time=connect_time,
+            render_time=render_time,
+            sample_weight=weight
         )
 
+        if get_buffer_config()['ENABLED']:
+            submitted = access_log_writer.submit(record)
+            metrics.access_log_records.inc(result='queued' if submitted else 'dropped')
+        else:
+            record.save()
+            metrics.access_log_records.inc(result='saved')
+
     except DatabaseError as e:
         logger.error(f"性能日志记录失败（数据库错误）：{str(e)}")
     except Exception as e:
         logger.error(f"性能日志记录失败：{str(e)}")
 
 
-def get_access_logs(limit: int = 100, user_id=None, path_filter=None):
-    """获取访问性能日志，支持过滤"""
-    # 使用Django ORM查询
+# get_access_logs返回的列（username由auth_user关联得到）
+ACCESS_LOG_COLUMNS = ('log_id', 'user_id', 'username', 'path', 'start_time', 'end_time', 'duration', 'ip',
+                      'status_code', 'error_class', 'response_size', 'db_query_count', 'db_time', 'connect_time',
+                      'render_time', 'sample_weight')
+
+
+def get_access_logs(limit: int = 100, user_id=None, path_filter=None, row_format: str = 'dict'):
+    """
+    获取访问性能日志，支持过滤
+    row_format：dict（默认）每行一个字典；row 每行一个命名元组；tuple 普通元组（列名见结果的columns/index）
+    """
+    # 直接取列值（用户名经JOIN一并取出），不创建模型实例，也不再逐行复制成第二个字典
     queryset = AccessLog.objects.all()
 
     # 添加过滤条件
@@ -95,65 +319,99 @@ def get_access_logs(limit: int = 100, user_id=None, path_filter=None):
     if path_filter:
         queryset = queryset.filter(path__icontains=path_filter)
 
-    # 排序和限制
-    queryset = queryset.order_by('-start_time')[:limit]
-
-    # 转换为字典格式，保持与之前兼容
-    logs = []
-    for log in queryset:
-        logs.append({
-            'log_id': log.log_id,
-            'user_id': log.user_id,
-            'username': log.user.username if log.user else None,
-            'path': log.path,
-            'start_time': log.start_time,
-            'end_time': log.end_time,
-            'duration': log.duration,
-            'ip': log.ip
-        })
-
-    return logs
-
-
-def get_performance_stats(days=7):
-    """获取性能统计信息"""
-    from django.db.models import Count, Avg, Max, Min
+    # 排序和限制：按主键倒序（与写入顺序一致），走主键索引而非对start_time全表排序
+    queryset = queryset.order_by('-log_id').annotate(username=F('user__username'))
+
+    if row_format == 'dict':
+        return list(queryset.values(*ACCESS_LOG_COLUMNS)[:limit])
+    if row_format == 'row':
+        return list(queryset.values_list(*ACCESS_LOG_COLUMNS, named=True)[:limit])
+    if row_format == 'tuple':
+        return TupleRows(queryset.values_list(*ACCESS_LOG_COLUMNS)[:limit], ACCESS_LOG_COLUMNS)
+    raise ValueError(f"不支持的结果格式：{row_format}（可选：dict/row/tuple）")
+
+
+def get_performance_stats(days=7, include_uniques=True):
+    """
+    获取性能统计信息（计数与耗时合计读取分钟/小时汇总表，百分位由各进程的耗时直方图合并得出）
+    独立IP/用户数无法由汇总表得出，仍按start_time索引扫描原始行；只需汇总指标的调用方可传include_uniques=False跳过（两项返回None）
+    """
+    from django.db.models import Count
     from django.utils import timezone
     from datetime import timedelta
 
     # 计算起始时间
     start_date = timezone.now() - timedelta(days=days)
 
-    # 使用Django ORM进行聚合查询
-    stats = AccessLog.objects.filter(
-        start_time__gte=start_date
-    ).aggregate(
-        total_requests=Count('log_id'),
-        avg_duration=Avg('duration'),
-        max_duration=Max('duration'),
-        min_duration=Min('duration'),
-        unique_ips=Count('ip', distinct=True),
-        unique_users=Count('user_id', distinct=True)
-    )
+    stats = summarize_rollups(query_rollups(start_date))
+    total = LatencyHistogram()
+    for hist in load_histograms(start_date).values():
+        total.merge(hist)
+    with_percentiles(stats, total)
+
+    stats['unique_ips'] = None
+    stats['unique_users'] = None
+    if include_uniques:
+        stats.update(AccessLog.objects.filter(
+            start_time__gte=start_date
+        ).aggregate(
+            unique_ips=Count('ip', distinct=True),
+            unique_users=Count('user_id', distinct=True)
+        ))
+
+    return stats
+
+
+def get_path_stats(days=7, limit=20):
+    """按访问路径统计：请求数、错误率、平均耗时、数据库耗时占比（读取汇总表）与耗时百分位（读取耗时直方图），按总耗时降序"""
+    from django.utils import timezone
+    from datetime import timedelta
 
+    start_date = timezone.now() - timedelta(days=days)
+
+    by_path = {}
+    for row in query_rollups(start_date):
+        by_path.setdefault(row.path, []).append(row)
+
+    result = [{'path': path, **summarize_rollups(rows)} for path, rows in by_path.items()]
+    result.sort(key=lambda r: r['total_duration'], reverse=True)
+    result = result[:limit]
+    histograms = load_histograms(start_date)
+    for row in result:
+        with_percentiles(row, histograms.get(row['path']))
+    return result
+
+
+def with_percentiles(stats, histogram):
+    """
+    用耗时直方图的百分位覆盖汇总表的百分位：直方图按每个请求记录（不受采样影响），
+    每PERSIST_INTERVAL秒持久化，比按汇总间隔与延迟窗口推进的汇总表更新更及时
+    """
+    percentiles = histogram.summary() if histogram is not None else {}
+    for key in ('p50', 'p90', 'p99', 'p999'):
+        stats[key] = percentiles.get(key)
     return stats
 
 
-def cleanup_old_logs(days=30):
-    """清理指定天数前的旧日志"""
+def cleanup_old_logs(days=30, chunk_size=5000, pause=0.1, time_budget=None):
+    """清理指定天数前的旧日志（分批删除，见core/utils/retention.py；命令行：manage.py prune_access_logs）"""
     try:
         from django.utils import timezone
         from datetime import timedelta
+        from core.utils.retention import purge_access_logs
 
         # 计算截止日期
         cutoff_date = timezone.now() - timedelta(days=days)
 
-        # 删除旧日志
-        deleted_count, _ = AccessLog.objects.filter(
-            start_time__lt=cutoff_date
-        ).delete()
+        # 按主键分批删除，每批独立提交，避免单个大事务锁表
+        result = purge_access_logs(cutoff_date, chunk_size=chunk_size, pause=pause, time_budget=time_budget)
+        deleted_count = result['deleted']
 
-        logger.info(f"清理了 {deleted_count} 条 {days} 天前的日志记录")
+        if result.get('skipped'):
+            logger.warning(f"跳过清理 {days} 天前的日志记录：{result['skipped']}")
+        else:
+            logger.info(f"清理了 {deleted_count} 条 {days} 天前的日志记录"
+                        f"{'' if result['finished'] else '（时间预算用尽，剩余留到下次）'}")
         return deleted_count
     except Exception as e:
         logger.error(f"清理旧日志失败：{str(e)}")
@@ -171,9 +429,17 @@ def get_access_logs_sql(limit: int = 100):
                  start_time, \
                  end_time, \
                  duration, \
-                 ip
+                 ip, \
+                 status_code, \
+                 error_class, \
+                 response_size, \
+                 db_query_count, \
+                 db_time, \
+                 connect_time, \
+                 render_time, \
+                 sample_weight
           FROM access_logs
-          ORDER BY start_time DESC
+          ORDER BY log_id DESC
               LIMIT %s \
           """
     return exec_query(sql, (limit,))
\ No newline at end of file
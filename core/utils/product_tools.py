@@ -1,72 +1,256 @@
 from core.utils.db import exec_query, exec_update
 from typing import Dict, List
 
-from core.utils.db import exec_query, exec_update
-from typing import Dict, List
-import time
+from core.utils.db import exec_query, exec_update, get_db_conn, execute_sql
+from core.utils.catalog_cache import catalog_cache
+from core.utils import metrics
+from core.utils.versions import bump_version
+from core.utils.events import publish_event
+from typing import Dict, List, Optional
+from itertools import islice
+import pymysql
 
 
 def get_product(product_id: int) -> Dict:
     """
-    查询商品
+    查询商品（目录信息走进程内缓存，库存实时查询）
     """
-    sql = """
-          SELECT p.product_id, p.name, p.price, p.stock, GROUP_CONCAT(c.name) AS categories
-          FROM product p
-                   LEFT JOIN product_category pc ON p.product_id = pc.product_id
-                   LEFT JOIN category c ON pc.category_id = c.category_id
-          WHERE p.product_id = %s
-          GROUP BY p.product_id \
-          """
-    product = exec_query(sql, (product_id,), return_single=True)
+    product = catalog_cache.get_product(product_id)
     if not product:
         raise Exception(f"商品ID {product_id} 不存在（表：product）")
     return product
 
 
+# 条件扣减：库存充足才更新；LAST_INSERT_ID(expr)把扣减后的库存放进OK包，
+# 通过cursor.lastrowid随同一次往返返回，无需再查询
+DECREMENT_STOCK_SQL = """
+                      UPDATE product
+                      SET stock = LAST_INSERT_ID(stock - %s)
+                      WHERE product_id = %s
+                        AND stock >= %s
+                      """
+
+
+def decrement_stock(product_id: int, qty: int, conn: Optional[pymysql.connections.Connection] = None) -> Optional[int]:
+    """
+    原子扣减单个商品库存（单条UPDATE，影响行数决定成败）
+    返回扣减后的剩余库存；库存不足或商品不存在时返回None
+    """
+    if qty <= 0:
+        raise Exception(f"扣减数量必须为正数（当前：{qty}）")
+
+    local_conn = None
+    cursor = None
+    try:
+        local_conn = conn or get_db_conn()
+        cursor = local_conn.cursor()
+        execute_sql(cursor, DECREMENT_STOCK_SQL, (qty, product_id, qty))
+        if conn is None:
+            local_conn.commit()
+        if cursor.rowcount != 1:
+            metrics.stock_conflicts.inc()
+            return None
+        return cursor.lastrowid
+    except Exception as e:
+        if conn is None and local_conn and local_conn.open:
+            local_conn.rollback()
+        raise Exception(f"库存扣减失败（商品ID：{product_id}，数量：{qty}）：{str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if local_conn and local_conn.open and conn is None:
+            local_conn.close()
+
+
+def decrement_stock_batch(
+        items: Dict[int, int],
+        conn: Optional[pymysql.connections.Connection] = None,
+        return_remaining: bool = True
+) -> Optional[Dict[int, int]]:
+    """
+    批量原子扣减库存（全部成功或全部失败）
+    items: {商品ID: 扣减数量}；返回 {商品ID: 剩余库存}，return_remaining=False时返回None
+    一条 UPDATE ... CASE 完成全部扣减，影响行数不足即回滚并定位库存不足的商品
+    MySQL的UPDATE不能返回多行的新值（单商品的LAST_INSERT_ID(expr)只能带回一个值），
+    剩余库存需要在同一事务内再读一次（行已被本事务加锁，读到的即扣减结果）；
+    调用方已持有行锁并读过库存时（如create_order）可传return_remaining=False省去这次往返，自行计算
+    """
+    items = {int(pid): int(qty) for pid, qty in items.items()}
+    if not items:
+        return {}
+    if any(qty <= 0 for qty in items.values()):
+        raise Exception(f"扣减数量必须为正数（当前：{items}）")
+
+    product_ids = sorted(items)  # 固定加锁顺序，降低死锁概率
+    case_sql = ' '.join(['WHEN %s THEN %s'] * len(product_ids))
+    case_params = [v for pid in product_ids for v in (pid, items[pid])]
+    placeholders = ','.join(['%s'] * len(product_ids))
+    update_sql = f"""
+                 UPDATE product
+                 SET stock = stock - CASE product_id {case_sql} END
+                 WHERE product_id IN ({placeholders})
+                   AND stock >= CASE product_id {case_sql} END
+                 """
+    params = case_params + product_ids + case_params
+
+    local_conn = None
+    cursor = None
+    try:
+        local_conn = conn or get_db_conn()
+        cursor = local_conn.cursor()
+        execute_sql(cursor, update_sql, params)
+
+        if cursor.rowcount != len(product_ids):
+            metrics.stock_conflicts.inc()
+            if conn is not None:
+                # 外部事务中部分行已扣减，无法区分哪些不足，由调用方整体回滚
+                raise Exception("部分商品库存不足，扣减未完成")
+            # 失败路径：回滚后查询当前库存，给出具体的不足商品
+            local_conn.rollback()
+            execute_sql(cursor, f"SELECT product_id, stock FROM product WHERE product_id IN ({placeholders})", product_ids)
+            stocks = {row['product_id']: row['stock'] for row in cursor.fetchall()}
+            shortages = [
+                f"商品ID {pid} 不存在" if pid not in stocks
+                else f"商品ID {pid} 库存不足（当前：{stocks[pid]}，需扣减：{items[pid]}）"
+                for pid in product_ids if pid not in stocks or stocks[pid] < items[pid]
+            ]
+            raise Exception('；'.join(shortages) or "库存已被并发修改，请重试")
+
+        remaining = None
+        if return_remaining:
+            execute_sql(cursor, f"SELECT product_id, stock FROM product WHERE product_id IN ({placeholders})", product_ids)
+            remaining = {row['product_id']: row['stock'] for row in cursor.fetchall()}
+        if conn is None:
+            local_conn.commit()
+        return remaining
+    except Exception as e:
+        if conn is None and local_conn and local_conn.open:
+            local_conn.rollback()
+        raise Exception(f"批量库存扣减失败：{str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if local_conn and local_conn.open and conn is None:
+            local_conn.close()
+
+
 def update_product_stock(product_id: int, reduce_qty: int) -> str:
     """
-    扣减商品库存（带锁等待超时处理）
+    扣减商品库存（单条条件UPDATE，无需先查后改，也不存在读写之间的竞态）
     """
-    max_retries = 5
-    base_delay = 0.5  # 基础延迟0.5秒
-
-    for attempt in range(max_retries):
-        try:
-            # 先查库存，再扣减
-            product = get_product(product_id)
-            if product['stock'] < reduce_qty:
-                raise Exception(f"商品「{product['name']}」库存不足（当前：{product['stock']}，需扣减：{reduce_qty}）")
-
-            sql = "UPDATE product SET stock = stock - %s WHERE product_id = %s"
-            result = exec_update(sql, (reduce_qty, product_id))
-
-            # 验证更新是否成功
-            updated_product = get_product(product_id)
-            if updated_product['stock'] != product['stock'] - reduce_qty:
-                raise Exception(
-                    f"库存更新失败，预期库存: {product['stock'] - reduce_qty}，实际库存: {updated_product['stock']}")
-
-            return f"库存扣减成功，剩余：{updated_product['stock']}"
-
-        except Exception as e:
-            if "Lock wait timeout" in str(e) and attempt < max_retries - 1:
-                wait_time = base_delay * (2 ** attempt)  # 指数退避
-                print(f"锁等待超时，第{attempt + 1}次重试，等待{wait_time}秒...")
-                time.sleep(wait_time)
-                continue
-            else:
-                raise Exception(f"库存扣减失败（尝试{attempt + 1}次）: {str(e)}")
+    remaining = decrement_stock(product_id, reduce_qty)
+    if remaining is None:
+        product = get_product(product_id)  # 仅失败路径查询，用于给出具体原因
+        raise Exception(f"商品「{product['name']}」库存不足（当前：{product['stock']}，需扣减：{reduce_qty}）")
+    bump_version('product_stock')
+    publish_event('stock.changed', {'stock': {product_id: remaining}})
+    return f"库存扣减成功，剩余：{remaining}"
 
 
 def get_product_list(limit: int = 100) -> List[Dict]:
-    """获取商品列表"""
-    sql = """
-          SELECT p.product_id, p.name, p.price, p.stock, GROUP_CONCAT(c.name) AS categories
-          FROM product p
-                   LEFT JOIN product_category pc ON p.product_id = pc.product_id
-                   LEFT JOIN category c ON pc.category_id = c.category_id
-          GROUP BY p.product_id
-              LIMIT %s \
-          """
-    return exec_query(sql, (limit,))
\ No newline at end of file
+    """获取商品列表（目录信息走进程内缓存，库存实时查询）"""
+    return catalog_cache.get_product_list(limit)
+
+
+BROWSE_SORTS = ('id', 'price', '-price', 'stock', '-stock')
+
+
+def _bitmap_to_ids(bitmap: int) -> List[int]:
+    """位图转商品ID列表（升序）"""
+    bits = bin(bitmap)[:1:-1]  # 去掉'0b'前缀并反转，下标即商品ID
+    return [pid for pid, bit in enumerate(bits) if bit == '1']
+
+
+def browse_products(
+        category_ids: Optional[List[int]] = None,
+        match: str = 'any',
+        sort: str = 'id',
+        page: int = 1,
+        page_size: int = 20
+) -> Dict:
+    """
+    按分类筛选浏览商品（分页+分面计数）
+    分类筛选基于目录缓存中预计算的分类位图求交（all）/求并（any），不再逐请求Join；
+    分面计数为当前结果集中各分类的商品数；库存仍实时查询
+    """
+    if match not in ('any', 'all'):
+        raise Exception(f"匹配方式必须为：any、all（当前：{match}）")
+    if sort not in BROWSE_SORTS:
+        raise Exception(f"排序方式必须为：{', '.join(BROWSE_SORTS)}（当前：{sort}）")
+    page = max(int(page), 1)
+    page_size = min(max(int(page_size), 1), 100)
+
+    catalog_cache.refresh()
+    snapshot = catalog_cache.snapshot
+
+    category_ids = [int(cid) for cid in category_ids or []]
+    unknown = [cid for cid in category_ids if cid not in snapshot.category_bitmaps]
+    if unknown:
+        raise Exception(f"分类ID {unknown} 不存在（表：category）")
+
+    # 分类位图求交/求并
+    if not category_ids:
+        bitmap = snapshot.all_bitmap
+    elif match == 'all':
+        bitmap = snapshot.all_bitmap
+        for cid in category_ids:
+            bitmap &= snapshot.category_bitmaps[cid]
+    else:
+        bitmap = 0
+        for cid in category_ids:
+            bitmap |= snapshot.category_bitmaps[cid]
+    bitmap &= snapshot.all_bitmap
+
+    facets = [
+        {'category_id': cid, 'name': name, 'count': (bitmap & snapshot.category_bitmaps.get(cid, 0)).bit_count()}
+        for cid, name in sorted(snapshot.category_names.items())
+    ]
+    total = bitmap.bit_count()
+    offset = (page - 1) * page_size
+
+    items = []
+    if total and offset < total:
+        descending = sort.startswith('-')
+        if sort.lstrip('-') == 'stock':
+            # 库存实时变化，排序交给数据库（单表主键IN查询，无Join）
+            direction = 'DESC' if descending else 'ASC'
+            if bitmap == snapshot.all_bitmap:
+                sql = f"SELECT product_id, stock FROM product ORDER BY stock {direction}, product_id LIMIT %s OFFSET %s"
+                params = (page_size, offset)
+            else:
+                matched_ids = _bitmap_to_ids(bitmap)
+                placeholders = ','.join(['%s'] * len(matched_ids))
+                sql = f"""
+                      SELECT product_id, stock FROM product
+                      WHERE product_id IN ({placeholders})
+                      ORDER BY stock {direction}, product_id
+                      LIMIT %s OFFSET %s
+                      """
+                params = tuple(matched_ids) + (page_size, offset)
+            rows = exec_query(sql, params)
+            items = [catalog_cache.build_product(snapshot, row['product_id'], row['stock']) for row in rows]
+        else:
+            # 单价/ID顺序在加载时已预排序，按位图过滤后直接分页
+            order = snapshot.price_order if sort.lstrip('-') == 'price' else snapshot.product_ids
+            if descending:
+                order = reversed(order)
+            if bitmap == snapshot.all_bitmap:
+                matched = order
+            else:
+                members = set(_bitmap_to_ids(bitmap))
+                matched = (pid for pid in order if pid in members)
+            page_ids = list(islice(matched, offset, offset + page_size))
+
+            placeholders = ','.join(['%s'] * len(page_ids))
+            rows = exec_query(f"SELECT product_id, stock FROM product WHERE product_id IN ({placeholders})",
+                              tuple(page_ids))
+            stocks = {row['product_id']: row['stock'] for row in rows}
+            items = [catalog_cache.build_product(snapshot, pid, stocks[pid]) for pid in page_ids if pid in stocks]
+
+    return {
+        'total': total,
+        'page': page,
+        'page_size': page_size,
+        'items': [item for item in items if item],
+        'facets': facets,
+    }
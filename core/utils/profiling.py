@@ -0,0 +1,228 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+# 默认配置，可在settings.REQUEST_PROFILING中按键覆盖
+DEFAULT_PROFILING_CONFIG = {
+    'ENABLED': True,
+    'DIR': None,  # 剖析文件目录，未配置时为 BASE_DIR/profiles
+    'SAMPLE_RATE': 0,  # 每N个请求随机剖析1个（0=不随机剖析）
+    'HEADER': 'X-Profile',  # 携带签名令牌的请求头（令牌由 manage.py make_profile_token 生成）
+    'TOKEN_MAX_AGE': 3600,  # 令牌有效期（秒）
+    'QUERY_PARAM': '_profile',  # staff用户在URL上附加 ?_profile=1 即剖析本次请求
+    'MAX_FILES': 200,  # 最多保留的剖析数
+    'MAX_AGE_DAYS': 7,  # 剖析保留天数
+    'STACK_DEPTH': 64,  # 折叠栈最大深度
+}
+
+TOKEN_SALT = 'core.request-profiling'
+TOKEN_VALUE = 'profile'
+# 剖析名只允许时间戳、路由与随机后缀组成的字符，下载时据此校验防止路径穿越
+PROFILE_NAME_RE = re.compile(r'^[0-9A-Za-z_.-]+$')
+PROFILE_KINDS = {'prof': '.prof', 'collapsed': '.collapsed.txt'}
+
+# cProfile同一时刻只能有一个实例启用（3.12起基于sys.monitoring），并发请求中只剖析一个
+_profile_lock = threading.Lock()
+
+
+def get_profiling_config() -> Dict:
+    """合并默认配置与settings.REQUEST_PROFILING"""
+    return {**DEFAULT_PROFILING_CONFIG, **getattr(settings, 'REQUEST_PROFILING', {})}
+
+
+def get_profile_dir(config: Optional[Dict] = None) -> str:
+    config = config or get_profiling_config()
+    return str(config['DIR'] or os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def make_profile_token() -> str:
+    """生成剖析令牌（带时间戳签名，有效期见TOKEN_MAX_AGE）"""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(TOKEN_VALUE)
+
+
+def _valid_token(token: str, max_age: int) -> bool:
+    try:
+        return signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=max_age) == TOKEN_VALUE
+    except signing.BadSignature:
+        return False
+
+
+def profile_reason(request) -> Optional[str]:
+    """判断本次请求是否剖析，返回触发方式（header/param/sample），不剖析返回None"""
+    config = get_profiling_config()
+    if not config['ENABLED']:
+        return None
+
+    token = request.headers.get(config['HEADER'])
+    if token and _valid_token(token, config['TOKEN_MAX_AGE']):
+        return 'header'
+
+    if request.GET.get(config['QUERY_PARAM']) and getattr(request.user, 'is_staff', False):
+        return 'param'
+
+    rate = int(config['SAMPLE_RATE'] or 0)
+    if rate > 0 and random.random() * rate < 1:
+        return 'sample'
+    return None
+
+
+def run_profiled(request, reason: str, view_func, *args, **kwargs):
+    """
+    在cProfile下执行视图，保存剖析结果并在响应头X-Profile-Id中返回剖析名
+    已有请求在剖析时直接执行视图（不排队等待）
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return view_func(request, *args, **kwargs)
+
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    response = None
+    try:
+        profiler.enable()
+        try:
+            response = view_func(request, *args, **kwargs)
+        finally:
+            profiler.disable()
+    finally:
+        _profile_lock.release()
+        duration = time.perf_counter() - start
+        try:
+            name = save_profile(profiler, request, reason, duration,
+                                getattr(response, 'status_code', 500))
+            if response is not None:
+                response['X-Profile-Id'] = name
+        except Exception as e:
+            logger.error(f"保存请求剖析失败（{request.path}）：{str(e)}")
+    return response
+
+
+def collapse_stacks(stats: pstats.Stats, max_depth: int = 64) -> Dict[str, int]:
+    """
+    把cProfile的调用关系转成折叠栈（flamegraph.pl / speedscope可直接读取），值为自身耗时（微秒）
+    cProfile只记录调用边，同一函数的耗时按各调用边的累计耗时比例分摊到不同栈
+    """
+    raw = stats.stats
+    callees: Dict = {}
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, (_, _, _, edge_ct) in callers.items():
+            callees.setdefault(caller, []).append((func, edge_ct))
+
+    def label(func) -> str:
+        filename, line, name = func
+        if filename == '~':
+            return name.replace(';', ':')
+        return f"{name} ({os.path.basename(filename)}:{line})".replace(';', ':')
+
+    stacks: Dict[str, int] = {}
+
+    def walk(func, path: List[str], on_path: set, inclusive: float) -> None:
+        _, _, tt, ct, _ = raw[func]
+        scale = inclusive / ct if ct else 0.0
+        path = path + [label(func)]
+        self_us = int(tt * scale * 1e6)
+        if self_us > 0:
+            key = ';'.join(path)
+            stacks[key] = stacks.get(key, 0) + self_us
+        if len(path) >= max_depth:
+            return
+        for child, edge_ct in callees.get(func, ()):
+            if child in on_path or child not in raw:
+                continue
+            walk(child, path, on_path | {child}, edge_ct * scale)
+
+    roots = [func for func, (_, _, _, _, callers) in raw.items() if not callers]
+    for root in roots:
+        walk(root, [], {root}, raw[root][3])
+    return stacks
+
+
+def save_profile(profiler: cProfile.Profile, request, reason: str, duration: float, status_code: int) -> str:
+    """保存pstats、折叠栈与元数据三个文件，随后按保留策略清理，返回剖析名"""
+    config = get_profiling_config()
+    directory = get_profile_dir(config)
+    os.makedirs(directory, exist_ok=True)
+
+    match = getattr(request, 'resolver_match', None)
+    route = match.route if match is not None and match.route else request.path
+    slug = re.sub(r'[^0-9A-Za-z]+', '-', route).strip('-')[:60] or 'root'
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}_{slug}_{os.getpid()}_{random.randrange(16 ** 6):06x}"
+    base = os.path.join(directory, name)
+
+    profiler.dump_stats(base + PROFILE_KINDS['prof'])
+    stats = pstats.Stats(profiler)
+    stacks = collapse_stacks(stats, config['STACK_DEPTH'])
+    with open(base + PROFILE_KINDS['collapsed'], 'w', encoding='utf-8') as f:
+        for stack, value in sorted(stacks.items()):
+            f.write(f"{stack} {value}\n")
+
+    meta = {
+        'name': name,
+        'path': request.path,
+        'route': route,
+        'method': request.method,
+        'status_code': status_code,
+        'duration': round(duration, 4),
+        'reason': reason,
+        'user': request.user.username if getattr(request.user, 'is_authenticated', False) else None,
+        'created': time.time(),
+        'total_calls': stats.total_calls,
+    }
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    prune_profiles(config)
+    return name
+
+
+def list_profiles(limit: Optional[int] = None) -> List[Dict]:
+    """列出已保存的剖析（按时间倒序）"""
+    directory = get_profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    profiles.sort(key=lambda p: p.get('created', 0), reverse=True)
+    return profiles[:limit] if limit else profiles
+
+
+def get_profile_file(name: str, kind: str = 'prof') -> Optional[str]:
+    """剖析文件的完整路径（名称或类型非法、文件不存在时返回None）"""
+    if kind not in PROFILE_KINDS or not PROFILE_NAME_RE.match(name or ''):
+        return None
+    path = os.path.join(get_profile_dir(), name + PROFILE_KINDS[kind])
+    return path if os.path.isfile(path) else None
+
+
+def prune_profiles(config: Optional[Dict] = None) -> int:
+    """按保留天数与最大数量删除旧剖析，返回删除的剖析数"""
+    config = config or get_profiling_config()
+    directory = get_profile_dir(config)
+    profiles = list_profiles()
+    expire_before = time.time() - config['MAX_AGE_DAYS'] * 86400
+    expired = [p for i, p in enumerate(profiles)
+               if i >= config['MAX_FILES'] or p.get('created', 0) < expire_before]
+    for profile in expired:
+        for suffix in list(PROFILE_KINDS.values()) + ['.json']:
+            try:
+                os.remove(os.path.join(directory, profile['name'] + suffix))
+            except FileNotFoundError:
+                pass
+    return len(expired)
@@ -0,0 +1,181 @@
+import logging
+import os
+import re
+import traceback
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.db import connection
+from core.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# 默认配置，可在settings.QUERY_AUDIT中按键覆盖
+DEFAULT_AUDIT_CONFIG = {
+    'ENABLED': True,
+    'REPEAT_THRESHOLD': 10,  # 同一指纹（SQL结构相同、参数不同）执行次数达到该值视为N+1
+    'DUPLICATE_THRESHOLD': 3,  # 完全相同的SQL与参数执行次数达到该值视为重复查询
+    'TOTAL_THRESHOLD': 100,  # 单个请求查询总数达到该值时告警
+    'STACK_DEPTH': 8,  # 记录的调用栈帧数（只保留项目代码）
+    'STRICT': False,  # 严格模式（测试用）：出现违规时请求抛出QueryAuditError
+}
+
+VIOLATION_KINDS = ('repeated', 'duplicate', 'total')
+
+query_audit_violations = metrics.Counter('query_audit_violations', "查询审计违规次数", ['kind'])
+
+# 归一化用的正则：字符串/数字字面量、占位符、IN列表、多余空白
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"%s|%\([^)]+\)s")
+_IN_LIST_RE = re.compile(r"\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_VALUES_RE = re.compile(r"\bvalues\s*\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*")
+_SPACE_RE = re.compile(r"\s+")
+
+# 调用栈中跳过的基础设施文件（只保留业务代码位置）
+_SKIP_FILES = ('query_audit.py', 'request_stats.py', 'db.py', 'performance.py', 'profiling.py')
+
+
+class QueryAuditError(Exception):
+    """严格模式下请求存在N+1/重复查询时抛出"""
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql: str) -> str:
+    """SQL指纹：字面量与占位符替换为?，IN列表/VALUES列表折叠，统一小写与空白"""
+    text = _STRING_RE.sub('?', sql)
+    text = _PLACEHOLDER_RE.sub('?', text)
+    text = _NUMBER_RE.sub('?', text)
+    text = _SPACE_RE.sub(' ', text).strip().lower()
+    text = _IN_LIST_RE.sub('in (...)', text)
+    text = _VALUES_RE.sub('values (...)', text)
+    return text
+
+
+def get_audit_config() -> Dict:
+    """合并默认配置与settings.QUERY_AUDIT"""
+    return {**DEFAULT_AUDIT_CONFIG, **getattr(settings, 'QUERY_AUDIT', {})}
+
+
+def _capture_stack(depth: int) -> List[str]:
+    """当前调用栈中的项目代码帧（由内到外最多depth帧）"""
+    base_dir = str(settings.BASE_DIR)
+    frames = []
+    for frame in reversed(traceback.extract_stack()):
+        filename = frame.filename
+        if not filename.startswith(base_dir) or os.path.basename(filename) in _SKIP_FILES:
+            continue
+        frames.append(f"{os.path.relpath(filename, base_dir)}:{frame.lineno} in {frame.name}")
+        if len(frames) >= depth:
+            break
+    return frames
+
+
+def _params_key(params) -> str:
+    try:
+        return repr(params)
+    except Exception:
+        return str(id(params))
+
+
+class QueryAudit:
+    """
+    单个请求的查询审计：按指纹计数，超过阈值时记录一次违规及其调用栈
+    调用栈只在达到阈值的那次查询时采集，正常请求没有额外开销
+    """
+    __slots__ = ('config', 'fingerprints', 'statements', 'total', 'violations')
+
+    def __init__(self, config: Optional[Dict] = None):
+        self.config = config or get_audit_config()
+        self.fingerprints: Dict[str, List] = {}  # 指纹 -> [次数, 累计耗时]
+        self.statements: Dict[tuple, int] = {}  # (SQL, 参数) -> 次数
+        self.total = 0
+        self.violations: List[Dict] = []
+
+    def record(self, sql: str, params, duration: float) -> None:
+        fp = fingerprint(sql)
+        entry = self.fingerprints.get(fp)
+        if entry is None:
+            entry = self.fingerprints[fp] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += duration
+        self.total += 1
+
+        if entry[0] == self.config['REPEAT_THRESHOLD']:
+            self._violate('repeated', fp)
+        key = (sql, _params_key(params))
+        count = self.statements[key] = self.statements.get(key, 0) + 1
+        if count == self.config['DUPLICATE_THRESHOLD']:
+            self._violate('duplicate', fp, statement=key)
+        if self.total == self.config['TOTAL_THRESHOLD']:
+            self._violate('total', fp)
+
+    def _violate(self, kind: str, fp: str, statement: Optional[tuple] = None) -> None:
+        self.violations.append({
+            'kind': kind,
+            'fingerprint': fp,
+            'statement': statement,
+            'stack': _capture_stack(self.config['STACK_DEPTH']),
+        })
+
+    def summary(self) -> List[Dict]:
+        """违规汇总（次数为请求结束时的最终值）"""
+        result = []
+        for violation in self.violations:
+            if violation['kind'] == 'total':
+                count = self.total
+            elif violation['kind'] == 'duplicate':
+                count = self.statements[violation['statement']]
+            else:
+                count = self.fingerprints[violation['fingerprint']][0]
+            result.append({
+                'kind': violation['kind'],
+                'fingerprint': violation['fingerprint'],
+                'count': count,
+                'time': round(self.fingerprints[violation['fingerprint']][1], 4),
+                'stack': violation['stack'],
+            })
+        return result
+
+    def report(self, label: str, raise_on_violation: Optional[bool] = None) -> List[Dict]:
+        """记录违规日志与指标；严格模式下抛出QueryAuditError"""
+        violations = self.summary()
+        if not violations:
+            return violations
+        lines = []
+        for v in violations:
+            query_audit_violations.inc(kind=v['kind'])
+            lines.append(f"[{v['kind']}] {v['count']} 次 / {v['time']} 秒：{v['fingerprint'][:200]}")
+            lines.extend(f"    at {frame}" for frame in v['stack'])
+        message = f"查询审计 {label}：共 {self.total} 次查询，{len(violations)} 项违规\n" + '\n'.join(lines)
+        logger.warning(message)
+        strict = self.config['STRICT'] if raise_on_violation is None else raise_on_violation
+        if strict:
+            raise QueryAuditError(message)
+        return violations
+
+
+def new_query_audit() -> Optional[QueryAudit]:
+    """按配置创建请求的审计对象（未启用时返回None）"""
+    config = get_audit_config()
+    return QueryAudit(config) if config['ENABLED'] else None
+
+
+@contextmanager
+def audit_queries(label: str = 'block', strict: Optional[bool] = None):
+    """
+    在请求之外审计一段代码（脚本、测试），同时统计pymysql工具函数与ORM查询：
+        with audit_queries('print_stats', strict=True) as audit:
+            ...
+    """
+    from core.utils.request_stats import begin_request_stats, end_request_stats, orm_query_wrapper
+
+    audit = QueryAudit()
+    token = begin_request_stats(audit)
+    try:
+        with connection.execute_wrapper(orm_query_wrapper):
+            yield audit
+    finally:
+        end_request_stats(token)
+    audit.report(label, raise_on_violation=strict)
@@ -0,0 +1,173 @@
+import datetime
+import logging
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+from django.conf import settings
+from core.utils import metrics
+from core.utils.analytics import SalesFrame, sales_analytics
+from core.utils.catalog_cache import catalog_cache
+from core.utils.scheduler import background_tasks
+
+logger = logging.getLogger(__name__)
+
+# 默认配置，可在settings.RECOMMENDATIONS中按键覆盖
+DEFAULT_RECOMMENDATION_CONFIG = {
+    'TOP_K': 10,  # 每个商品保留的关联商品数
+    'MIN_PAIR_COUNT': 2,  # 共同出现少于该订单数的商品对不推荐（过滤偶然组合）
+    'METRIC': 'lift',  # 排序依据：lift（提升度）或confidence（置信度）
+    'MAX_BASKET_SIZE': 50,  # 商品种类超过该数的订单不参与配对（批发类大单会产生大量无意义的组合）
+    'REFRESH_INTERVAL': 60,  # 后台检查新订单并重建的间隔（秒）
+}
+
+recommendation_build_duration = metrics.Histogram('recommendation_build_seconds', "关联推荐重建耗时（秒）",
+                                                  buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0))
+recommendation_pairs = metrics.Gauge('recommendation_pairs', "关联推荐保留的商品对数（共现矩阵非零项）",
+                                     multiprocess_mode='max')
+
+
+def get_recommendation_config() -> Dict:
+    """合并默认配置与settings.RECOMMENDATIONS"""
+    return {**DEFAULT_RECOMMENDATION_CONFIG, **getattr(settings, 'RECOMMENDATIONS', {})}
+
+
+class Neighbour(NamedTuple):
+    product_id: int
+    co_count: int  # 同时购买的订单数
+    confidence: float  # 买了A的订单中也买了B的比例
+    lift: float  # confidence / B的整体购买率，>1表示比随机搭配更常一起购买
+
+
+class RecommendationModel(NamedTuple):
+    """一次构建的结果（整体替换，读者无需加锁）"""
+    frame: SalesFrame  # 构建所用的销售数据快照，快照变化即需要重建
+    built_at: datetime.datetime
+    orders: int
+    metric: str
+    neighbours: Dict[int, Tuple[Neighbour, ...]]  # {商品ID: 按得分降序的关联商品}
+
+
+def basket_pairs(order_ids: np.ndarray, products: np.ndarray, max_basket_size: int):
+    """
+    由 (订单, 商品) 明细生成共现矩阵的上三角（COO：行商品 < 列商品，值为共同出现的订单数）
+    返回 (行, 列, 次数, 每个商品出现的订单数, 订单数)；同一订单重复的商品只计一次
+    按购物篮大小s分组：同为s种商品的订单排成 (订单数, s) 矩阵，用上三角下标一次取出全部商品对
+    """
+    size = int(products.max()) + 1 if products.size else 1
+    # 订单内去重并按 (订单, 商品) 排序
+    keys = np.unique(order_ids.astype(np.int64) * size + products)
+    basket_order, basket_product = keys // size, keys % size
+    support = np.bincount(basket_product, minlength=size)
+    if keys.size == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, support, 0
+
+    starts = np.flatnonzero(np.r_[True, basket_order[1:] != basket_order[:-1]])
+    sizes = np.diff(np.r_[starts, keys.size])
+    rows, cols = [], []
+    for s in np.unique(sizes):
+        if s < 2 or s > max_basket_size:
+            continue
+        matrix = basket_product[starts[sizes == s][:, None] + np.arange(s)]
+        upper_i, upper_j = np.triu_indices(s, 1)
+        rows.append(matrix[:, upper_i].ravel())
+        cols.append(matrix[:, upper_j].ravel())
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, support, starts.size
+
+    pair_keys, counts = np.unique(np.concatenate(rows) * size + np.concatenate(cols), return_counts=True)
+    return pair_keys // size, pair_keys % size, counts, support, starts.size
+
+
+def build_model(frame: SalesFrame, config: Dict) -> RecommendationModel:
+    """从销售数据快照构建每个商品的Top-K关联商品（得分计算与排序全部向量化）"""
+    order_ids = np.repeat(frame.order_ids, frame.order_lines)
+    rows, cols, counts, support, orders = basket_pairs(order_ids, frame.line_product, config['MAX_BASKET_SIZE'])
+
+    keep = counts >= config['MIN_PAIR_COUNT']
+    rows, cols, counts = rows[keep], cols[keep], counts[keep]
+    # 对称展开：A→B 与 B→A 的置信度不同，各自一行
+    src = np.concatenate([rows, cols])
+    dst = np.concatenate([cols, rows])
+    co = np.concatenate([counts, counts]).astype(np.float64)
+    confidence = co / support[src]
+    lift = co * orders / (support[src].astype(np.float64) * support[dst])
+    score = lift if config['METRIC'] == 'lift' else confidence
+
+    # 按 (商品, 得分降序, 共现次数降序, 关联商品ID) 排序，每个商品取前K个
+    order = np.lexsort((dst, -co, -score, src))
+    src, dst, co, confidence, lift = src[order], dst[order], co[order], confidence[order], lift[order]
+    if src.size:
+        starts = np.flatnonzero(np.r_[True, src[1:] != src[:-1]])
+        rank = np.arange(src.size) - np.repeat(starts, np.diff(np.r_[starts, src.size]))
+        top = rank < config['TOP_K']
+        src, dst, co, confidence, lift = src[top], dst[top], co[top], confidence[top], lift[top]
+
+    neighbours: Dict[int, List[Neighbour]] = {}
+    for s, d, c, conf, l in zip(src.tolist(), dst.tolist(), co.tolist(), confidence.tolist(), lift.tolist()):
+        neighbours.setdefault(s, []).append(Neighbour(d, int(c), round(conf, 4), round(l, 4)))
+    recommendation_pairs.set(rows.size)
+    return RecommendationModel(
+        frame=frame,
+        built_at=datetime.datetime.now(),
+        orders=int(orders),
+        metric=config['METRIC'],
+        neighbours={pid: tuple(items) for pid, items in neighbours.items()},
+    )
+
+
+class Recommender:
+    """
+    "经常一起购买"推荐：基于销售分析的订单明细快照（见core/utils/analytics.py）批量构建，
+    后台线程按REFRESH_INTERVAL检查新订单并重建，查询只是一次字典查找
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._model: Optional[RecommendationModel] = None
+        self.build_count = 0
+
+    def refresh(self, force: bool = False) -> RecommendationModel:
+        """销售数据快照变化时重建（重建期间查询继续使用旧模型）"""
+        frame = sales_analytics.frame(force=force)
+        model = self._model
+        if model is not None and model.frame is frame:
+            return model
+        with self._lock:
+            if self._model is None or self._model.frame is not frame:
+                start = time.perf_counter()
+                self._model = build_model(frame, get_recommendation_config())
+                recommendation_build_duration.observe(time.perf_counter() - start)
+                self.build_count += 1
+            return self._model
+
+    def model(self) -> RecommendationModel:
+        """当前模型；首次使用时同步构建，之后由后台任务更新"""
+        return self._model or self.refresh()
+
+    def related(self, product_id: int, limit: Optional[int] = None) -> List[Dict]:
+        """商品的关联推荐（名称取自商品目录缓存，不访问数据库）"""
+        items = self.model().neighbours.get(product_id, ())
+        if limit is not None:
+            items = items[:limit]
+        products = catalog_cache.snapshot.products
+        return [{**item._asdict(), 'name': products[item.product_id][0] if item.product_id in products else None}
+                for item in items]
+
+
+recommender = Recommender()
+
+
+def refresh_recommendations() -> None:
+    """后台周期任务：模型已被使用过时才检查并重建，未使用的进程不加载订单数据"""
+    if recommender._model is None:
+        return
+    try:
+        recommender.refresh()
+    except Exception as e:
+        logger.error(f"重建关联推荐失败：{str(e)}")
+
+
+background_tasks.add_task(refresh_recommendations, get_recommendation_config()['REFRESH_INTERVAL'])
@@ -0,0 +1,104 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Optional
+from core.utils.tracing import start_span
+
+
+class RequestStats:
+    """
+    单个请求的数据库统计与阶段耗时（纳秒，perf_counter_ns单调时钟）
+    阶段互斥：模板渲染中发生的查询计入SQL而不计入渲染；视图逻辑 = 总耗时 - 其余阶段
+    """
+    __slots__ = ('query_count', 'sql_ns', 'connect_ns', 'connect_count', 'render_ns', 'audit', 'circuit_open')
+
+    def __init__(self, audit=None):
+        self.query_count = 0
+        self.sql_ns = 0  # SQL执行
+        self.connect_ns = 0  # 等待/建立数据库连接
+        self.connect_count = 0
+        self.render_ns = 0  # 模板渲染（不含其中的查询）
+        self.audit = audit  # core.utils.query_audit.QueryAudit，按SQL指纹检测N+1/重复查询
+        self.circuit_open = None  # 本请求被数据库熔断器拒绝时的CircuitOpenError
+
+    @property
+    def db_time(self) -> float:
+        """数据库耗时（秒，SQL执行 + 建立连接）"""
+        return (self.sql_ns + self.connect_ns) / 1e9
+
+    def phases(self, total_ns: int) -> dict:
+        """各阶段耗时（纳秒）：connect / sql / render / view"""
+        view_ns = max(total_ns - self.sql_ns - self.connect_ns - self.render_ns, 0)
+        return {'connect': self.connect_ns, 'sql': self.sql_ns, 'render': self.render_ns, 'view': view_ns}
+
+
+# 通过contextvars随请求传递，线程/协程之间互不干扰
+_current_stats: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+
+
+def begin_request_stats(audit=None) -> Token:
+    """开始统计当前请求，返回用于结束统计的token"""
+    return _current_stats.set(RequestStats(audit))
+
+
+def end_request_stats(token: Token) -> None:
+    _current_stats.reset(token)
+
+
+def current_stats() -> Optional[RequestStats]:
+    """当前请求的统计对象（请求之外为None）"""
+    return _current_stats.get()
+
+
+def record_query(duration_ns: int, sql: Optional[str] = None, params=None) -> None:
+    """累计一次查询（纳秒；请求之外调用时忽略）"""
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.query_count += 1
+        stats.sql_ns += duration_ns
+        if stats.audit is not None and sql:
+            stats.audit.record(sql, params, duration_ns / 1e9)
+
+
+def record_circuit_open(error: Exception) -> None:
+    """记录当前请求被熔断器拒绝（请求之外调用时忽略）"""
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.circuit_open = error
+
+
+def record_connect(duration_ns: int) -> None:
+    """累计一次建立数据库连接的耗时（纳秒）"""
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.connect_count += 1
+        stats.connect_ns += duration_ns
+
+
+@contextmanager
+def render_phase():
+    """计时模板渲染阶段，扣除渲染过程中发生的数据库耗时（惰性查询集在模板中求值）"""
+    stats = _current_stats.get()
+    if stats is None:
+        yield
+        return
+    db_before = stats.sql_ns + stats.connect_ns
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter_ns() - start - (stats.sql_ns + stats.connect_ns - db_before)
+        stats.render_ns += max(elapsed, 0)
+
+
+def orm_query_wrapper(execute, sql, params, many, context):
+    """Django ORM执行包装器（connection.execute_wrapper），统计ORM查询并记录查询span"""
+    start = time.perf_counter_ns()
+    operation = sql.lstrip().split(None, 1)[0].lower() if sql else 'other'
+    try:
+        with start_span(f"db.{operation}", 'client', {
+            'db.system': context['connection'].vendor, 'db.operation': operation, 'db.statement': sql[:500],
+        }):
+            return execute(sql, params, many, context)
+    finally:
+        record_query(time.perf_counter_ns() - start, sql, params)
@@ -0,0 +1,195 @@
+import logging
+import re
+import time
+from datetime import datetime, timezone as dt_timezone
+from typing import Callable, Dict, List, Optional
+from core.utils.db import exec_query, exec_update
+
+logger = logging.getLogger(__name__)
+
+# 按天分区的命名约定：pYYYYMMDD，分区内为该日的日志
+DAILY_PARTITION_RE = re.compile(r'^p(\d{8})$')
+
+
+def to_db_datetime(value: datetime) -> datetime:
+    """带时区的时间转为UTC无时区时间（USE_TZ=True时数据库中按UTC存储）"""
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def find_daily_partitions(table: str) -> List[Dict]:
+    """查询表的按天分区（information_schema.PARTITIONS，未分区时返回空列表）"""
+    sql = """
+          SELECT PARTITION_NAME AS name, TABLE_ROWS AS table_rows
+          FROM information_schema.PARTITIONS
+          WHERE TABLE_SCHEMA = DATABASE()
+            AND TABLE_NAME = %s
+            AND PARTITION_NAME IS NOT NULL
+          ORDER BY PARTITION_ORDINAL_POSITION
+          """
+    partitions = []
+    for row in exec_query(sql, (table,)):
+        match = DAILY_PARTITION_RE.match(row['name'] or '')
+        if match:
+            partitions.append({
+                'name': row['name'],
+                'day': datetime.strptime(match.group(1), '%Y%m%d').date(),
+                'rows': row['table_rows'] or 0,
+            })
+    return partitions
+
+
+def drop_expired_partitions(
+        table: str,
+        cutoff: datetime,
+        dry_run: bool = False,
+        progress: Optional[Callable[[str], None]] = None
+) -> int:
+    """
+    删除整天早于截止日期的分区（DROP PARTITION为元数据操作，不产生逐行undo）
+    返回删除分区的估算行数
+    """
+    expired = [p for p in find_daily_partitions(table) if p['day'] < to_db_datetime(cutoff).date()]
+    dropped_rows = 0
+    for partition in expired:
+        if not dry_run:
+            exec_update(f"ALTER TABLE `{table}` DROP PARTITION `{partition['name']}`")
+        dropped_rows += partition['rows']
+        if progress:
+            progress(f"{'[演练] ' if dry_run else ''}删除分区 {table}.{partition['name']}（约 {partition['rows']} 行）")
+    return dropped_rows
+
+
+def purge_in_chunks(
+        table: str,
+        pk: str,
+        time_column: str,
+        cutoff: datetime,
+        chunk_size: int = 5000,
+        pause: float = 0.1,
+        time_budget: Optional[float] = None,
+        max_pk: Optional[int] = None,
+        extra_where: str = '',
+        dry_run: bool = False,
+        progress: Optional[Callable[[str], None]] = None
+) -> Dict:
+    """
+    按主键顺序分批删除早于截止时间的行，每批独立提交、批间暂停
+    避免单个大事务长时间锁表和undo膨胀；旧数据集中在主键前段，按主键扫描即可定位
+    max_pk：只删除主键不超过该值的行（如尚未汇总的日志不删）
+    extra_where：附加的固定过滤条件（不含参数），如 "resolution = 60"
+    返回 {'deleted': 删除行数, 'chunks': 批次数, 'elapsed': 耗时秒, 'finished': 是否删完}
+    """
+    start = time.monotonic()
+    deleted = 0
+    chunks = 0
+    last_pk = 0
+    finished = False
+    cutoff = to_db_datetime(cutoff)
+
+    bound_sql = f" AND `{pk}` <= %s" if max_pk is not None else ""
+    extra_sql = f" AND ({extra_where})" if extra_where else ""
+    select_sql = f"""
+                 SELECT `{pk}` AS pk
+                 FROM `{table}`
+                 WHERE `{pk}` > %s AND `{time_column}` < %s{bound_sql}{extra_sql}
+                 ORDER BY `{pk}`
+                 LIMIT %s
+                 """
+    delete_sql = f"DELETE FROM `{table}` WHERE `{pk}` BETWEEN %s AND %s AND `{time_column}` < %s{extra_sql}"
+
+    while True:
+        if time_budget is not None and time.monotonic() - start >= time_budget:
+            break
+
+        params = (last_pk, cutoff) + ((max_pk,) if max_pk is not None else ()) + (chunk_size,)
+        rows = exec_query(select_sql, params)
+        if not rows:
+            finished = True
+            break
+
+        first, last = rows[0]['pk'], rows[-1]['pk']
+        if dry_run:
+            affected = len(rows)
+        else:
+            # 每批独立连接、独立提交（exec_update自动提交）
+            affected = exec_update(delete_sql, (first, last, cutoff))
+        deleted += affected
+        chunks += 1
+        last_pk = last
+
+        if progress:
+            progress(f"{'[演练] ' if dry_run else ''}{table}：第 {chunks} 批删除 {affected} 行"
+                     f"（主键 {first}~{last}），累计 {deleted} 行，耗时 {time.monotonic() - start:.1f} 秒")
+
+        if len(rows) < chunk_size:
+            finished = True
+            break
+        if pause:
+            time.sleep(pause)
+
+    return {'deleted': deleted, 'chunks': chunks, 'elapsed': round(time.monotonic() - start, 3), 'finished': finished}
+
+
+def purge_access_logs(
+        cutoff: datetime,
+        chunk_size: int = 5000,
+        pause: float = 0.1,
+        time_budget: Optional[float] = None,
+        keep_unrolled: bool = True,
+        dry_run: bool = False,
+        progress: Optional[Callable[[str], None]] = None
+) -> Dict:
+    """
+    清理早于截止时间的访问日志：已按天分区则直接删除过期分区，否则分批删除
+    keep_unrolled：未分区时只删除已汇总（不超过rollup_state高水位）的日志，避免汇总数据缺失；
+    汇总已关闭（ACCESS_LOG_ROLLUP['ENABLED']=False）时不等待汇总，只按时间删除
+    尚无汇总进度时不删除任何行，结果带 'skipped'（原因）且 finished=False
+    """
+    if find_daily_partitions('access_logs'):
+        start = time.monotonic()
+        deleted = drop_expired_partitions('access_logs', cutoff, dry_run=dry_run, progress=progress)
+        return {'deleted': deleted, 'chunks': 0, 'elapsed': round(time.monotonic() - start, 3), 'finished': True}
+
+    from core.utils.rollup import ROLLUP_NAME, get_rollup_config
+    max_pk = None
+    if keep_unrolled and get_rollup_config()['ENABLED']:
+        state = exec_query("SELECT last_log_id FROM rollup_state WHERE name = %s", (ROLLUP_NAME,), return_single=True)
+        max_pk = state['last_log_id'] if state else 0
+        if not max_pk:
+            reason = ("访问日志尚未汇总（rollup_state无进度），为避免汇总数据缺失未删除；"
+                      "如需强制删除请关闭keep_unrolled（命令行 --include-unrolled）")
+            return {'deleted': 0, 'chunks': 0, 'elapsed': 0.0, 'finished': False, 'skipped': reason}
+
+    return purge_in_chunks(
+        'access_logs', 'log_id', 'start_time', cutoff,
+        chunk_size=chunk_size, pause=pause, time_budget=time_budget,
+        max_pk=max_pk, dry_run=dry_run, progress=progress
+    )
+
+
+def purge_aggregates(
+        cutoff: datetime,
+        chunk_size: int = 5000,
+        pause: float = 0.1,
+        time_budget: Optional[float] = None,
+        dry_run: bool = False,
+        progress: Optional[Callable[[str], None]] = None
+) -> Dict:
+    """清理早于截止时间的分钟级汇总行与耗时直方图行（小时级汇总保留）"""
+    from core.utils.rollup import MINUTE
+
+    start = time.monotonic()
+    results = {}
+    for table, pk, time_column, extra_where in (
+            ('access_log_rollup', 'id', 'bucket_start', f"resolution = {MINUTE}"),
+            ('latency_histogram', 'id', 'window_start', ''),
+    ):
+        remaining = None if time_budget is None else max(time_budget - (time.monotonic() - start), 0)
+        results[table] = purge_in_chunks(
+            table, pk, time_column, cutoff,
+            chunk_size=chunk_size, pause=pause, time_budget=remaining,
+            extra_where=extra_where, dry_run=dry_run, progress=progress
+        )
+    return results
@@ -0,0 +1,295 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models.functions import Now
+from django.utils import timezone
+from core.models import AccessLog, AccessLogRollup, RollupState
+from core.utils.histogram import LatencyHistogram
+from core.utils.scheduler import background_tasks
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 3600
+RESOLUTIONS = (MINUTE, HOUR)
+ROLLUP_NAME = 'access_logs'
+
+# 默认配置，可在settings.ACCESS_LOG_ROLLUP中按键覆盖
+DEFAULT_ROLLUP_CONFIG = {
+    'ENABLED': True,  # 关闭后不再汇总；清理原始日志时也不再等待汇总进度（只按时间删除）
+    'INTERVAL': 30.0,  # 后台任务汇总间隔（秒）
+    'BATCH_SIZE': 20000,  # 每批读取的原始日志条数
+    'LAG_SECONDS': 10,  # 只汇总写入超过该秒数的日志，给并发写入留出提交时间
+    'TIME_BUDGET': 5.0,  # 单次汇总最长耗时（秒），未追平的留到下次
+}
+
+
+def get_rollup_config() -> Dict:
+    """合并默认配置与settings.ACCESS_LOG_ROLLUP"""
+    return {**DEFAULT_ROLLUP_CONFIG, **getattr(settings, 'ACCESS_LOG_ROLLUP', {})}
+
+
+def bucket_floor(dt: datetime, resolution: int) -> datetime:
+    """时间向下取整到粒度边界（UTC）"""
+    ts = int(dt.timestamp()) // resolution * resolution
+    return datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+
+
+class _RollupAccumulator:
+    """单个(粒度, 时间桶, 路径)的内存累加器"""
+    __slots__ = ('count', 'error_count', 'sum_duration', 'max_duration', 'min_duration',
+                 'sum_db_time', 'sum_db_queries', 'sum_connect_time', 'sum_render_time', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.error_count = 0
+        self.sum_duration = 0.0
+        self.max_duration = 0.0
+        self.min_duration = None
+        self.sum_db_time = 0.0
+        self.sum_db_queries = 0
+        self.sum_connect_time = 0.0
+        self.sum_render_time = 0.0
+        self.histogram = LatencyHistogram()
+
+    def add(self, duration, is_error, db_time, db_queries, weight=1, connect_time=0.0, render_time=0.0) -> None:
+        """累加一条日志；采样记录按权重放大，计数与合计即为真实请求的无偏估计"""
+        self.count += weight
+        self.error_count += weight if is_error else 0
+        self.sum_duration += duration * weight
+        self.max_duration = max(self.max_duration, duration)
+        self.min_duration = duration if self.min_duration is None else min(self.min_duration, duration)
+        self.sum_db_time += (db_time or 0) * weight
+        self.sum_db_queries += (db_queries or 0) * weight
+        self.sum_connect_time += (connect_time or 0) * weight
+        self.sum_render_time += (render_time or 0) * weight
+        self.histogram.record(int(duration * 1e6), weight)
+
+    def merge_into(self, row: AccessLogRollup) -> None:
+        """累加到已有汇总行（直方图按桶相加）"""
+        row.count += self.count
+        row.error_count += self.error_count
+        row.sum_duration += self.sum_duration
+        row.max_duration = max(row.max_duration, self.max_duration)
+        row.min_duration = self.min_duration if row.min_duration is None else min(row.min_duration, self.min_duration)
+        row.sum_db_time += self.sum_db_time
+        row.sum_db_queries += self.sum_db_queries
+        row.sum_connect_time += self.sum_connect_time
+        row.sum_render_time += self.sum_render_time
+        hist = LatencyHistogram.from_row(row.buckets, 0, 0, 0).merge(self.histogram)
+        row.buckets = hist.to_json()
+
+
+def _rollup_batch(batch_size: int, lag_seconds: int) -> int:
+    """
+    汇总一批高水位之后的原始日志（同一事务内：锁进度行→读日志→合并汇总行→推进高水位）
+    进度行的行锁保证多进程同时只有一个在汇总，返回本批处理的日志条数
+    """
+    with transaction.atomic():
+        state, _ = RollupState.objects.get_or_create(name=ROLLUP_NAME)
+        state = RollupState.objects.select_for_update().get(name=ROLLUP_NAME)
+
+        # 按写入时间（数据库时钟）判断日志是否已稳定：写入线程积压时，请求结束时间早的日志可能很晚才写入，
+        # 按end_time判断会在较小ID尚未提交时推进高水位，把它们永久跳过（清理时还会当作已汇总删除）
+        settled = ExpressionWrapper(Q(inserted_at__lt=Now() - timedelta(seconds=lag_seconds)),
+                                    output_field=BooleanField())
+        logs = list(
+            AccessLog.objects.filter(log_id__gt=state.last_log_id)
+            .order_by('log_id')
+            .annotate(settled=settled)
+            .values_list('log_id', 'route', 'path', 'start_time', 'settled', 'duration',
+                         'status_code', 'error_class', 'db_time', 'db_query_count',
+                         'sample_weight', 'connect_time', 'render_time')[:batch_size]
+        )
+        # 截止到第一条写入不足LAG_SECONDS的日志，之后的留到下次，避免跳过尚未提交的较小ID
+        for i, log in enumerate(logs):
+            if not log[4]:
+                logs = logs[:i]
+                break
+        if not logs:
+            return 0
+
+        accumulators: Dict[Tuple[int, datetime, str], _RollupAccumulator] = {}
+        for (log_id, route, path, start_time, _, duration, status_code, error_class, db_time, db_queries, weight,
+             connect_time, render_time) in logs:
+            is_error = (status_code or 0) >= 500 or error_class is not None
+            for resolution in RESOLUTIONS:
+                # 按路由模板汇总，/customer/<id>/ 之类的URL不会每个ID各占一行
+                key = (resolution, bucket_floor(start_time, resolution), route or path)
+                acc = accumulators.get(key)
+                if acc is None:
+                    acc = accumulators[key] = _RollupAccumulator()
+                acc.add(duration, is_error, db_time, db_queries, weight or 1, connect_time, render_time)
+
+        # 已存在的汇总行加锁后累加，不存在的新建
+        existing = {}
+        for resolution in RESOLUTIONS:
+            keys = [k for k in accumulators if k[0] == resolution]
+            rows = AccessLogRollup.objects.select_for_update().filter(
+                resolution=resolution,
+                bucket_start__in={k[1] for k in keys},
+                path__in={k[2] for k in keys},
+            )
+            for row in rows:
+                existing[(row.resolution, row.bucket_start, row.path)] = row
+
+        to_update: List[AccessLogRollup] = []
+        to_create: List[AccessLogRollup] = []
+        for key, acc in accumulators.items():
+            row = existing.get(key)
+            if row is None:
+                row = AccessLogRollup(resolution=key[0], bucket_start=key[1], path=key[2], min_duration=None)
+                acc.merge_into(row)
+                to_create.append(row)
+            else:
+                acc.merge_into(row)
+                to_update.append(row)
+
+        AccessLogRollup.objects.bulk_create(to_create, batch_size=500)
+        AccessLogRollup.objects.bulk_update(
+            to_update,
+            ['count', 'error_count', 'sum_duration', 'max_duration', 'min_duration',
+             'sum_db_time', 'sum_db_queries', 'sum_connect_time', 'sum_render_time', 'buckets'],
+            batch_size=500,
+        )
+
+        state.last_log_id = logs[-1][0]
+        state.save(update_fields=['last_log_id', 'update_time'])
+        return len(logs)
+
+
+def rollup_access_logs(time_budget: Optional[float] = None) -> int:
+    """增量汇总访问日志到分钟/小时汇总表，直到追平或用完时间预算，返回处理条数"""
+    config = get_rollup_config()
+    time_budget = config['TIME_BUDGET'] if time_budget is None else time_budget
+    deadline = time.monotonic() + time_budget
+    total = 0
+    while True:
+        processed = _rollup_batch(config['BATCH_SIZE'], config['LAG_SECONDS'])
+        total += processed
+        if processed < config['BATCH_SIZE'] or time.monotonic() >= deadline:
+            break
+    if total:
+        logger.info(f"访问日志汇总：处理 {total} 条")
+    return total
+
+
+def choose_resolution(start: datetime, end: datetime) -> int:
+    """时间跨度超过一天用小时粒度，否则用分钟粒度"""
+    return HOUR if end - start > timedelta(days=1) else MINUTE
+
+
+def query_rollups(start: datetime, end: Optional[datetime] = None, resolution: Optional[int] = None,
+                  path: Optional[str] = None):
+    """查询时间范围内的汇总行（未指定粒度时按跨度自动选择）"""
+    end = end or timezone.now()
+    resolution = resolution or choose_resolution(start, end)
+    queryset = AccessLogRollup.objects.filter(
+        resolution=resolution,
+        bucket_start__gte=bucket_floor(start, resolution),
+        bucket_start__lt=end,
+    )
+    if path:
+        queryset = queryset.filter(path=path)
+    return queryset
+
+
+def summarize_rollups(rows) -> Dict:
+    """把多条汇总行合并成一组统计（含错误率、各阶段平均耗时与占比、耗时百分位）"""
+    count = error_count = db_queries = 0
+    sum_duration = sum_db_time = sum_connect_time = sum_render_time = max_duration = 0.0
+    min_duration = None
+    histogram = LatencyHistogram()
+    for row in rows:
+        count += row.count
+        error_count += row.error_count
+        sum_duration += row.sum_duration
+        sum_db_time += row.sum_db_time
+        db_queries += row.sum_db_queries
+        sum_connect_time += row.sum_connect_time
+        sum_render_time += row.sum_render_time
+        max_duration = max(max_duration, row.max_duration)
+        if row.min_duration is not None:
+            min_duration = row.min_duration if min_duration is None else min(min_duration, row.min_duration)
+        histogram.merge(LatencyHistogram.from_row(row.buckets, 0, 0, 0))
+    histogram.count = sum(histogram.buckets.values())
+    histogram.max_us = int(max_duration * 1e6)
+
+    summary = {
+        'total_requests': count,
+        'error_count': error_count,
+        'error_rate': round(error_count / count, 4) if count else 0.0,
+        'avg_duration': sum_duration / count if count else None,
+        'max_duration': max_duration if count else None,
+        'min_duration': min_duration,
+        'total_duration': sum_duration,
+        'total_db_time': sum_db_time,
+        'avg_db_time': sum_db_time / count if count else None,
+        'avg_db_queries': db_queries / count if count else None,
+        'db_time_share': round(sum_db_time / sum_duration, 4) if sum_duration else 0.0,
+    }
+    # 阶段拆分：数据库（含建立连接）/ 模板渲染 / 视图逻辑（其余部分）
+    sum_view_time = max(sum_duration - sum_db_time - sum_render_time, 0.0)
+    summary['phases'] = {
+        phase: {
+            'avg': phase_sum / count if count else None,
+            'share': round(phase_sum / sum_duration, 4) if sum_duration else 0.0,
+        }
+        for phase, phase_sum in (
+            ('connect', sum_connect_time),
+            ('sql', max(sum_db_time - sum_connect_time, 0.0)),
+            ('render', sum_render_time),
+            ('view', sum_view_time),
+        )
+    }
+    percentiles = histogram.summary()
+    for key in ('p50', 'p90', 'p99', 'p999'):
+        summary[key] = percentiles.get(key)
+    return summary
+
+
+def get_dashboard_data(minutes: int = 60, resolution: Optional[int] = None, top_paths: int = 10) -> Dict:
+    """看板数据：按时间桶的请求量/错误数/平均耗时序列 + 路径排行（全部来自汇总表）"""
+    end = timezone.now()
+    start = end - timedelta(minutes=minutes)
+    resolution = resolution or choose_resolution(start, end)
+    rows = list(query_rollups(start, end, resolution))
+
+    series: Dict[datetime, List[AccessLogRollup]] = {}
+    by_path: Dict[str, List[AccessLogRollup]] = {}
+    for row in rows:
+        series.setdefault(row.bucket_start, []).append(row)
+        by_path.setdefault(row.path, []).append(row)
+
+    timeline = []
+    for bucket_start in sorted(series):
+        bucket_rows = series[bucket_start]
+        count = sum(r.count for r in bucket_rows)
+        timeline.append({
+            'bucket_start': bucket_start,
+            'count': count,
+            'error_count': sum(r.error_count for r in bucket_rows),
+            'avg_duration': sum(r.sum_duration for r in bucket_rows) / count if count else None,
+            'max_duration': max(r.max_duration for r in bucket_rows),
+        })
+
+    paths = [{'path': p, **summarize_rollups(path_rows)} for p, path_rows in by_path.items()]
+    paths.sort(key=lambda r: r['total_duration'], reverse=True)
+
+    return {
+        'resolution': resolution,
+        'start': start,
+        'end': end,
+        'summary': summarize_rollups(rows),
+        'timeline': timeline,
+        'paths': paths[:top_paths],
+    }
+
+
+# 增量汇总由后台任务调度线程周期执行（见core/utils/scheduler.py）
+if get_rollup_config()['ENABLED']:
+    background_tasks.add_task(rollup_access_logs, get_rollup_config()['INTERVAL'])
@@ -0,0 +1,106 @@
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+from pymysql.constants import FIELD_TYPE
+
+# exec_query/iter_query的结果格式：
+#   dict     每行一个字典（默认，与原有调用方兼容）
+#   tuple    每行一个普通元组，列名索引在结果对象上共享（TupleRows.columns/index）
+#   row      每行一个命名元组（__slots__为空，内存与普通元组相同，可按属性取值）
+#   columns  按列存放：{列名: 列}，无NULL的整数/浮点列为array('q'/'d')，其他列为list
+#   numpy    按列存放的NumPy数组：整数int64、浮点float64（NULL为nan）、时间datetime64[us]/日期datetime64[D]，其他列为object数组
+ROW_FORMATS = ('dict', 'tuple', 'row', 'columns', 'numpy')
+
+_INT_TYPES = {FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.LONGLONG, FIELD_TYPE.INT24,
+              FIELD_TYPE.YEAR}
+_FLOAT_TYPES = {FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE}
+_TIME_TYPES = {FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP}
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_NAT = -2 ** 63  # datetime64的NaT
+
+
+class TupleRows(list):
+    """元组结果：列表中每行是普通元组，列名与列序号映射整个结果只保存一份"""
+    __slots__ = ('columns', 'index')
+
+    def __init__(self, rows, columns: Sequence[str]):
+        super().__init__(rows)
+        self.columns = tuple(columns)
+        self.index = {name: i for i, name in enumerate(self.columns)}
+
+    def column(self, name: str) -> list:
+        """取出一列的全部值"""
+        i = self.index[name]
+        return [row[i] for row in self]
+
+    def as_dicts(self) -> List[Dict]:
+        """转换为字典列表（只在需要与旧代码交互时使用）"""
+        return [dict(zip(self.columns, row)) for row in self]
+
+
+@lru_cache(maxsize=256)
+def row_class(columns: Tuple[str, ...]):
+    """同一组列名共用一个命名元组类型（列名不是合法标识符时按位置重命名为_0、_1...）"""
+    return namedtuple('Row', columns, rename=True)
+
+
+def column_names(description) -> Tuple[str, ...]:
+    return tuple(col[0] for col in description or ())
+
+
+def format_rows(rows: Sequence[tuple], description, row_format: str):
+    """把游标返回的元组行转换为指定格式（dict格式由DictCursor直接生成，不经过这里）"""
+    columns = column_names(description)
+    if row_format == 'tuple':
+        return TupleRows(rows, columns)
+    if row_format == 'row':
+        cls = row_class(columns)
+        return [cls._make(row) for row in rows]
+    if row_format == 'columns':
+        return to_columns(rows, description)
+    if row_format == 'numpy':
+        return to_numpy_columns(rows, description)
+    raise ValueError(f"不支持的结果格式：{row_format}（可选：{', '.join(ROW_FORMATS)}）")
+
+
+def _transpose(rows: Sequence[tuple], width: int) -> List[tuple]:
+    return list(zip(*rows)) if rows else [()] * width
+
+
+def to_columns(rows: Sequence[tuple], description) -> Dict[str, object]:
+    """按列存放（标准库array）：无NULL的数值列每个值只占8字节，不再是独立的Python对象"""
+    result = {}
+    for (name, type_code, *_), values in zip(description, _transpose(rows, len(description))):
+        if type_code in _INT_TYPES and None not in values:
+            result[name] = array('q', values)
+        elif type_code in _FLOAT_TYPES and None not in values:
+            result[name] = array('d', values)
+        else:
+            result[name] = list(values)
+    return result
+
+
+def to_numpy_columns(rows: Sequence[tuple], description) -> Dict[str, object]:
+    """按列存放的NumPy数组（供向量化计算；含NULL的整数列转为float64，NULL为nan）"""
+    import numpy as np
+
+    result = {}
+    for (name, type_code, *_), values in zip(description, _transpose(rows, len(description))):
+        has_null = None in values
+        if type_code in _INT_TYPES:
+            result[name] = (np.array([np.nan if v is None else v for v in values], dtype=np.float64) if has_null
+                            else np.fromiter(values, dtype=np.int64, count=len(values)))
+        elif type_code in _FLOAT_TYPES:
+            result[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        elif type_code in _TIME_TYPES:
+            # 先换算成微秒整数再转换类型，比让NumPy逐个解析datetime对象快数倍
+            micros = (_NAT if v is None else (v - _EPOCH) // _MICROSECOND for v in values)
+            result[name] = np.fromiter(micros, dtype=np.int64, count=len(values)).view('datetime64[us]')
+        elif type_code == FIELD_TYPE.DATE:
+            result[name] = np.array(['NaT' if v is None else v for v in values], dtype='datetime64[D]')
+        else:
+            result[name] = np.array(values, dtype=object)
+    return result
@@ -0,0 +1,129 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from django.conf import settings
+from django.db import close_old_connections
+from core.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# 默认配置，可在settings.BACKGROUND_TASKS中按键覆盖
+DEFAULT_SCHEDULER_CONFIG = {
+    'ENABLED': True,  # False时Web进程不运行周期任务，改由 manage.py run_background_tasks 单独运行
+    'SHUTDOWN_TIMEOUT': 5.0,  # 进程退出时等待当前任务与退出任务的最长时间（秒）
+}
+
+background_task_runs = metrics.Counter('background_task_runs', "后台周期任务执行次数", ['task', 'result'])
+background_task_duration = metrics.Histogram('background_task_duration_seconds', "后台周期任务耗时（秒）", ['task'],
+                                             buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0))
+
+
+def get_scheduler_config() -> Dict:
+    """合并默认配置与settings.BACKGROUND_TASKS"""
+    return {**DEFAULT_SCHEDULER_CONFIG, **getattr(settings, 'BACKGROUND_TASKS', {})}
+
+
+class PeriodicTask:
+    __slots__ = ('func', 'interval', 'run_at_exit', 'name', 'last_run')
+
+    def __init__(self, func: Callable[[], None], interval: float, run_at_exit: bool, name: str):
+        self.func = func
+        self.interval = interval
+        self.run_at_exit = run_at_exit
+        self.name = name
+        self.last_run = time.monotonic()
+
+
+class PeriodicScheduler:
+    """
+    周期任务调度线程（汇总、清理、重建等），与访问日志写入线程分开：
+    耗时的任务只会推迟其他周期任务，不会让日志队列积压、溢出丢弃
+    """
+
+    def __init__(self, name: str = 'background-tasks'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._tasks: List[PeriodicTask] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop: Optional[threading.Event] = None
+        self._pid = None
+
+    def add_task(self, func: Callable[[], None], interval: float, run_at_exit: bool = False,
+                 name: Optional[str] = None) -> None:
+        """
+        注册周期任务（按间隔执行，首次执行在注册一个间隔之后）
+        run_at_exit：进程退出前再执行一次（用于持久化进程内聚合数据；清理、重建等任务不需要）
+        """
+        with self._lock:
+            self._tasks.append(PeriodicTask(func, interval, run_at_exit, name or getattr(func, '__name__', str(func))))
+
+    def tasks(self) -> List[PeriodicTask]:
+        with self._lock:
+            return list(self._tasks)
+
+    def ensure_started(self) -> None:
+        """惰性启动调度线程（BACKGROUND_TASKS['ENABLED']=False时不启动）；fork出的子进程重新创建线程"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        if not get_scheduler_config()['ENABLED']:
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._stop,), name=self.name, daemon=True)
+                self._thread.start()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """停止调度线程：等待当前任务结束，再执行run_at_exit的任务"""
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"{self.name} 关闭超时（{timeout}秒），退出任务未执行完")
+
+    def run_pending(self, force: bool = False, names: Optional[List[str]] = None) -> float:
+        """执行到期的任务（force时全部执行），返回距下一个任务到期的秒数"""
+        now = time.monotonic()
+        wait = None
+        for task in self.tasks():
+            if names is not None and task.name not in names:
+                continue
+            if force or now - task.last_run >= task.interval:
+                task.last_run = now
+                self.run_task(task)
+            remaining = task.interval - (time.monotonic() - task.last_run)
+            wait = remaining if wait is None else min(wait, remaining)
+        return max(wait if wait is not None else 1.0, 0.0)
+
+    def run_task(self, task: PeriodicTask) -> bool:
+        start = time.perf_counter()
+        try:
+            close_old_connections()  # 调度线程独立持有数据库连接，失效时重建
+            task.func()
+            background_task_runs.inc(task=task.name, result='ok')
+            return True
+        except Exception as e:
+            background_task_runs.inc(task=task.name, result='error')
+            logger.error(f"{self.name} 周期任务 {task.name} 执行失败：{str(e)}")
+            return False
+        finally:
+            background_task_duration.observe(time.perf_counter() - start, task=task.name)
+
+    def _run(self, stop: threading.Event) -> None:
+        while not stop.wait(min(self.run_pending(), 1.0)):
+            pass
+        for task in self.tasks():
+            if task.run_at_exit:
+                self.run_task(task)
+        close_old_connections()
+
+
+background_tasks = PeriodicScheduler()
+
+# 进程退出前停止调度线程并执行退出任务
+atexit.register(background_tasks.close, get_scheduler_config()['SHUTDOWN_TIMEOUT'])
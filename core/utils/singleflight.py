@@ -0,0 +1,107 @@
+import copy
+import threading
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, Optional
+from django.conf import settings
+from core.utils import metrics
+from core.utils.conditional import current_version_key
+
+# 默认配置，可在settings.SINGLE_FLIGHT中按键覆盖
+DEFAULT_SINGLE_FLIGHT_CONFIG = {
+    'ENABLED': True,
+    'COPY_RESULTS': True,  # 跟随者拿到结果的深拷贝，调用方修改结果不会互相影响
+}
+
+singleflight_calls = metrics.Counter('singleflight_calls', "单飞调用数：leader执行，coalesced复用进行中的结果",
+                                     ['name', 'result'])
+
+
+def get_single_flight_config() -> Dict:
+    """合并默认配置与settings.SINGLE_FLIGHT"""
+    return {**DEFAULT_SINGLE_FLIGHT_CONFIG, **getattr(settings, 'SINGLE_FLIGHT', {})}
+
+
+class _Call:
+    """一次进行中的执行：leader完成后置位，跟随者等待并共享结果或异常"""
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    相同键的并发调用只执行一次：第一个调用者（leader）执行，执行期间到达的调用者等待并共享结果
+    只合并"正在进行"的调用，执行结束即移除，不是缓存；跟随者通过threading.Event等待
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            singleflight_calls.inc(name=self.name, result='coalesced')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return _share(call.result)
+
+        singleflight_calls.inc(name=self.name, result='leader')
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+def _share(result):
+    return copy.deepcopy(result) if get_single_flight_config()['COPY_RESULTS'] else result
+
+
+def single_flight(func=None, key_func: Optional[Callable[..., Hashable]] = None, name: Optional[str] = None):
+    """
+    单飞装饰器：相同参数的并发调用合并为一次执行
+        @single_flight
+        def get_customer_detail(customer_id): ...
+    键默认为参数；在条件GET视图中还包含该请求ETag依据的版本号，
+    写入提交后到达的请求不会合并到写入前开始的执行上（否则旧数据会配上新ETag）
+    """
+
+    def decorator(f):
+        group = SingleFlight(name or f.__name__)
+
+        def make_key(args, kwargs) -> Hashable:
+            base = key_func(*args, **kwargs) if key_func else (args, tuple(sorted(kwargs.items())))
+            return base, current_version_key()
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not get_single_flight_config()['ENABLED']:
+                return f(*args, **kwargs)
+            return group.do(make_key(args, kwargs), lambda: f(*args, **kwargs))
+
+        wrapper.flight = group
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
@@ -0,0 +1,24 @@
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from core.utils.request_stats import render_phase
+
+
+class TimedTemplate(Template):
+    """渲染耗时计入当前请求的render阶段（include/extends在引擎内部完成，不会重复计时）"""
+
+    def render(self, context=None, request=None):
+        with render_phase():
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django模板后端：返回计时的模板对象，其余行为与DjangoTemplates一致"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
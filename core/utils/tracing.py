@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 默认配置，可在settings.TRACING中按键覆盖
+DEFAULT_TRACING_CONFIG = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1,  # 每N个请求追踪1个（1=全部；携带traceparent且已采样的请求总是追踪）
+    'EXPORTERS': ('memory',),  # memory：进程内环形缓冲（/traces/查看）；file：轮转的本地JSON行文件
+    'RING_SIZE': 200,  # 内存中保留的最近追踪数
+    'MAX_SPANS': 500,  # 单个追踪最多记录的span数，超出的只计数
+    'FILE': None,  # file导出路径，未配置时为 BASE_DIR/traces/spans.jsonl
+    'MAX_BYTES': 10 * 1024 * 1024,  # 单个文件上限，超出后轮转
+    'BACKUP_COUNT': 3,  # 保留的轮转文件数
+    'SERVICE_NAME': 'relation_db',
+}
+
+# OpenTelemetry的span类型与状态码（OTLP/JSON中的枚举值）
+SPAN_KIND = {'internal': 1, 'server': 2, 'client': 3}
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+# W3C Trace Context请求头：version-traceid-parentid-flags
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+
+class Span:
+    """一个计时区间（请求/事务/查询），结束后随所属追踪一起导出"""
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'start_ns', 'end_ns',
+                 'attributes', 'status', 'status_message')
+
+    def __init__(self, trace: 'Trace', name: str, kind: str, parent_id: Optional[str], attributes: Optional[Dict]):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes) if attributes else {}
+        self.status = STATUS_UNSET
+        self.status_message = ''
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, exc: BaseException) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(exc).__name__}: {exc}"[:500]
+
+    def to_otlp(self) -> Dict:
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': SPAN_KIND[self.kind],
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or self.start_ns),
+            'attributes': [_otlp_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            'status': {'code': self.status, 'message': self.status_message} if self.status else {},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class Trace:
+    """一次请求的全部span；根span结束时整体导出"""
+    __slots__ = ('trace_id', 'spans', 'dropped', 'lock')
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or f"{random.getrandbits(128):032x}"
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def to_otlp(self, service_name: str) -> Dict:
+        """OTLP/JSON的ExportTraceServiceRequest结构，可直接被OpenTelemetry Collector接收"""
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [_otlp_attribute('service.name', service_name)]},
+                'scopeSpans': [{
+                    'scope': {'name': 'core.utils.tracing'},
+                    'spans': [span.to_otlp() for span in self.spans],
+                }],
+            }],
+        }
+
+
+def _otlp_attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+# 当前span随contextvars传递，线程/协程之间互不干扰
+_current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+class TraceExporter:
+    """已完成追踪的导出：内存环形缓冲（供staff接口查看）与可选的轮转文件"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ring: Optional[deque] = None
+        self._file_handler: Optional[RotatingFileHandler] = None
+        self._file_pid = None
+
+    def _ring_buffer(self, config: Dict) -> deque:
+        if self._ring is None or self._ring.maxlen != config['RING_SIZE']:
+            self._ring = deque(self._ring or (), maxlen=config['RING_SIZE'])
+        return self._ring
+
+    def _file(self, config: Dict) -> RotatingFileHandler:
+        # 借用RotatingFileHandler的按大小轮转；fork后的子进程重新打开文件
+        if self._file_handler is None or self._file_pid != os.getpid():
+            path = str(config['FILE'] or os.path.join(settings.BASE_DIR, 'traces', 'spans.jsonl'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file_handler = RotatingFileHandler(
+                path, maxBytes=config['MAX_BYTES'], backupCount=config['BACKUP_COUNT'], encoding='utf-8'
+            )
+            self._file_handler.setFormatter(logging.Formatter('%(message)s'))
+            self._file_pid = os.getpid()
+        return self._file_handler
+
+    def export(self, trace: Trace) -> None:
+        config = get_tracing_config()
+        exporters = config['EXPORTERS']
+        with self._lock:
+            if 'memory' in exporters:
+                self._ring_buffer(config).append(trace)
+            if 'file' in exporters:
+                line = json.dumps(trace.to_otlp(config['SERVICE_NAME']), ensure_ascii=False, separators=(',', ':'))
+                self._file(config).emit(logging.makeLogRecord({'msg': line}))
+
+    def recent(self) -> List[Trace]:
+        with self._lock:
+            return list(self._ring or ())
+
+
+trace_exporter = TraceExporter()
+
+
+def get_tracing_config() -> Dict:
+    """合并默认配置与settings.TRACING"""
+    return {**DEFAULT_TRACING_CONFIG, **getattr(settings, 'TRACING', {})}
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace.trace_id if span is not None else None
+
+
+def _parse_traceparent(header: Optional[str]):
+    """解析traceparent请求头，返回(trace_id, parent_span_id, sampled)，格式不合法返回None"""
+    match = TRACEPARENT_RE.match((header or '').strip().lower())
+    if not match or match.group(1) == '0' * 32:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+@contextmanager
+def start_trace(name: str, traceparent: Optional[str] = None, attributes: Optional[Dict] = None):
+    """
+    开始一个追踪（根span，由performance_log在请求入口调用），未采样时yield None
+    携带traceparent时沿用上游的trace_id，本地根span挂在上游span之下
+    """
+    config = get_tracing_config()
+    parent = _parse_traceparent(traceparent)
+    if not config['ENABLED'] or (parent is not None and not parent[2]):
+        yield None
+        return
+    rate = max(int(config['SAMPLE_RATE']), 1)
+    if parent is None and rate > 1 and random.random() * rate >= 1:
+        yield None
+        return
+
+    trace = Trace(parent[0] if parent else None)
+    span = Span(trace, name, 'server', parent[1] if parent else None, attributes)
+    trace.spans.append(span)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end_ns = time.time_ns()
+        if trace.dropped:
+            span.set_attribute('trace.dropped_spans', trace.dropped)
+        try:
+            trace_exporter.export(trace)
+        except Exception as e:
+            logger.error(f"追踪导出失败：{str(e)}")
+
+
+@contextmanager
+def start_span(name: str, kind: str = 'internal', attributes: Optional[Dict] = None):
+    """在当前追踪中开始子span；不在追踪中（请求之外或未采样）时yield None，开销只有一次contextvar读取"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    trace = parent.trace
+    with trace.lock:
+        if len(trace.spans) >= get_tracing_config()['MAX_SPANS']:
+            trace.dropped += 1
+            span = None
+        else:
+            span = Span(trace, name, kind, parent.span_id, attributes)
+            trace.spans.append(span)
+    if span is None:
+        yield None
+        return
+
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end_ns = time.time_ns()
+
+
+def traceparent_header(span: Span) -> str:
+    """当前span的traceparent，用于向下游传播"""
+    return f"00-{span.trace.trace_id}-{span.span_id}-01"
+
+
+def list_traces(limit: int = 50, min_duration: float = 0.0) -> List[Dict]:
+    """最近的追踪摘要（按时间倒序），min_duration为根span最短耗时（秒）"""
+    result = []
+    for trace in reversed(trace_exporter.recent()):
+        root = trace.spans[0]
+        duration = ((root.end_ns or root.start_ns) - root.start_ns) / 1e9
+        if duration < min_duration:
+            continue
+        result.append({
+            'trace_id': trace.trace_id,
+            'name': root.name,
+            'start': root.start_ns / 1e9,
+            'duration': round(duration, 6),
+            'spans': len(trace.spans),
+            'dropped_spans': trace.dropped,
+            'error': any(span.status == STATUS_ERROR for span in trace.spans),
+        })
+        if len(result) >= limit:
+            break
+    return result
+
+
+def get_trace(trace_id: str) -> Optional[Dict]:
+    """按trace_id取内存中的追踪（OTLP/JSON）"""
+    for trace in trace_exporter.recent():
+        if trace.trace_id == trace_id:
+            return trace.to_otlp(get_tracing_config()['SERVICE_NAME'])
+    return None
@@ -0,0 +1,67 @@
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, Iterable, Optional, Tuple
+import pymysql
+from core.utils.db import exec_query, exec_update
+
+
+def get_versions(tables: Iterable[str], conn: Optional[pymysql.connections.Connection] = None) -> Dict[str, int]:
+    """
+    批量读取表版本号（主键查询，未登记的表视为版本0）
+    """
+    tables = list(tables)
+    if not tables:
+        return {}
+
+    placeholders = ','.join(['%s'] * len(tables))
+    sql = f"SELECT table_name, version FROM data_version WHERE table_name IN ({placeholders})"
+    rows = exec_query(sql, tuple(tables), conn=conn)
+
+    versions = {table: 0 for table in tables}
+    for row in rows:
+        versions[row['table_name']] = int(row['version'])
+    return versions
+
+
+def get_version_stamps(
+        keys: Iterable[str],
+        conn: Optional[pymysql.connections.Connection] = None
+) -> Dict[str, Tuple[int, Optional[datetime]]]:
+    """
+    批量读取版本号与最后递增时间（UTC），用于计算ETag/Last-Modified
+    键可以是表名，也可以是单个实体（如 customer:12）；未登记的键为 (0, None)
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+
+    placeholders = ','.join(['%s'] * len(keys))
+    sql = f"SELECT table_name, version, update_time FROM data_version WHERE table_name IN ({placeholders})"
+    rows = exec_query(sql, tuple(keys), conn=conn)
+
+    stamps = {key: (0, None) for key in keys}
+    for row in rows:
+        update_time = row['update_time']
+        if update_time is not None and update_time.tzinfo is None:
+            update_time = update_time.replace(tzinfo=dt_timezone.utc)
+        stamps[row['table_name']] = (int(row['version']), update_time)
+    return stamps
+
+
+def get_version(table: str, conn: Optional[pymysql.connections.Connection] = None) -> int:
+    """读取单个表的版本号"""
+    return get_versions([table], conn=conn)[table]
+
+
+def bump_version(*tables: str, conn: Optional[pymysql.connections.Connection] = None) -> None:
+    """
+    递增表/实体版本号（传入事务连接时随业务一起提交，回滚则不生效）
+    """
+    if not tables:
+        return
+
+    sql = """
+          INSERT INTO data_version (table_name, version, update_time)
+          VALUES (%s, 1, UTC_TIMESTAMP(6))
+          ON DUPLICATE KEY UPDATE version = version + 1, update_time = UTC_TIMESTAMP(6)
+          """
+    exec_update(sql, batch=True, params_list=[(table,) for table in tables], conn=conn)
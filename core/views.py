@@ -1,35 +1,36 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, FileResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
+import os
 import traceback
-from core.utils.order_tools import create_order, get_order_list, update_order_status, delete_order
-from core.utils.product_tools import get_product_list
-from core.utils.customer_tools import get_customer_list, get_customer_detail, update_customer as update_customer_tool, \
+from core.utils.order_tools import create_order, update_order_status, delete_order
+from core.utils.product_tools import browse_products
+from core.utils.customer_tools import get_customer_detail, update_customer as update_customer_tool, \
     delete_customer as delete_customer_tool, create_customer as create_customer_tool, get_customer_by_phone
-from core.utils.performance import performance_log, get_access_logs
+from core.utils.performance import performance_log
+from core.utils.rollup import get_dashboard_data, MINUTE, HOUR
+from core.utils.metrics import REGISTRY, get_metrics_config
+from core.utils.profiling import list_profiles, get_profile_file
+from core.utils.tracing import list_traces, get_trace
+from core.utils.fragments import render_fragment, PANELS
+from core.utils.conditional import version_condition
+from core.utils.events import event_stream, async_event_stream
+from core.utils.admission import admission_control
+from core.utils.idempotency import claim_from_request, IdempotencyError
+from core.utils.circuit_breaker import db_breaker, serve_stale_when_open, OPEN
+from core.utils.db import exec_query
+from core.utils.analytics import sales_analytics, get_analytics_config
+from core.utils.recommendations import recommender
 import traceback
 from django.contrib.auth import logout
 @login_required
 @performance_log
 def order_manage(request):
-    """订单管理视图（只处理GET请求）"""
+    """订单管理视图（只处理GET请求；页面只含框架，各分块由order_fragment异步加载）"""
     if request.method == 'GET':
-        customer_id = request.GET.get('customer_id')
-        customer_detail = None
-        if customer_id:
-            customer_detail = get_customer_detail(customer_id)
-
-        # 总是获取日志数据，不再需要show_logs参数
-        access_logs = get_access_logs(limit=50)
-
-        return render(request, 'order_manage.html', {
-            'orders': get_order_list(limit=50),
-            'products': get_product_list(limit=100),
-            'customers': get_customer_list(limit=100),
-            'customer_detail': customer_detail,
-            'access_logs': access_logs,
-        })
+        return render(request, 'order_manage.html')
 
     # 如果不是GET请求，原代码中处理POST的部分已经拆分到其他视图，所以这里可以返回错误
     return JsonResponse({"code": 400, "msg": "不支持的请求方法"})
@@ -37,12 +38,47 @@ def order_manage(request):
 
 @login_required
 @performance_log
+@serve_stale_when_open
+@version_condition(lambda request, name: PANELS[name].tables if name in PANELS else ())
+def order_fragment(request, name):
+    """订单管理页分块API（订单/商品/客户/日志），按数据表版本号缓存渲染结果"""
+    if name not in PANELS:
+        return JsonResponse({"code": 404, "msg": f"分块 {name} 不存在"}, status=404)
+    try:
+        return JsonResponse({"code": 200, "data": render_fragment(name, request)})
+    except Exception as e:
+        return JsonResponse({"code": 500, "msg": f"加载分块失败: {str(e)}"})
+
+
+@login_required
+def order_events(request):
+    """
+    订单/库存实时事件（Server-Sent Events），页面据此只刷新变化的分块
+    长连接不经过performance_log（耗时无意义）；ASGI下每个连接只占一个协程，WSGI下占用一个请求线程
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    stream = async_event_stream(last_event_id) if isinstance(request, ASGIRequest) else event_stream(last_event_id)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # 关闭nginx的响应缓冲
+    return response
+
+
+@login_required
+@performance_log
+@admission_control
 def order_create(request):
-    """创建订单"""
+    """创建订单（支持Idempotency-Key请求头：重试时返回首次结果，不会重复下单）"""
     if request.method != 'POST':
         return JsonResponse({"code": 400, "msg": "只支持POST请求"})
 
+    claim = None
     try:
+        # 携带幂等键的重试：结果已提交时直接返回，不进入加锁事务
+        claim = claim_from_request(request, 'order_create')
+        if claim is not None and claim.lookup():
+            return idempotent_response(claim)
+
         # 调试信息
         print("收到创建订单请求")
         print("客户姓名:", request.POST.get('cust_name'))
@@ -72,11 +108,19 @@ def order_create(request):
             cust_name=request.POST.get('cust_name'),
             cust_phone=request.POST.get('cust_phone'),
             cust_addr=request.POST.get('cust_addr'),
-            items=items
+            items=items,
+            idempotency=claim
         )
+        if claim is not None and claim.replayed:
+            return idempotent_response(claim)
         return JsonResponse({"code": 200, "msg": msg})
 
+    except IdempotencyError as e:
+        return JsonResponse({"code": 422, "msg": str(e)}, status=422)
     except Exception as e:
+        if claim is not None and claim.conflict:
+            return JsonResponse({"code": 422, "msg": f"幂等键 {claim.key} 已用于参数不同的请求，请使用新的幂等键"},
+                                status=422)
         # 记录详细错误信息
         error_traceback = traceback.format_exc()
         print(f"创建订单异常: {str(e)}")
@@ -92,8 +136,16 @@ def order_create(request):
             return JsonResponse({"code": 500, "msg": f"系统错误: {error_msg}"})
 
 
+def idempotent_response(claim):
+    """返回幂等键对应的首次执行结果（响应头Idempotent-Replayed标明是重放）"""
+    response = JsonResponse({"code": 200, "msg": claim.result})
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
 @login_required
 @performance_log
+@admission_control
 def order_update_status(request):
     """更新订单状态"""
     if request.method != 'POST':
@@ -120,6 +172,7 @@ def order_update_status(request):
 
 @login_required
 @performance_log
+@admission_control
 def order_delete(request):
     """删除订单"""
     if request.method != 'POST':
@@ -142,6 +195,8 @@ def order_delete(request):
 
 @login_required
 @performance_log
+@serve_stale_when_open
+@version_condition(lambda request, customer_id: [f'customer:{customer_id}'])
 def customer_detail(request, customer_id):
     """客户详情API"""
     try:
@@ -230,4 +285,162 @@ def delete_customer(request, customer_id):
         return JsonResponse({"code": 200, "msg": msg})
 
     except Exception as e:
-        return JsonResponse({"code": 500, "msg": f"删除客户失败: {str(e)}"})
\ No newline at end of file
+        return JsonResponse({"code": 500, "msg": f"删除客户失败: {str(e)}"})
+
+
+@login_required
+@performance_log
+@serve_stale_when_open
+def product_browse(request):
+    """商品分类筛选浏览API（分页+分面计数）"""
+    try:
+        data = browse_products(
+            category_ids=request.GET.getlist('category'),
+            match=request.GET.get('match', 'any'),
+            sort=request.GET.get('sort', 'id'),
+            page=request.GET.get('page', 1),
+            page_size=request.GET.get('page_size', 20)
+        )
+        return JsonResponse({"code": 200, "data": data})
+    except ValueError:
+        return JsonResponse({"code": 400, "msg": "分类ID与分页参数必须为整数"})
+    except Exception as e:
+        return JsonResponse({"code": 400, "msg": f"商品浏览失败: {str(e)}"})
+
+
+@login_required
+@performance_log
+def product_related(request, product_id):
+    """经常一起购买的商品（按提升度/置信度排序的Top-K，数据常驻内存）：?limit=条数"""
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 100)
+    except ValueError:
+        return JsonResponse({"code": 400, "msg": "limit必须为整数"})
+    try:
+        model = recommender.model()
+        return JsonResponse({"code": 200, "data": {
+            'product_id': product_id,
+            'metric': model.metric,
+            'orders': model.orders,
+            'built_at': model.built_at,
+            'items': recommender.related(product_id, limit),
+        }})
+    except Exception as e:
+        return JsonResponse({"code": 500, "msg": f"获取关联推荐失败: {str(e)}"})
+
+
+@login_required
+@performance_log
+@serve_stale_when_open
+def dashboard_stats(request):
+    """访问性能看板API（数据来自分钟/小时汇总表）"""
+    try:
+        minutes = min(max(int(request.GET.get('minutes', 60)), 1), 60 * 24 * 31)
+        resolution = {'minute': MINUTE, 'hour': HOUR}.get(request.GET.get('resolution'))
+        return JsonResponse({"code": 200, "data": get_dashboard_data(minutes=minutes, resolution=resolution)})
+    except ValueError:
+        return JsonResponse({"code": 400, "msg": "minutes必须为整数"})
+    except Exception as e:
+        return JsonResponse({"code": 500, "msg": f"获取看板数据失败: {str(e)}"})
+
+
+ANALYTICS_SECTIONS = ('by_day', 'by_product', 'by_category', 'top_sellers', 'basket')
+
+
+@login_required
+@performance_log
+def analytics_sales(request):
+    """
+    销售分析API（仅staff）：?days=最近N天（默认全部）&top=热销条数&section=只返回某一部分
+    数据常驻内存，有新订单时重新加载
+    """
+    if not request.user.is_staff:
+        return JsonResponse({"code": 403, "msg": "仅管理员可查看销售分析"}, status=403)
+    try:
+        days = request.GET.get('days')
+        days = min(max(int(days), 1), get_analytics_config()['MAX_DAYS']) if days else None
+        top = min(max(int(request.GET.get('top', get_analytics_config()['TOP_N'])), 1), 100)
+    except ValueError:
+        return JsonResponse({"code": 400, "msg": "days与top必须为整数"})
+    section = request.GET.get('section')
+    if section and section not in ANALYTICS_SECTIONS:
+        return JsonResponse({"code": 400, "msg": f"section可选：{', '.join(ANALYTICS_SECTIONS)}"})
+    try:
+        report = sales_analytics.report(days=days, top=top)
+        if section:
+            report = {key: report[key] for key in ('loaded_at', 'days', section)}
+        return JsonResponse({"code": 200, "data": report})
+    except Exception as e:
+        return JsonResponse({"code": 500, "msg": f"获取销售分析失败: {str(e)}"})
+
+
+def health(request):
+    """健康检查（供负载均衡探测，无需登录）：数据库熔断器断开时返回503；?deep=1 额外执行一次 SELECT 1"""
+    breaker = db_breaker.snapshot()
+    data = {"status": "ok", "database": breaker}
+    if request.GET.get('deep') == '1' and breaker['state'] != OPEN:
+        try:
+            exec_query("SELECT 1 AS ok", return_single=True)
+        except Exception as e:
+            data["database"] = {**db_breaker.snapshot(), "check_error": str(e)[:200]}
+            data["status"] = "unavailable"
+    if data["database"]["state"] == OPEN:
+        data["status"] = "unavailable"
+    if data["status"] != "ok":
+        return JsonResponse({"code": 503, "data": data}, status=503)
+    return JsonResponse({"code": 200, "data": data})
+
+
+def metrics(request):
+    """Prometheus抓取端点（文本格式，合并所有工作进程的指标；本机或staff可访问）"""
+    if request.META.get('REMOTE_ADDR') not in get_metrics_config()['ALLOWED_IPS'] and not request.user.is_staff:
+        return HttpResponse("Forbidden", status=403, content_type="text/plain")
+    return HttpResponse(REGISTRY.generate_latest(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@login_required
+def profile_list(request):
+    """已保存的请求剖析列表（仅staff）"""
+    if not request.user.is_staff:
+        return JsonResponse({"code": 403, "msg": "仅管理员可查看剖析"}, status=403)
+    try:
+        limit = min(max(int(request.GET.get('limit', 100)), 1), 1000)
+        return JsonResponse({"code": 200, "data": list_profiles(limit)})
+    except ValueError:
+        return JsonResponse({"code": 400, "msg": "limit必须为整数"})
+
+
+@login_required
+def profile_download(request, name):
+    """下载剖析文件：?kind=prof（pstats，可用snakeviz等打开）或 collapsed（折叠栈，用于火焰图）"""
+    if not request.user.is_staff:
+        return JsonResponse({"code": 403, "msg": "仅管理员可下载剖析"}, status=403)
+    kind = request.GET.get('kind', 'prof')
+    path = get_profile_file(name, kind)
+    if path is None:
+        return JsonResponse({"code": 404, "msg": f"剖析 {name}（{kind}）不存在"}, status=404)
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path))
+
+
+@login_required
+def trace_list(request):
+    """最近的请求追踪摘要（仅staff；?min_duration=秒 过滤慢请求）"""
+    if not request.user.is_staff:
+        return JsonResponse({"code": 403, "msg": "仅管理员可查看追踪"}, status=403)
+    try:
+        limit = min(max(int(request.GET.get('limit', 50)), 1), 1000)
+        min_duration = float(request.GET.get('min_duration', 0))
+        return JsonResponse({"code": 200, "data": list_traces(limit, min_duration)})
+    except ValueError:
+        return JsonResponse({"code": 400, "msg": "limit必须为整数，min_duration必须为数字"})
+
+
+@login_required
+def trace_detail(request, trace_id):
+    """单个追踪的全部span（OpenTelemetry OTLP/JSON格式，仅staff）"""
+    if not request.user.is_staff:
+        return JsonResponse({"code": 403, "msg": "仅管理员可查看追踪"}, status=403)
+    trace = get_trace(trace_id)
+    if trace is None:
+        return JsonResponse({"code": 404, "msg": f"追踪 {trace_id} 不存在或已被淘汰"}, status=404)
+    return JsonResponse(trace)
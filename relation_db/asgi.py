@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+实时事件接口 /order/events/（SSE长连接）应部署在ASGI服务器下，每个连接只占用一个协程，
+例如：uvicorn relation_db.asgi:application --workers 4（多个工作进程之间的事件转发见core/utils/events.py）
 """
 
 import os
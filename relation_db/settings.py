@@ -43,7 +43,8 @@ ROOT_URLCONF = 'relation_db.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.utils.timed_templates.TimedDjangoTemplates',  # DjangoTemplates + 渲染阶段计时
+        'NAME': 'django',  # 保持默认别名，engines['django'] / using='django' 仍可用
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -117,3 +118,184 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+
+# 访问日志缓冲写入（见core/utils/log_writer.py，未配置的键使用默认值）
+ACCESS_LOG_BUFFER = {
+    'ENABLED': True,
+    'MAX_QUEUE': 10000,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 2.0,
+    'OVERFLOW': 'drop',
+}
+
+# 访问耗时直方图（见core/utils/histogram.py）：每个请求按路由模板计入进程内直方图（不受采样影响），
+# 按窗口周期持久化到latency_histogram表，get_performance_stats/get_path_stats的百分位由各进程的直方图合并得出
+LATENCY_HISTOGRAM = {
+    'WINDOW_SECONDS': 60,
+    'PERSIST_INTERVAL': 10.0,
+}
+
+# 后台周期任务（见core/utils/scheduler.py）：汇总、过期幂等键清理、推荐重建等在独立调度线程中执行，不占用日志写入线程
+# 多进程部署可在Web进程中关闭（ENABLED=False），改由单独进程运行 manage.py run_background_tasks
+BACKGROUND_TASKS = {
+    'ENABLED': True,
+    'SHUTDOWN_TIMEOUT': 5.0,
+}
+
+# 访问日志增量汇总（见core/utils/rollup.py）：按高水位把原始日志汇总到分钟/小时汇总表
+# ENABLED=False时停止汇总，prune_access_logs/cleanup_old_logs随之只按时间删除原始日志
+ACCESS_LOG_ROLLUP = {
+    'ENABLED': True,
+    'INTERVAL': 30.0,
+    'BATCH_SIZE': 20000,
+    'LAG_SECONDS': 10,
+}
+
+# 访问日志采样（见core/utils/performance.py）：普通请求按1/N记录并携带权重N，慢请求和错误请求总是记录
+ACCESS_LOG_SAMPLING = {
+    'DEFAULT_RATE': 1,
+    'PATH_RATES': {},
+    'SLOW_THRESHOLD': 1.0,
+}
+
+# 运行指标（见core/utils/metrics.py）：/metrics/输出Prometheus文本格式
+# 多进程部署（gunicorn等）需配置共享目录，各进程写自己的mmap文件，抓取时合并；启动前清空该目录
+METRICS = {
+    'MULTIPROC_DIR': None,
+    'ALLOWED_IPS': ('127.0.0.1', '::1'),
+}
+
+# 按需请求剖析（见core/utils/profiling.py）：签名请求头、staff的?_profile=1或随机采样触发，结果在/profiles/查看下载
+REQUEST_PROFILING = {
+    'ENABLED': True,
+    'DIR': BASE_DIR / 'profiles',
+    'SAMPLE_RATE': 0,
+    'MAX_FILES': 200,
+    'MAX_AGE_DAYS': 7,
+}
+
+# 查询审计（见core/utils/query_audit.py）：按SQL指纹统计每个请求的查询，N+1/重复查询记录告警与调用栈
+# 测试环境可开启STRICT，违规请求直接抛出QueryAuditError
+QUERY_AUDIT = {
+    'ENABLED': True,
+    'REPEAT_THRESHOLD': 10,
+    'DUPLICATE_THRESHOLD': 3,
+    'TOTAL_THRESHOLD': 100,
+    'STRICT': False,
+}
+
+# 响应头Server-Timing：输出本次请求各阶段耗时（db/conn/render/view），浏览器开发者工具可直接查看
+# 'staff'（默认）只对staff用户或DEBUG模式输出，避免向匿名客户端暴露数据库与渲染耗时；True对所有请求输出；False关闭
+SERVER_TIMING_HEADER = 'staff'
+
+# 请求追踪（见core/utils/tracing.py）：请求/事务/查询三级span，OTLP/JSON格式
+# memory保留最近的追踪供/traces/查看；加入'file'则同时写入轮转的本地文件（可由OpenTelemetry Collector读取）
+TRACING = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1,
+    'EXPORTERS': ('memory',),
+    'RING_SIZE': 200,
+    'FILE': BASE_DIR / 'traces' / 'spans.jsonl',
+}
+
+# 订单管理页分块缓存（见core/utils/fragments.py）：缓存键包含依赖表的版本号，写入后自动失效
+# 未配置CACHES时使用进程内LocMemCache，各进程各自缓存，版本号保证不会读到旧数据
+FRAGMENT_CACHE = {
+    'TIMEOUT': 600,
+    'ACCESS_LOG_TIMEOUT': 5,
+}
+
+# 条件GET（见core/utils/conditional.py）：customer_detail与页面分块按data_version版本号计算ETag/Last-Modified
+# 客户端带If-None-Match/If-Modified-Since轮询时，数据未变化直接返回304，不执行任何数据查询
+CONDITIONAL_GET = {
+    'ENABLED': True,
+    'ETAG_SALT': '',
+}
+
+# 订单/库存实时事件（见core/utils/events.py）：写操作提交后经进程内发布/订阅推送到 /order/events/（SSE）
+# 部署在ASGI服务器下（relation_db/asgi.py）每个连接只占一个协程；多进程时经本机Unix套接字互相转发
+# 套接字目录（DIR，默认 系统临时目录/relation_db_events-<uid>）以0700创建，已存在但不属于运行用户时不做跨进程广播
+LIVE_EVENTS = {
+    'ENABLED': True,
+    'FANOUT': True,
+    'QUEUE_SIZE': 256,
+    'REPLAY_SIZE': 500,
+    'HEARTBEAT': 15,
+}
+
+# 写接口准入控制（见core/utils/admission.py）：下单/改状态/删单按端点限制并发，超出的请求有界排队，
+# 队列满或等待超时返回503、单个用户并发过多返回429（均带Retry-After），避免突发流量拖垮MySQL连接与行锁
+# 上限按工作进程计；ADAPTIVE开启后按延迟AIMD自动调整
+ADMISSION_CONTROL = {
+    'ENABLED': True,
+    'LIMITS': {
+        'order_create': 8,
+        'order_update_status': 16,
+        'order_delete': 4,
+    },
+    'QUEUE_SIZE': 16,
+    'QUEUE_TIMEOUT': 2.0,
+    'PER_USER_LIMIT': 2,
+    'ADAPTIVE': False,
+    'TARGET_LATENCY': 0.5,
+}
+
+# 单飞合并（见core/utils/singleflight.py）：get_customer_detail/get_order_list的相同并发调用只查询一次，其余调用者共享结果
+SINGLE_FLIGHT = {
+    'ENABLED': True,
+    'COPY_RESULTS': True,
+}
+
+# 下单幂等键（见core/utils/idempotency.py）：客户端在Idempotency-Key请求头携带键，键与订单同一事务写入，
+# 超时重试时直接返回首次结果；并发的相同键等待首个请求结束。过期键由后台线程定期清理
+IDEMPOTENCY = {
+    'ENABLED': True,
+    'HEADER': 'Idempotency-Key',
+    'TTL': 24 * 3600,
+    'PURGE_INTERVAL': 600,
+}
+
+# 请求时间预算（见core/utils/deadline.py）：performance_log为每个请求设置截止时间，经contextvars传到查询层，
+# SELECT附加MAX_EXECUTION_TIME提示、所有语句设置套接字超时，客户端超时后KILL QUERY中止服务端语句，超时返回504
+REQUEST_DEADLINE = {
+    'ENABLED': True,
+    'DEFAULT_BUDGET': 10.0,
+    'PATH_BUDGETS': {
+        '/dashboard/': 20.0,
+        '/fragments/': 5.0,
+        '/analytics/': 60.0,
+    },
+    'KILL_GRACE': 0.2,
+}
+
+# 数据库熔断器（见core/utils/circuit_breaker.py）：窗口内失败率过高或连续超时时断开，get_db_conn直接失败而不等待连接超时；
+# 断开OPEN_SECONDS后半开放行试探连接，成功则恢复。断开期间读接口返回最近一次成功的结果（带Warning: 110），/health/返回503
+DB_CIRCUIT_BREAKER = {
+    'ENABLED': True,
+    'WINDOW': 30,
+    'MIN_CALLS': 10,
+    'FAILURE_RATE': 0.5,
+    'CONSECUTIVE_TIMEOUTS': 3,
+    'OPEN_SECONDS': 5,
+    'MAX_OPEN_SECONDS': 60,
+    'STALE_MAX_AGE': 600,
+}
+
+# 销售分析（见core/utils/analytics.py）：订单明细流式读入NumPy列数组常驻内存，按日/商品/分类/购物篮向量化统计，
+# shop_order_item版本号变化（新订单、删除订单）时重新加载；/analytics/sales/仅staff可访问
+SALES_ANALYTICS = {
+    'CHECK_INTERVAL': 5.0,
+    'BATCH_SIZE': 50000,
+    'TOP_N': 10,
+    'MAX_DAYS': 366,
+}
+
+# 经常一起购买推荐（见core/utils/recommendations.py）：由销售分析的订单明细快照构建商品共现矩阵，按提升度取每个商品的Top-K，
+# 后台每REFRESH_INTERVAL秒检查新订单并重建；/product/<id>/related/ 只做内存查找
+RECOMMENDATIONS = {
+    'TOP_K': 10,
+    'MIN_PAIR_COUNT': 2,
+    'METRIC': 'lift',
+    'MAX_BASKET_SIZE': 50,
+    'REFRESH_INTERVAL': 60,
+}
@@ -4,13 +4,16 @@ from django.urls import path
 from django.contrib.auth import views as auth_views
 
 from core.utils.performance import performance_log
-from core.views import order_manage, order_create, order_update_status, order_delete, customer_detail, update_customer, delete_customer, create_customer
+from core.views import order_manage, order_fragment, order_events, order_create, order_update_status, order_delete, customer_detail, update_customer, delete_customer, create_customer, \
+    product_browse, product_related, dashboard_stats, analytics_sales, health, metrics, profile_list, profile_download, trace_list, trace_detail
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('login/', performance_log(auth_views.LoginView.as_view(template_name='login.html')), name='login'),
     path('logout/', performance_log(auth_views.LogoutView.as_view(next_page='login')), name='logout'),
     path('', order_manage, name='order_manage'),
+    path('fragments/<slug:name>/', order_fragment, name='order_fragment'),
+    path('order/events/', order_events, name='order_events'),
     path('order/create/', order_create, name='order_create'),
     path('order/update_status/', order_update_status, name='order_update_status'),
     path('order/delete/', order_delete, name='order_delete'),
@@ -18,4 +21,14 @@ urlpatterns = [
     path('customer/<int:customer_id>/update/', update_customer, name='update_customer'),
     path('customer/<int:customer_id>/delete/', delete_customer, name='delete_customer'),
     path('customer/create/', create_customer, name='create_customer'),
+    path('product/browse/', product_browse, name='product_browse'),
+    path('product/<int:product_id>/related/', product_related, name='product_related'),
+    path('dashboard/stats/', dashboard_stats, name='dashboard_stats'),
+    path('analytics/sales/', analytics_sales, name='analytics_sales'),
+    path('health/', health, name='health'),
+    path('metrics/', metrics, name='metrics'),
+    path('profiles/', profile_list, name='profile_list'),
+    path('profiles/<str:name>/', profile_download, name='profile_download'),
+    path('traces/', trace_list, name='trace_list'),
+    path('traces/<str:trace_id>/', trace_detail, name='trace_detail'),
 ]
\ No newline at end of file
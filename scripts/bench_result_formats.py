@@ -0,0 +1,115 @@
+import os
+import sys
+import django
+
+# 设置Django环境
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'relation_db.settings')
+django.setup()
+
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pymysql.constants import FIELD_TYPE
+from core.utils.db import exec_query
+from core.utils.rows import ROW_FORMATS, format_rows
+
+# 与shop_order_item一致的列（含一个时间列，便于比较按列存放的效果）
+SYNTHETIC_DESCRIPTION = (
+    ('item_id', FIELD_TYPE.LONG), ('order_id', FIELD_TYPE.LONG), ('product_id', FIELD_TYPE.LONG),
+    ('quantity', FIELD_TYPE.LONG), ('unit_price', FIELD_TYPE.NEWDECIMAL), ('create_time', FIELD_TYPE.DATETIME),
+)
+BENCH_SQL = """
+            SELECT oi.item_id, oi.order_id, oi.product_id, oi.quantity, oi.unit_price, o.create_time
+            FROM shop_order_item oi
+                     JOIN shop_order o ON o.order_id = oi.order_id
+            ORDER BY oi.item_id
+                LIMIT %s
+            """
+
+
+def synthetic_rows(count: int):
+    """生成模拟的字段值（每行一个列表，相当于游标已解码、尚未组装成行的数据）"""
+    start = datetime(2025, 1, 1)
+    return [
+        [i, i // 3 + 1, random.randint(1, 100), random.randint(1, 5),
+         Decimal(random.randint(100, 99999)) / 100, start + timedelta(seconds=i * 7)]
+        for i in range(1, count + 1)
+    ]
+
+
+def build_synthetic(values, row_format: str):
+    """
+    模拟exec_query：先像游标fetchall一样逐行组装新元组，再做各格式的转换（dict格式与DictCursor一样逐行zip成字典）
+    每种格式都包含组装元组这一步，否则tuple格式只是包装已有对象，耗时和内存都不可比
+    """
+    rows = [tuple(row) for row in values]
+    if row_format == 'dict':
+        names = [col[0] for col in SYNTHETIC_DESCRIPTION]
+        return [dict(zip(names, row)) for row in rows]
+    return format_rows(rows, SYNTHETIC_DESCRIPTION, row_format)
+
+
+def measure(build, repeat: int):
+    """
+    返回 (最快一次耗时秒, 结果占用的内存字节, 峰值内存字节)
+    耗时与内存分开测量：tracemalloc会显著拖慢分配密集的代码，不能同时计时
+    """
+    build()  # 预热（导入NumPy、建立命名元组类型等）
+    elapsed = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = build()
+        elapsed = min(elapsed, time.perf_counter() - start)
+        del result
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较exec_query各结果格式的内存占用与吞吐")
+    parser.add_argument('--rows', type=int, default=200000, help="行数")
+    parser.add_argument('--source', choices=('synthetic', 'db'), default='synthetic',
+                        help="synthetic：比较组装行与结果转换（不需要数据库）；db：对shop_order_item执行真实查询")
+    parser.add_argument('--repeat', type=int, default=3, help="计时重复次数（取最快一次）")
+    parser.add_argument('--formats', default=','.join(ROW_FORMATS), help="逗号分隔的结果格式")
+    args = parser.parse_args()
+
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    rows = synthetic_rows(args.rows) if args.source == 'synthetic' else None
+
+    print(f"数据来源：{args.source}，行数：{args.rows}")
+    print(f"{'格式':<10}{'耗时(s)':>10}{'行/秒':>14}{'结果内存(MB)':>14}{'峰值内存(MB)':>14}{'字节/行':>10}")
+    for row_format in formats:
+        if args.source == 'synthetic':
+            build = lambda: build_synthetic(rows, row_format)
+        else:
+            build = lambda: exec_query(BENCH_SQL, (args.rows,), row_format=row_format)
+        elapsed, current, peak = measure(build, args.repeat)
+        if args.source == 'synthetic':
+            count = args.rows
+        else:
+            result = build()
+            count = len(next(iter(result.values()))) if isinstance(result, dict) else len(result)
+            del result
+        count = max(count, 1)
+        print(f"{row_format:<10}{elapsed:>10.3f}{count / elapsed if elapsed else 0:>14,.0f}"
+              f"{current / 1048576:>14.1f}{peak / 1048576:>14.1f}{current / count:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
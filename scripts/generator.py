@@ -15,6 +15,8 @@ import random
 from datetime import datetime, timedelta
 from decimal import Decimal
 from core.models import Customer, Category, Product, ProductCategory, Order, OrderItem, AccessLog
+from core.utils.versions import bump_version
+from core.utils.query_audit import audit_queries
 from django.contrib.auth.models import User
 from django.db import transaction
 from django.utils import timezone
@@ -32,8 +34,13 @@ def main():
     generate_products(100)  # 100个真实商品
     generate_orders_and_items(100000)  # 10000个真实订单
 
+    # bulk_create不触发模型信号，手动递增版本号使商品目录与客户缓存失效（订单经create()写入，由信号递增）
+    bump_version('product', 'category', 'product_category', 'customer')
+
     print("所有真实模拟数据生成完成！")
-    print_stats()
+    # 统计输出逐订单/逐商品查询，审计结果（N+1指纹与调用位置）输出到日志
+    with audit_queries('print_stats'):
+        print_stats()
 
 
 def clear_existing_data():